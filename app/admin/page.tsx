@@ -3,7 +3,7 @@
 import { useEffect, useState } from 'react';
 import { useRouter } from 'next/navigation';
 import Image from 'next/image';
-import { getApiUrl, API_CONFIG } from '@/lib/api-config';
+import { getApiUrl, getAuthHeaders, API_CONFIG } from '@/lib/api-config';
 
 interface HistoryEvent {
   invoiceNumber: string;
@@ -40,6 +40,7 @@ export default function AdminPage() {
   
   // User management state
   const [users, setUsers] = useState<User[]>([]);
+  const [hasMoreUsers, setHasMoreUsers] = useState(false);
   const [searchQuery, setSearchQuery] = useState('');
   const [loadingUsers, setLoadingUsers] = useState(false);
   const [selectedUser, setSelectedUser] = useState<User | null>(null);
@@ -79,7 +80,7 @@ export default function AdminPage() {
 
     try {
       const url = getApiUrl('/api/invoices/stats/summary');
-      const response = await fetch(url);
+      const response = await fetch(url, { headers: getAuthHeaders() });
 
       if (!response.ok) {
         throw new Error('Error al cargar estadísticas');
@@ -97,21 +98,25 @@ export default function AdminPage() {
   const handleLogout = () => {
     localStorage.removeItem('isAuthenticated');
     localStorage.removeItem('userEmail');
+    localStorage.removeItem('sessionToken');
     router.push('/login');
   };
 
-  const loadUsers = async () => {
+  const loadUsers = async (append = false) => {
     setLoadingUsers(true);
     try {
-      const url = getApiUrl(`/api/auth/users${searchQuery ? `?search=${encodeURIComponent(searchQuery)}` : ''}`);
-      const response = await fetch(url);
+      const params = new URLSearchParams({ skip: String(append ? users.length : 0) });
+      if (searchQuery) params.set('search', searchQuery);
+      const url = getApiUrl(`/api/auth/users?${params.toString()}`);
+      const response = await fetch(url, { headers: getAuthHeaders() });
 
       if (!response.ok) {
         throw new Error('Error al cargar usuarios');
       }
 
       const data = await response.json();
-      setUsers(data.users);
+      setUsers(append ? [...users, ...data.users] : data.users);
+      setHasMoreUsers(data.pagination?.hasMore ?? false);
     } catch (err) {
       console.error('Error loading users:', err);
     } finally {
@@ -130,6 +135,7 @@ export default function AdminPage() {
       const response = await fetch(url, {
         method: 'PUT',
         headers: {
+          ...getAuthHeaders(),
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({ role: newRole }),
@@ -158,6 +164,7 @@ export default function AdminPage() {
       const url = getApiUrl(`/api/auth/users/${userId}`);
       const response = await fetch(url, {
         method: 'DELETE',
+        headers: getAuthHeaders(),
       });
 
       if (!response.ok) {
@@ -559,6 +566,18 @@ export default function AdminPage() {
                   </table>
                 </div>
 
+                {hasMoreUsers && (
+                  <div className="text-center py-4">
+                    <button
+                      onClick={() => loadUsers(true)}
+                      disabled={loadingUsers}
+                      className="px-4 py-2 text-sm font-medium text-blue-600 dark:text-blue-400 hover:underline disabled:opacity-50"
+                    >
+                      Cargar más usuarios
+                    </button>
+                  </div>
+                )}
+
                 {users.length === 0 && (
                   <div className="text-center py-12">
                     <p className="text-zinc-500 dark:text-zinc-400">
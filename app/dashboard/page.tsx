@@ -24,6 +24,7 @@ export default function DashboardPage() {
   const handleLogout = () => {
     localStorage.removeItem('isAuthenticated');
     localStorage.removeItem('userEmail');
+    localStorage.removeItem('sessionToken');
     router.push('/login');
   };
 
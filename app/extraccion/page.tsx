@@ -3,7 +3,7 @@
 import { useState, useEffect } from 'react';
 import { useRouter } from 'next/navigation';
 import Image from 'next/image';
-import { getApiUrl, API_CONFIG } from '@/lib/api-config';
+import { getApiUrl, getAuthHeaders, API_CONFIG } from '@/lib/api-config';
 
 interface FacturaData {
   numeroFactura?: string;
@@ -24,6 +24,7 @@ interface FacturaData {
 
 interface InvoiceItem {
   file: File;
+  requestId: string; // Base de la cabecera Idempotency-Key (los reintentos no repiten el trabajo)
   previewUrl: string;
   extractedData: FacturaData | null;
   isProcessed: boolean;
@@ -89,8 +90,8 @@ export default function ExtraccionPage() {
     const newInvoices: InvoiceItem[] = [];
     const errors: string[] = [];
     const MAX_FILE_SIZE = 1 * 1024 * 1024; // 1MB
-    const validTypes = ['application/pdf', 'image/png', 'image/jpeg', 'image/jpg', 'image/webp'];
-    const validExtensions = ['.pdf', '.png', '.jpg', '.jpeg', '.webp'];
+    const validTypes = ['application/pdf', 'image/png', 'image/jpeg', 'image/jpg', 'image/webp', 'application/xml', 'text/xml'];
+    const validExtensions = ['.pdf', '.png', '.jpg', '.jpeg', '.webp', '.xml'];
 
     files.forEach(file => {
       // Validar nombre de archivo
@@ -126,6 +127,7 @@ export default function ExtraccionPage() {
       // Archivo válido
       newInvoices.push({
         file,
+        requestId: crypto.randomUUID(),
         previewUrl: URL.createObjectURL(file),
         extractedData: null,
         isProcessed: false,
@@ -190,6 +192,10 @@ export default function ExtraccionPage() {
         const apiUrl = getApiUrl(API_CONFIG.ENDPOINTS.EXTRACT_INVOICE);
         const response = await fetch(apiUrl, {
           method: 'POST',
+          headers: {
+            ...getAuthHeaders(),
+            'Idempotency-Key': `extract-${invoice.requestId}`,
+          },
           body: formData,
         });
 
@@ -238,6 +244,7 @@ export default function ExtraccionPage() {
   const handleLogout = () => {
     localStorage.removeItem('isAuthenticated');
     localStorage.removeItem('userEmail');
+    localStorage.removeItem('sessionToken');
     router.push('/login');
   };
 
@@ -319,19 +326,36 @@ export default function ExtraccionPage() {
       // Usar datos editados si existen, sino usar los extraídos
       const dataToSend = editedData || currentInvoice.extractedData;
       
-      // Crear FormData para enviar archivo + datos
-      const formData = new FormData();
-      formData.append('file', currentInvoice.file);
-      formData.append('invoice_data', JSON.stringify(dataToSend));
-      formData.append('validatedBy', userEmail);
-      formData.append('wasModified', wasModified.toString());
+      // El archivo ya se subió en la extracción: se envía su stagingToken en lugar del archivo
+      const stagingToken = currentInvoice.extractedData.stagingToken;
       
-      const apiUrl = getApiUrl(API_CONFIG.ENDPOINTS.VALIDATE_INVOICE);
+      const sendValidation = (withFile: boolean) => {
+        // Crear FormData para enviar archivo (o token) + datos
+        const formData = new FormData();
+        if (withFile) {
+          formData.append('file', currentInvoice.file);
+        } else {
+          formData.append('stagingToken', stagingToken);
+        }
+        formData.append('invoice_data', JSON.stringify(dataToSend));
+        formData.append('validatedBy', userEmail);
+        formData.append('wasModified', wasModified.toString());
+        
+        return fetch(getApiUrl(API_CONFIG.ENDPOINTS.VALIDATE_INVOICE), {
+          method: 'POST',
+          headers: {
+            ...getAuthHeaders(),
+            'Idempotency-Key': `validate-${currentInvoice.requestId}`,
+          },
+          body: formData, // No incluir Content-Type header, el navegador lo establece automáticamente con boundary
+        });
+      };
       
-      const response = await fetch(apiUrl, {
-        method: 'POST',
-        body: formData, // No incluir Content-Type header, el navegador lo establece automáticamente con boundary
-      });
+      let response = await sendValidation(!stagingToken);
+      if (response.status === 410) {
+        // El archivo en espera expiró: reenviar el archivo
+        response = await sendValidation(true);
+      }
 
       const data = await response.json();
 
@@ -436,7 +460,7 @@ export default function ExtraccionPage() {
                 <input
                   type="file"
                   id="file-upload"
-                  accept=".pdf,.png,.jpg,.jpeg,.webp"
+                  accept=".pdf,.png,.jpg,.jpeg,.webp,.xml"
                   multiple
                   onChange={handleFileChange}
                   className="hidden"
@@ -595,11 +619,11 @@ export default function ExtraccionPage() {
               ) : (
                 <div className="h-full flex flex-col">
                   <div className="flex-1 bg-white dark:bg-zinc-800 rounded border-2 border-zinc-200 dark:border-zinc-700 overflow-hidden">
-                    {currentInvoice.file.type === 'application/pdf' ? (
+                    {currentInvoice.file.type === 'application/pdf' || currentInvoice.file.type.endsWith('/xml') ? (
                       <iframe
                         src={currentInvoice.previewUrl}
                         className="w-full h-full"
-                        title="PDF Preview"
+                        title="Document Preview"
                       />
                     ) : (
                       <div className="w-full h-full flex items-center justify-center bg-zinc-100 dark:bg-zinc-900 p-4">
@@ -3,7 +3,7 @@
 import { useEffect, useState } from 'react';
 import { useRouter } from 'next/navigation';
 import Image from 'next/image';
-import { getApiUrl, API_CONFIG } from '@/lib/api-config';
+import { getApiUrl, getAuthHeaders, API_CONFIG } from '@/lib/api-config';
 
 interface Item {
   descripcion?: string;
@@ -52,6 +52,7 @@ interface Factura {
     validatedBy?: string;
     s3Url?: string;
     s3Key?: string;
+    thumbnailKey?: string;
   };
   rawData?: any;
 }
@@ -70,6 +71,7 @@ export default function FacturasPage() {
   const [isDeleting, setIsDeleting] = useState(false);
   const [signedImageUrl, setSignedImageUrl] = useState<string | null>(null);
   const [loadingImage, setLoadingImage] = useState(false);
+  const [signedUrls, setSignedUrls] = useState<Record<string, string>>({});
   const router = useRouter();
 
   useEffect(() => {
@@ -93,7 +95,7 @@ export default function FacturasPage() {
         : API_CONFIG.ENDPOINTS.LIST_INVOICES;
       const url = getApiUrl(endpoint);
       
-      const response = await fetch(url);
+      const response = await fetch(url, { headers: getAuthHeaders() });
       
       if (!response.ok) {
         throw new Error('Error al cargar facturas');
@@ -101,6 +103,7 @@ export default function FacturasPage() {
 
       const data = await response.json();
       setFacturas(data.data || []);
+      prefetchSignedUrls(data.data || []);
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Error al cargar facturas');
     } finally {
@@ -108,6 +111,36 @@ export default function FacturasPage() {
     }
   };
 
+  // Usar la miniatura WebP si existe; si no, el archivo original
+  const previewKey = (factura: Factura) =>
+    factura.metadata?.thumbnailKey || factura.metadata?.s3Key;
+
+  // Firmar todas las imágenes de la página en una sola petición
+  const prefetchSignedUrls = async (items: Factura[]) => {
+    const keys = items
+      .map(f => previewKey(f))
+      .filter((key): key is string => !!key);
+    if (keys.length === 0) return;
+
+    try {
+      const url = getApiUrl(API_CONFIG.ENDPOINTS.INVOICE_IMAGES_BATCH);
+      const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+          ...getAuthHeaders(),
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ keys }),
+      });
+      if (response.ok) {
+        const data = await response.json();
+        setSignedUrls(data.urls || {});
+      }
+    } catch (error) {
+      console.error('Error prefetching images:', error);
+    }
+  };
+
   const handleSearch = (e: React.FormEvent) => {
     e.preventDefault();
     loadFacturas(searchTerm);
@@ -116,6 +149,7 @@ export default function FacturasPage() {
   const handleLogout = () => {
     localStorage.removeItem('isAuthenticated');
     localStorage.removeItem('userEmail');
+    localStorage.removeItem('sessionToken');
     router.push('/login');
   };
 
@@ -126,12 +160,20 @@ export default function FacturasPage() {
     setSaveSuccess(false);
     setSignedImageUrl(null);
 
+    // Use prefetched signed URL if available
+    const key = previewKey(factura);
+    const prefetchedUrl = key ? signedUrls[key] : undefined;
+    if (prefetchedUrl) {
+      setSignedImageUrl(prefetchedUrl);
+      return;
+    }
+
     // Load signed URL if S3 key exists
-    if (factura.metadata.s3Key) {
+    if (key) {
       setLoadingImage(true);
       try {
-        const url = getApiUrl(`/api/invoices/image?key=${encodeURIComponent(factura.metadata.s3Key)}`);
-        const response = await fetch(url);
+        const url = getApiUrl(`/api/invoices/image?key=${encodeURIComponent(key)}`);
+        const response = await fetch(url, { headers: getAuthHeaders() });
         if (response.ok) {
           const data = await response.json();
           setSignedImageUrl(data.url);
@@ -166,6 +208,7 @@ export default function FacturasPage() {
       const url = getApiUrl(API_CONFIG.ENDPOINTS.DELETE_INVOICE(editedData._id));
       const response = await fetch(url, {
         method: 'DELETE',
+        headers: getAuthHeaders(),
       });
 
       if (!response.ok) {
@@ -239,6 +282,7 @@ export default function FacturasPage() {
       const response = await fetch(url, {
         method: 'PUT',
         headers: {
+          ...getAuthHeaders(),
           'Content-Type': 'application/json',
         },
         body: JSON.stringify(editedData),
@@ -531,7 +575,7 @@ export default function FacturasPage() {
                           </svg>
                         </div>
                       ) : signedImageUrl ? (
-                        editedData.metadata.fileName.toLowerCase().endsWith('.pdf') ? (
+                        !editedData.metadata.thumbnailKey && editedData.metadata.fileName.toLowerCase().endsWith('.pdf') ? (
                           <iframe
                             src={signedImageUrl}
                             className="w-full h-[calc(100vh-300px)]"
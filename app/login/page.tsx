@@ -103,6 +103,7 @@ export default function LoginPage() {
       localStorage.setItem('userName', data.user.name);
       localStorage.setItem('userId', data.user.id.toString());
       localStorage.setItem('userRole', data.user.role);
+      localStorage.setItem('sessionToken', data.token);
       console.log('✅ [FRONTEND] Session saved successfully');
       
       // Redirect to dashboard
@@ -0,0 +1,88 @@
+"""
+Generar miniaturas de vista previa para facturas existentes
+
+Busca facturas con archivo en S3 y sin metadata.thumbnailKey, descarga el
+original, genera la miniatura WebP en el pool de procesos y la sube bajo
+el prefijo thumbnails/.
+
+Uso:
+    python backfill_thumbnails.py [--limit N] [--concurrency N]
+"""
+import argparse
+import asyncio
+from database.mongodb import connect_to_mongo, close_mongo_connection, get_collection
+from services.raster_pool import shutdown_raster_pool
+from services.thumbnail_service import ThumbnailService
+
+async def backfill(limit: int = 0, concurrency: int = 4) -> int:
+    print('🔄 Generando miniaturas faltantes...')
+    await connect_to_mongo()
+    
+    try:
+        thumbnail_service = ThumbnailService()
+        s3_service = thumbnail_service.s3_service
+        if not s3_service.client:
+            print('❌ S3 no está configurado')
+            return 1
+        
+        collection = get_collection("invoices")
+        query = {
+            "metadata.s3Key": {"$exists": True, "$ne": None},
+            "metadata.thumbnailKey": {"$exists": False}
+        }
+        total = await collection.count_documents(query)
+        print(f'📋 Facturas sin miniatura: {total}')
+        
+        semaphore = asyncio.Semaphore(concurrency)
+        results = {"ok": 0, "failed": 0}
+        
+        async def process(invoice):
+            async with semaphore:
+                invoice_id = str(invoice["_id"])
+                s3_key = invoice["metadata"]["s3Key"]
+                try:
+                    response = await asyncio.to_thread(
+                        s3_service.client.get_object,
+                        Bucket=s3_service.bucket_name,
+                        Key=s3_key
+                    )
+                    file_content = await asyncio.to_thread(response['Body'].read)
+                    mime_type = invoice["metadata"].get("mimeType") or response.get('ContentType')
+                except Exception as error:
+                    results["failed"] += 1
+                    print(f'  ⚠️  {invoice_id}: no se pudo descargar {s3_key}: {error}')
+                    return
+                
+                thumbnail_key = await thumbnail_service.generate_for_invoice(invoice_id, file_content, mime_type, s3_key)
+                if thumbnail_key:
+                    results["ok"] += 1
+                    print(f'  ✅ {invoice_id}: {thumbnail_key}')
+                else:
+                    results["failed"] += 1
+        
+        cursor = collection.find(query, {"metadata.s3Key": 1, "metadata.mimeType": 1})
+        if limit:
+            cursor = cursor.limit(limit)
+        
+        tasks = []
+        async for invoice in cursor:
+            tasks.append(asyncio.create_task(process(invoice)))
+            # Evitar acumular demasiadas tareas pendientes en memoria
+            if len(tasks) >= concurrency * 10:
+                await asyncio.gather(*tasks)
+                tasks = []
+        await asyncio.gather(*tasks)
+        
+        print(f'\n🎉 Miniaturas generadas: {results["ok"]} | Errores: {results["failed"]}')
+        return 0 if results["failed"] == 0 else 1
+    
+    finally:
+        shutdown_raster_pool()
+        await close_mongo_connection()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generar miniaturas de vista previa faltantes")
+    parser.add_argument('--limit', type=int, default=0, help="Máximo de facturas a procesar (0 = todas)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Facturas procesadas en paralelo")
+    args = parser.parse_args()
+    exit(asyncio.run(backfill(limit=args.limit, concurrency=args.concurrency)))
@@ -0,0 +1,111 @@
+"""
+Extraer un backlog de facturas con la Batch API de OpenAI
+
+Para respaldos y cargas nocturnas que no necesitan respuesta inmediata: los
+documentos se encolan, se envían en batches (mitad de precio y límites
+propios, separados de la extracción interactiva), y al terminar cada batch
+las facturas se guardan pendientes de revisión. Los CFDI XML y las facturas
+con plantilla se resuelven sin llamar a OpenAI.
+
+Uso:
+    python batch_extract.py enqueue RUTA [RUTA ...]   # archivos o carpetas (recursivo)
+    python batch_extract.py enqueue --s3-prefix PREFIJO
+    python batch_extract.py submit
+    python batch_extract.py poll
+    python batch_extract.py run [--interval SEGUNDOS]  # enviar y consultar hasta vaciar la cola
+    python batch_extract.py status
+"""
+import argparse
+import asyncio
+import json
+from pathlib import Path
+from config import settings
+from database.mongodb import connect_to_mongo, close_mongo_connection
+from services.batch_service import BATCH_MIME_TYPES, BatchService, iter_backlog_files
+from services.raster_pool import shutdown_raster_pool
+
+async def enqueue(service: BatchService, paths, s3_prefix: str = None) -> int:
+    results = {"queued": 0, "skipped": 0, "failed": 0}
+
+    async def add(file_content: bytes, file_name: str, source: dict):
+        try:
+            queue_id = await service.enqueue(file_content, file_name, source)
+        except ValueError as error:
+            results["failed"] += 1
+            print(f'  ⚠️  {file_name}: {error}')
+            return
+        results["queued" if queue_id else "skipped"] += 1
+
+    for path in iter_backlog_files(paths):
+        file_content = await asyncio.to_thread(Path(path).read_bytes)
+        await add(file_content, path, {"path": str(Path(path).resolve())})
+
+    if s3_prefix is not None:
+        s3_service = service.s3_service
+        if not s3_service.client:
+            print('❌ S3 no está configurado')
+            return 1
+        pages = s3_service.iter_object_pages(s3_prefix)
+        while (page := await asyncio.to_thread(next, pages, None)) is not None:
+            for obj in page:
+                if not obj['Key'].lower().endswith(tuple(BATCH_MIME_TYPES)):
+                    continue
+                response = await asyncio.to_thread(s3_service.client.get_object, Bucket=s3_service.bucket_name, Key=obj['Key'])
+                file_content = await asyncio.to_thread(response['Body'].read)
+                await add(file_content, obj['Key'].rsplit('/', 1)[-1], {"s3Key": obj['Key']})
+
+    print(f'📥 Encolados: {results["queued"]} | Ya encolados o guardados: {results["skipped"]} | Errores: {results["failed"]}')
+    return 0 if results["failed"] == 0 else 1
+
+async def run(service: BatchService, interval: int) -> int:
+    """Enviar y consultar hasta que no queden documentos en cola ni batches pendientes"""
+    while True:
+        batches = await service.submit()
+        if batches:
+            print(f'📦 Batches enviados: {", ".join(batches)}')
+        counts = await service.poll()
+        if any(counts.values()):
+            print(f'📬 Resultados: {counts}')
+        if not await service.has_pending():
+            break
+        await asyncio.sleep(interval)
+    return await status(service)
+
+async def status(service: BatchService) -> int:
+    print(json.dumps(await service.get_status(), indent=2, ensure_ascii=False))
+    return 0
+
+async def main(args) -> int:
+    await connect_to_mongo()
+    try:
+        service = BatchService()
+        await service.ensure_indexes()
+        if args.command == 'enqueue':
+            return await enqueue(service, args.paths, args.s3_prefix)
+        if args.command == 'submit':
+            batches = await service.submit()
+            print(f'📦 Batches enviados: {len(batches)} {batches}')
+            return 0
+        if args.command == 'poll':
+            print(f'📬 Resultados: {await service.poll()}')
+            return 0
+        if args.command == 'run':
+            return await run(service, args.interval)
+        return await status(service)
+    finally:
+        shutdown_raster_pool()
+        await close_mongo_connection()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Extraer un backlog de facturas con la Batch API de OpenAI")
+    commands = parser.add_subparsers(dest='command', required=True)
+    enqueue_parser = commands.add_parser('enqueue', help="Encolar archivos locales o de S3")
+    enqueue_parser.add_argument('paths', nargs='*', help="Archivos o carpetas")
+    enqueue_parser.add_argument('--s3-prefix', default=None, help="Encolar los objetos del bucket bajo este prefijo")
+    commands.add_parser('submit', help="Enviar los documentos en cola")
+    commands.add_parser('poll', help="Aplicar los resultados de los batches terminados")
+    run_parser = commands.add_parser('run', help="Enviar y consultar hasta vaciar la cola")
+    run_parser.add_argument('--interval', type=int, default=settings.BATCH_POLL_SECONDS, help="Segundos entre consultas")
+    commands.add_parser('status', help="Documentos por estado y batches pendientes")
+    args = parser.parse_args()
+    exit(asyncio.run(main(args)))
@@ -0,0 +1,79 @@
+"""Utilidades compartidas por los benchmarks"""
+import os
+import socket
+import statistics
+import subprocess
+import threading
+import time
+from typing import Dict, List
+
+def set_default_env():
+    """Valores mínimos para poder importar config.settings sin un .env real"""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize_latencies(latencies: List[float], elapsed: float, errors: int = 0) -> Dict[str, float]:
+    """Resumen de latencias en milisegundos y throughput en peticiones/segundo"""
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed > 0 else 0.0,
+        "mean_ms": round(statistics.fmean(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+def git_revision() -> str:
+    """Commit actual, para comparar resultados entre commits"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL,
+            text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+def free_port() -> int:
+    """Puerto TCP libre en localhost"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class ServerThread:
+    """Servidor uvicorn en un hilo propio (con su propio event loop)"""
+    
+    def __init__(self, app, port: int = None, host: str = "127.0.0.1"):
+        import uvicorn
+        
+        self.host = host
+        self.port = port or free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+    
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+    
+    def start(self, timeout: float = 30) -> "ServerThread":
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError(f"El servidor en {self.url} no arrancó")
+            time.sleep(0.05)
+        return self
+    
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
@@ -0,0 +1,281 @@
+"""
+Benchmark de precisión y latencia de la extracción sobre el corpus local
+
+Corre cada modo de extracción de OpenAIService sobre las facturas del corpus
+(benchmarks/corpus.py) y compara campo por campo contra el ground truth.
+Junto a la precisión reporta latencia total, tiempo en la API, overhead
+propio (rasterizado, codificación, parseo), bytes enviados y tokens.
+
+Modos:
+    image   imagen enviada a Vision (admite preprocesado: --max-side, --jpeg-quality)
+    pdf     la misma factura como PDF, rasterizado antes de enviarlo
+
+Uso (desde backend/):
+    python -m benchmarks.bench_accuracy [--modes image,pdf] [--limit 20] [--concurrency 4] [--output resultado.json]
+    python -m benchmarks.bench_accuracy --modes image --tiers gpt-4o --tiers gpt-4o-mini,gpt-4o
+
+Con --tiers se compara el ruteo de modelos: cada --tiers es una lista de
+modelos (p. ej. "gpt-4o" contra "gpt-4o-mini,gpt-4o") y se reporta la tasa
+de escalamiento, el modelo que resolvió cada factura y la diferencia de
+latencia y precisión contra la primera configuración.
+
+Usa la API real de OpenAI (OPENAI_API_KEY) o el servidor indicado en OPENAI_BASE_URL.
+Con --replay-mode record se graban las respuestas en --replay-dir; con
+--replay-mode replay se reproducen sin red, de modo que la latencia medida
+es solo el overhead propio del pipeline (o la grabada, con --replay-latency 1).
+"""
+import argparse
+import asyncio
+import difflib
+import io
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from benchmarks._common import set_default_env, summarize_latencies, git_revision
+from benchmarks.corpus import CORPUS_DIR, load_corpus, parse_amount
+
+TEXT_FIELDS = ["numeroFactura", "proveedor.nombre", "proveedor.rfc", "cliente.nombre", "cliente.rfc"]
+NUMBER_FIELDS = ["subtotal", "iva", "total"]
+FIELDS = TEXT_FIELDS + ["fecha"] + NUMBER_FIELDS + ["items.count", "items.total"]
+
+_NON_ALNUM = re.compile(r"[\W_]+", re.UNICODE)
+
+def _get(data: Dict[str, Any], path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+def _normalize_text(value: Any) -> str:
+    return _NON_ALNUM.sub("", str(value).casefold())
+
+def text_matches(expected: Any, actual: Any) -> bool:
+    """Igualdad ignorando mayúsculas, espacios y puntuación (tolera errores menores de OCR)"""
+    if actual is None:
+        return False
+    expected, actual = _normalize_text(expected), _normalize_text(actual)
+    return expected == actual or difflib.SequenceMatcher(None, expected, actual).ratio() >= 0.9
+
+def number_matches(expected: float, actual: Any) -> bool:
+    actual = parse_amount(actual)
+    if actual is None:
+        return False
+    return abs(expected - actual) <= max(0.01, abs(expected) * 0.005)
+
+def score_invoice(expected: Dict[str, Any], actual: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """
+    Puntaje por campo entre 0 y 1 (None si el ground truth no tiene el campo)
+
+    items.total es la fracción de totales de conceptos esperados que aparecen
+    en la extracción.
+    """
+    scores = {}
+    for field in TEXT_FIELDS:
+        value = _get(expected, field)
+        scores[field] = None if not value else float(text_matches(value, _get(actual, field)))
+
+    scores["fecha"] = None if not expected.get("fecha") else float(expected["fecha"] == actual.get("fecha"))
+
+    for field in NUMBER_FIELDS:
+        value = expected.get(field)
+        scores[field] = None if value is None else float(number_matches(value, actual.get(field)))
+
+    expected_items = expected.get("items") or []
+    actual_items = actual.get("items") or []
+    if expected_items:
+        scores["items.count"] = float(len(expected_items) == len(actual_items))
+        remaining = [item.get("total") for item in actual_items if isinstance(item, dict)]
+        matched = 0
+        for item in expected_items:
+            if item.get("total") is None:
+                continue
+            hit = next((i for i, value in enumerate(remaining) if number_matches(item["total"], value)), None)
+            if hit is not None:
+                matched += 1
+                remaining.pop(hit)
+        with_total = sum(1 for item in expected_items if item.get("total") is not None)
+        scores["items.total"] = matched / with_total if with_total else None
+    else:
+        scores["items.count"] = None
+        scores["items.total"] = None
+    return scores
+
+def preprocess_image(content: bytes, max_side: Optional[int], jpeg_quality: Optional[int]) -> tuple:
+    """Reducir y/o recomprimir la imagen antes de enviarla; devuelve (bytes, mime_type)"""
+    if not max_side and not jpeg_quality:
+        return content, "image/png"
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(content))
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    buffer = io.BytesIO()
+    if jpeg_quality:
+        image.convert("RGB").save(buffer, format="JPEG", quality=jpeg_quality, optimize=True)
+        return buffer.getvalue(), "image/jpeg"
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue(), "image/png"
+
+async def run_image(service, sample: dict, options: dict) -> Dict[str, Any]:
+    content, mime_type = preprocess_image(sample["png"].read_bytes(), options.get("max_side"), options.get("jpeg_quality"))
+    return await service.extract_from_image(content, mime_type)
+
+async def run_pdf(service, sample: dict, options: dict) -> Dict[str, Any]:
+    return await service.extract_from_pdf(sample["pdf"].read_bytes(), sample["pdf"].name)
+
+MODES = {
+    "image": run_image,
+    "pdf": run_pdf,
+}
+
+async def run_sample(mode: str, sample: dict, options: dict) -> dict:
+    from services.openai_service import OpenAIService
+
+    service = OpenAIService(model_tiers=options.get("model_tiers"))
+    record = {"id": sample["id"], "mode": mode, "error": None}
+    start = time.perf_counter()
+    try:
+        actual = await MODES[mode](service, sample, options)
+    except Exception as e:
+        actual = {}
+        record["error"] = str(e)
+    record["latency_s"] = time.perf_counter() - start
+    record["api_s"] = service.usage["api_seconds"]
+    record["overhead_s"] = max(0.0, record["latency_s"] - record["api_s"])
+    record["request_bytes"] = service.usage["request_bytes"]
+    record["tokens"] = service.usage["total_tokens"]
+    record["model"] = service.model_used
+    record["escalations"] = service.usage["escalations"]
+    record["scores"] = score_invoice(sample["expected"], actual)
+    return record
+
+def summarize_mode(records: List[dict], elapsed: float) -> dict:
+    accuracy = {}
+    for field in FIELDS:
+        values = [r["scores"][field] for r in records if r["scores"][field] is not None]
+        accuracy[field] = round(sum(values) / len(values), 4) if values else None
+    field_values = [value for value in accuracy.values() if value is not None]
+    count = len(records) or 1
+    models = {}
+    for r in records:
+        models[r["model"] or "error"] = models.get(r["model"] or "error", 0) + 1
+    return {
+        "samples": len(records),
+        "errors": sum(1 for r in records if r["error"]),
+        "accuracy": accuracy,
+        "accuracy_mean": round(sum(field_values) / len(field_values), 4) if field_values else None,
+        "latency": summarize_latencies([r["latency_s"] for r in records], elapsed),
+        "overhead": summarize_latencies([r["overhead_s"] for r in records], elapsed),
+        "request_bytes_mean": round(sum(r["request_bytes"] for r in records) / count),
+        "tokens_mean": round(sum(r["tokens"] for r in records) / count, 1),
+        "escalation_rate": round(sum(1 for r in records if r["escalations"]) / count, 4),
+        "models": models,
+    }
+
+def compare_runs(baseline: dict, candidate: dict) -> dict:
+    """Diferencia de latencia, tokens y precisión de una configuración contra la base, por modo"""
+    comparison = {}
+    for mode, result in candidate.items():
+        base, cand = baseline[mode]["summary"], result["summary"]
+        comparison[mode] = {
+            "latency_mean_ms": round(cand["latency"]["mean_ms"] - base["latency"]["mean_ms"], 1),
+            "latency_p50_ms": round(cand["latency"]["p50_ms"] - base["latency"]["p50_ms"], 1),
+            "latency_p95_ms": round(cand["latency"]["p95_ms"] - base["latency"]["p95_ms"], 1),
+            "tokens_mean": round(cand["tokens_mean"] - base["tokens_mean"], 1),
+            "accuracy_mean": (
+                round(cand["accuracy_mean"] - base["accuracy_mean"], 4)
+                if cand["accuracy_mean"] is not None and base["accuracy_mean"] is not None else None
+            ),
+            "escalation_rate": cand["escalation_rate"],
+        }
+    return comparison
+
+async def run_benchmark(modes: List[str], samples: List[dict], options: dict, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def guarded(mode, sample):
+        async with semaphore:
+            # Las llamadas a OpenAI son síncronas: cada muestra corre en su propio hilo
+            return await asyncio.to_thread(asyncio.run, run_sample(mode, sample, options))
+
+    results = {}
+    for mode in modes:
+        start = time.perf_counter()
+        records = await asyncio.gather(*(guarded(mode, sample) for sample in samples))
+        results[mode] = {
+            "summary": summarize_mode(records, time.perf_counter() - start),
+            "samples": records,
+        }
+    return results
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Precisión y latencia de la extracción sobre el corpus local")
+    parser.add_argument('--modes', default="image,pdf", help=f"Modos a evaluar ({', '.join(MODES)})")
+    parser.add_argument('--split', default="test")
+    parser.add_argument('--corpus-dir', type=Path, default=CORPUS_DIR)
+    parser.add_argument('--limit', type=int, default=None, help="Máximo de facturas del corpus")
+    parser.add_argument('--concurrency', type=int, default=4, help="Extracciones simultáneas")
+    parser.add_argument('--max-side', type=int, default=None, help="Reducir imágenes a este lado máximo (px)")
+    parser.add_argument('--jpeg-quality', type=int, default=None, help="Recomprimir imágenes como JPEG con esta calidad")
+    parser.add_argument('--tiers', action='append', default=None,
+                        help="Modelos en orden de escalamiento, separados por comas (repetible para comparar)")
+    parser.add_argument('--replay-mode', choices=["record", "replay", "auto"], default=None,
+                        help="Grabar o reproducir las respuestas de OpenAI")
+    parser.add_argument('--replay-dir', default=str(Path(__file__).parent / ".replay"),
+                        help="Carpeta de respuestas grabadas")
+    parser.add_argument('--replay-latency', type=float, default=0.0,
+                        help="Fracción de la latencia grabada a esperar en replay (0 = sin espera)")
+    parser.add_argument('--details', action='store_true', help="Incluir el resultado de cada muestra")
+    parser.add_argument('--output', help="Guardar el resultado JSON en este archivo")
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(",")]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"Modos desconocidos: {', '.join(unknown)}")
+
+    if args.replay_mode:
+        os.environ["OPENAI_REPLAY_MODE"] = args.replay_mode
+        os.environ["OPENAI_REPLAY_DIR"] = args.replay_dir
+        os.environ["OPENAI_REPLAY_LATENCY_SCALE"] = str(args.replay_latency)
+    set_default_env()
+    logging.disable(logging.WARNING)
+
+    samples = load_corpus(args.split, args.limit, args.corpus_dir)
+    tier_configs = [[model.strip() for model in tiers.split(",")] for tiers in args.tiers] if args.tiers else [None]
+    runs = []
+    for model_tiers in tier_configs:
+        options = {"max_side": args.max_side, "jpeg_quality": args.jpeg_quality, "model_tiers": model_tiers}
+        results = asyncio.run(run_benchmark(modes, samples, options, args.concurrency))
+        runs.append({"model_tiers": model_tiers, "modes": results})
+
+    report = {
+        "benchmark": "accuracy",
+        "revision": git_revision(),
+        "params": vars(args),
+        "runs": runs,
+    }
+    if len(runs) > 1:
+        # Diferencias contra la primera configuración (negativo = menos latencia/tokens)
+        report["comparison"] = [
+            {"model_tiers": run["model_tiers"], "vs": runs[0]["model_tiers"], "modes": compare_runs(runs[0]["modes"], run["modes"])}
+            for run in runs[1:]
+        ]
+    if not args.details:
+        for run in runs:
+            for result in run["modes"].values():
+                result.pop("samples")
+
+    output = json.dumps(report, indent=2, default=str)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == '__main__':
+    main_cli()
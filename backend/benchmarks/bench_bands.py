@@ -0,0 +1,153 @@
+"""
+Benchmark de la extracción en franjas de tablas de conceptos largas
+
+Genera la imagen de una factura con N conceptos, levanta el servidor falso
+de OpenAI con esos mismos N conceptos y latencia proporcional a los tokens
+de la respuesta (--ms-per-token), y extrae la imagen con OpenAIService con
+VISION_BANDS_ENABLED apagado y encendido. Reporta la latencia de cada
+modo, las llamadas hechas, las franjas detectadas y si los conceptos
+unidos coinciden con los originales (sin repetidos ni faltantes). También
+une franjas de una tabla de filas idénticas (--repeated-rows) y comprueba
+que a lo más se pierden las filas de traslape de cada borde.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_bands [--items 20,60,120] [--ms-per-token 15] [--latency-ms 400] [--repeat 3] [--repeated-rows 24]
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import statistics
+import time
+from typing import Dict, List
+from benchmarks._common import ServerThread, set_default_env, git_revision
+
+def render_invoice(items: List[dict]) -> bytes:
+    """PNG de una factura simple: encabezado, una fila por concepto y totales"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    font = ImageFont.load_default(size=22)
+    pitch = 34
+    height = 420 + pitch * (len(items) + 1) + 260
+    page = Image.new("RGB", (1700, height), "white")
+    draw = ImageDraw.Draw(page)
+    header = [
+        "FACTURA A-1024                                  Fecha: 2024-03-15",
+        "Papelería del Centro SA de CV                   RFC: PCE010203AB1",
+        "Av. Juárez 100, CDMX",
+        "Cliente: Comercializadora Norte SA de CV        RFC: CNO040506CD2",
+        "Forma de pago: 03 - Transferencia               Método de pago: PUE",
+    ]
+    for line, text in enumerate(header):
+        draw.text((100, 100 + line * pitch), text, fill="black", font=font)
+
+    top = 420
+    for x in (90, 900, 1100, 1350, 1610):
+        # Reglas verticales de la tabla (no deben unir las filas en una sola línea)
+        draw.line((x, top - 6, x, top + pitch * (len(items) + 1)), fill="black", width=2)
+    for x, title in ((100, "Descripción"), (910, "Cantidad"), (1110, "P. unitario"), (1360, "Importe")):
+        draw.text((x, top), title, fill="black", font=font)
+    for row, item in enumerate(items, start=1):
+        y = top + row * pitch
+        draw.text((100, y), item["descripcion"], fill="black", font=font)
+        draw.text((910, y), f"{item['cantidad']:g}", fill="black", font=font)
+        draw.text((1110, y), f"{item['precioUnitario']:,.2f}", fill="black", font=font)
+        draw.text((1360, y), f"{item['total']:,.2f}", fill="black", font=font)
+
+    footer = top + pitch * (len(items) + 2)
+    for line, text in enumerate(("Subtotal", "IVA 16%", "Total")):
+        draw.text((1110, footer + line * pitch), text, fill="black", font=font)
+    buffer = io.BytesIO()
+    page.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+async def run_size(count: int, args) -> Dict[str, object]:
+    from benchmarks.fake_openai import build_invoice, create_fake_openai_app
+    from config import settings
+    from services.openai_service import OpenAIService
+    from services.raster_pool import shutdown_raster_pool
+
+    expected = build_invoice(count)["items"]
+    image = render_invoice(expected)
+    fake = create_fake_openai_app(
+        latency_ms=args.latency_ms, latency_sigma=0, seed=1, items=count, ms_per_token=args.ms_per_token
+    )
+    server = ServerThread(fake).start()
+    settings.OPENAI_BASE_URL = f"{server.url}/v1"
+    result = {"items": count}
+    try:
+        for mode, enabled in (("single", False), ("bands", True)):
+            settings.VISION_BANDS_ENABLED = enabled
+            latencies = []
+            for _ in range(args.repeat):
+                service = OpenAIService(model_tiers=["gpt-4o"])
+                start = time.perf_counter()
+                data = await service.extract_from_image(image, "image/png")
+                latencies.append(time.perf_counter() - start)
+            extracted = [(item["descripcion"], item["total"]) for item in data.get("items", [])]
+            result[mode] = {
+                "median_ms": round(statistics.median(latencies) * 1000, 1),
+                "calls": service.usage["requests"],
+                "completion_tokens": service.usage["completion_tokens"],
+                "items": len(extracted),
+                "items_match": extracted == [(item["descripcion"], item["total"]) for item in expected],
+            }
+        result["speedup"] = round(result["single"]["median_ms"] / result["bands"]["median_ms"], 2)
+    finally:
+        server.stop()
+        shutdown_raster_pool()
+    return result
+
+def check_repeated_rows(rows: int, band_count: int) -> Dict[str, object]:
+    """Unir franjas de una tabla con todas las filas iguales (p. ej. "Renta mensual" cada mes)"""
+    from benchmarks.fake_openai import band_items
+    from config import settings
+    from services.page_bands import merge_band_items
+
+    items = [{"descripcion": "Renta mensual", "cantidad": 1, "precioUnitario": 1000.0, "total": 1000.0} for _ in range(rows)]
+    bands = [band_items(items, number, band_count) for number in range(1, band_count + 1)]
+    merged = merge_band_items([[dict(item) for item in band] for band in bands], settings.VISION_BAND_OVERLAP_LINES)
+    max_lost = settings.VISION_BAND_OVERLAP_LINES * (band_count - 1)
+    return {
+        "rows": rows,
+        "bands": band_count,
+        "merged": len(merged),
+        "max_lost": max_lost,
+        "within_overlap": rows - max_lost <= len(merged) <= rows,
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Extracción en franjas de tablas de conceptos largas")
+    parser.add_argument('--items', default="20,60,120", help="Cantidades de conceptos a medir, separadas por comas")
+    parser.add_argument('--ms-per-token', type=float, default=15, help="Latencia del servidor falso por token de respuesta")
+    parser.add_argument('--latency-ms', type=float, default=400, help="Latencia fija del servidor falso por petición")
+    parser.add_argument('--band-lines', type=int, default=None, help="VISION_BAND_LINES (default: el de config)")
+    parser.add_argument('--repeat', type=int, default=3, help="Extracciones por modo (se reporta la mediana)")
+    parser.add_argument('--repeated-rows', type=int, default=24, help="Filas idénticas de la tabla para revisar la unión de franjas")
+    parser.add_argument('--output', help="Guardar el resultado JSON en este archivo")
+    args = parser.parse_args()
+
+    set_default_env()
+    logging.disable(logging.WARNING)
+    from config import settings
+    settings.PREPASS_ENABLED = False
+    if args.band_lines:
+        settings.VISION_BAND_LINES = args.band_lines
+
+    sizes = [int(count) for count in args.items.split(",")]
+    report = {
+        "benchmark": "bands",
+        "revision": git_revision(),
+        "params": vars(args),
+        "results": [asyncio.run(run_size(count, args)) for count in sizes],
+        "repeated_rows": [check_repeated_rows(args.repeated_rows, band_count) for band_count in (2, 4)],
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,139 @@
+"""
+Benchmark de throughput de login bajo carga concurrente
+
+Crea una base de usuarios temporal, lanza una "tormenta" de logins contra
+/api/auth/login dentro del mismo proceso (ASGI) y, en paralelo, mide la
+latencia de peticiones ligeras (/health) que comparten el event loop. Si las
+consultas a SQLite bloquean el loop, la latencia de /health se dispara.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_login [--users N] [--requests N] [--concurrency N] [--pool-size N] [--output archivo.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from benchmarks._common import set_default_env, summarize_latencies, git_revision
+
+USERS_SCHEMA = """
+CREATE TABLE users (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  name TEXT NOT NULL,
+  email TEXT UNIQUE NOT NULL,
+  password TEXT NOT NULL,
+  role TEXT DEFAULT 'user' CHECK(role IN ('user', 'admin')),
+  is_active INTEGER DEFAULT 1,
+  created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+def create_users_db(path: str, num_users: int):
+    """Crear una base de usuarios de prueba con num_users registros"""
+    conn = sqlite3.connect(path)
+    conn.execute(USERS_SCHEMA)
+    conn.executemany(
+        "INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)",
+        (
+            (f"Usuario {i}", f"user{i}@example.com", f"password{i}", "admin" if i % 50 == 0 else "user")
+            for i in range(num_users)
+        )
+    )
+    conn.commit()
+    conn.close()
+
+async def run_benchmark(num_users: int, total_requests: int, concurrency: int) -> dict:
+    import httpx
+    import main
+    
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        login_latencies = []
+        probe_latencies = []
+        errors = 0
+        storm_done = asyncio.Event()
+        queue = asyncio.Queue()
+        for _ in range(total_requests):
+            queue.put_nowait(random.randrange(num_users))
+        
+        async def login_worker():
+            nonlocal errors
+            while True:
+                try:
+                    user_index = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                start = time.perf_counter()
+                response = await client.post("/api/auth/login", json={
+                    "email": f"user{user_index}@example.com",
+                    "password": f"password{user_index}"
+                })
+                login_latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+        
+        async def probe():
+            # Simula peticiones de facturas que comparten el worker con la tormenta
+            while not storm_done.is_set():
+                start = time.perf_counter()
+                await client.get("/health")
+                probe_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.005)
+        
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(login_worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        storm_done.set()
+        await probe_task
+    
+    return {
+        "login": summarize_latencies(login_latencies, elapsed, errors),
+        "health_during_storm": summarize_latencies(probe_latencies, elapsed),
+        "elapsed_s": round(elapsed, 3),
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark de login concurrente contra SQLite")
+    parser.add_argument('--users', type=int, default=10000, help="Usuarios en la base temporal")
+    parser.add_argument('--requests', type=int, default=5000, help="Logins totales")
+    parser.add_argument('--concurrency', type=int, default=100, help="Logins simultáneos")
+    parser.add_argument('--pool-size', type=int, default=None, help="SQLITE_POOL_SIZE a usar")
+    parser.add_argument('--output', help="Guardar el resultado JSON en este archivo")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "users.db")
+        create_users_db(db_path, args.users)
+        
+        # Configurar antes de importar la aplicación
+        set_default_env()
+        os.environ["USERS_DB_PATH"] = db_path
+        if args.pool_size:
+            os.environ["SQLITE_POOL_SIZE"] = str(args.pool_size)
+        
+        import logging
+        logging.disable(logging.INFO)
+        
+        result = asyncio.run(run_benchmark(args.users, args.requests, args.concurrency))
+        result.update({
+            "benchmark": "login",
+            "revision": git_revision(),
+            "params": vars(args),
+        })
+        
+        from database.sqlite import close_user_db
+        close_user_db()
+    
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == '__main__':
+    main_cli()
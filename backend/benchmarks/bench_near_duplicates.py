@@ -0,0 +1,49 @@
+"""
+Benchmark del índice de casi-duplicados (pytest-benchmark)
+
+Mide la búsqueda por distancia de Hamming de HammingIndex con 10k, 100k y
+1M hashes guardados, para un hash que tiene un vecino cercano y para uno
+que no tiene ninguno (el caso de toda factura nueva).
+
+Uso (desde backend/):
+    pip install -r benchmarks/requirements.txt
+    python -m pytest benchmarks/bench_near_duplicates.py --benchmark-only
+"""
+import random
+import pytest
+from services.near_duplicate_service import HammingIndex
+
+MAX_DISTANCE = 4
+
+_indexes = {}
+
+def build_index(size: int) -> tuple:
+    """Índice con size hashes aleatorios (cacheado entre pruebas) y los hashes guardados"""
+    if size not in _indexes:
+        rng = random.Random(size)
+        index = HammingIndex(MAX_DISTANCE)
+        hashes = [rng.getrandbits(64) for _ in range(size)]
+        for position, value in enumerate(hashes):
+            index.add(value, str(position))
+        _indexes[size] = (index, hashes)
+    return _indexes[size]
+
+def flip_bits(value: int, bits: int, rng: random.Random) -> int:
+    for bit in rng.sample(range(64), bits):
+        value ^= 1 << bit
+    return value
+
+@pytest.mark.parametrize("size", [10_000, 100_000, 1_000_000])
+def test_find_near_duplicate(benchmark, size):
+    index, hashes = build_index(size)
+    rng = random.Random(0)
+    target = rng.randrange(size)
+    query = flip_bits(hashes[target], MAX_DISTANCE, rng)
+    match = benchmark(index.find, query)
+    assert match is not None and match[1] <= MAX_DISTANCE
+
+@pytest.mark.parametrize("size", [10_000, 100_000, 1_000_000])
+def test_find_miss(benchmark, size):
+    index, _ = build_index(size)
+    query = random.Random(1).getrandbits(64)
+    benchmark(index.find, query)
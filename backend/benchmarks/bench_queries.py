@@ -0,0 +1,192 @@
+"""
+Benchmark de consultas de InvoiceService a escala (100k, 1M, 10M facturas)
+
+Para cada escala completa la colección con benchmarks.generate_invoices,
+mide la latencia de cada método de InvoiceService (a través del cliente Motor
+real) y guarda el plan de ejecución de las consultas que hay detrás
+(etapas, índices usados, documentos y keys examinados).
+
+Requiere un mongod local; usa una base de datos propia (--db) que nunca
+debe ser la de producción.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_queries [--scales 100000,1000000,10000000] [--repeat 20] [--mongo-uri mongodb://localhost:27017] [--output resultado.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from benchmarks._common import set_default_env, summarize_latencies, git_revision
+from benchmarks.generate_invoices import DEFAULT_DB, load_invoices
+
+def summarize_plan(explain: dict) -> dict:
+    """Resumir la salida de explain (executionStats) a lo necesario para comparar"""
+    stats = explain.get("executionStats", {})
+    planner = explain.get("queryPlanner", {})
+    if not planner and "stages" in explain:
+        # Pipelines de agregación: el plan está en la etapa $cursor
+        cursor_stage = explain["stages"][0].get("$cursor", {})
+        planner = cursor_stage.get("queryPlanner", {})
+        stats = cursor_stage.get("executionStats", {})
+
+    stages, indexes = [], []
+    node = planner.get("winningPlan", {})
+    node = node.get("queryPlan", node)  # motor de ejecución SBE
+    while node:
+        stages.append(node.get("stage"))
+        if node.get("indexName"):
+            indexes.append(node["indexName"])
+        node = node.get("inputStage") or (node.get("inputStages") or [None])[0]
+
+    return {
+        "stages": " <- ".join(stage for stage in stages if stage),
+        "indexes": indexes,
+        "docsExamined": stats.get("totalDocsExamined"),
+        "keysExamined": stats.get("totalKeysExamined"),
+        "nReturned": stats.get("nReturned"),
+        "executionTimeMillis": stats.get("executionTimeMillis"),
+    }
+
+def explain_queries(db) -> tuple:
+    """Planes de las consultas que ejecuta InvoiceService (mismos filtros y orden) y una factura de muestra"""
+    collection = db["invoices"]
+    sample = collection.find_one({}, {"numeroFactura": 1}, sort=[("_id", -1)])
+
+    def find(query, sort, skip=0, limit=50):
+        return summarize_plan(collection.find(query).sort(*sort).skip(skip).limit(limit).explain())
+
+    def count(query):
+        return summarize_plan(db.command(
+            "explain",
+            {"aggregate": "invoices", "pipeline": [{"$match": query}, {"$group": {"_id": 1, "n": {"$sum": 1}}}], "cursor": {}},
+            verbosity="executionStats"
+        ))
+
+    def aggregate(pipeline):
+        return summarize_plan(db.command(
+            "explain",
+            {"aggregate": "invoices", "pipeline": pipeline, "cursor": {}},
+            verbosity="executionStats"
+        ))
+
+    regex_exact = {"numeroFactura": {"$regex": sample["numeroFactura"], "$options": "i"}}
+    regex_fragment = {"numeroFactura": {"$regex": "000123", "$options": "i"}}
+    validated = {"metadata.validatedAt": {"$exists": True, "$ne": None}}
+
+    return {
+        "list_first_page": find({}, ("createdAt", -1)),
+        "list_deep_page": find({}, ("createdAt", -1), skip=10000),
+        "list_count": count({}),
+        "search_exact": find(regex_exact, ("createdAt", -1)),
+        "search_exact_count": count(regex_exact),
+        "search_fragment": find(regex_fragment, ("createdAt", -1)),
+        "stats_validated_count": count(validated),
+        "stats_modified_count": count({"metadata.wasModified": True}),
+        "stats_with_s3_count": count({"metadata.s3Key": {"$exists": True, "$ne": None}}),
+        "stats_pending_count": count({
+            "metadata.processedAt": {"$exists": True, "$ne": None},
+            "metadata.validatedAt": {"$exists": False}
+        }),
+        "stats_by_month": aggregate([
+            {"$match": {"metadata.validatedAt": {"$exists": True}}},
+            {"$project": {"month": {"$substr": ["$metadata.validatedAt", 0, 7]}}},
+            {"$group": {"_id": "$month", "count": {"$sum": 1}}},
+            {"$sort": {"_id": -1}},
+            {"$limit": 6}
+        ]),
+        "stats_history": find(validated, ("metadata.validatedAt", -1), limit=20),
+        "get_invoice": summarize_plan(collection.find({"_id": sample["_id"]}).explain()),
+    }, sample
+
+async def time_methods(sample: dict, repeat: int) -> dict:
+    """Latencia de cada método de InvoiceService contra la colección cargada"""
+    from services.invoice_service import InvoiceService
+
+    service = InvoiceService()
+    invoice_id = str(sample["_id"])
+    cases = {
+        "list_invoices": lambda: service.list_invoices(skip=0, limit=50),
+        "list_invoices_deep": lambda: service.list_invoices(skip=10000, limit=50),
+        "search_exact": lambda: service.list_invoices(numero=sample["numeroFactura"]),
+        "search_fragment": lambda: service.list_invoices(numero="000123"),
+        "get_statistics": service.get_statistics,
+        "get_invoice": lambda: service.get_invoice(invoice_id),
+    }
+
+    results = {}
+    for name, call in cases.items():
+        await call()  # Calentar cache y conexiones
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(repeat):
+            call_start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - call_start)
+        results[name] = summarize_latencies(latencies, time.perf_counter() - start)
+    return results
+
+async def run_scale(repeat: int, sample: dict) -> dict:
+    from database.mongodb import connect_to_mongo, close_mongo_connection
+
+    await connect_to_mongo()
+    try:
+        return await time_methods(sample, repeat)
+    finally:
+        await close_mongo_connection()
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Latencia y planes de consultas de facturas a escala")
+    parser.add_argument('--scales', default="100000,1000000,10000000", help="Tamaños de colección a medir")
+    parser.add_argument('--repeat', type=int, default=20, help="Repeticiones por método")
+    parser.add_argument('--mongo-uri', default=os.environ.get("MONGODB_URI", "mongodb://localhost:27017"))
+    parser.add_argument('--db', default=DEFAULT_DB, help="Base de datos de benchmark (nunca la de producción)")
+    parser.add_argument('--workers', type=int, default=None, help="Procesos para generar facturas")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--drop', action='store_true', help="Empezar con la colección vacía")
+    parser.add_argument('--output', help="Guardar el resultado JSON en este archivo")
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+
+    # Configurar antes de importar los servicios
+    os.environ["MONGODB_URI"] = args.mongo_uri
+    os.environ["MONGODB_DB"] = args.db
+    set_default_env()
+    logging.disable(logging.INFO)
+
+    client = MongoClient(args.mongo_uri)
+    db = client[args.db]
+    if args.drop:
+        db["invoices"].drop()
+
+    scales = sorted(int(scale) for scale in args.scales.split(","))
+    results = []
+    for scale in scales:
+        print(f"📏 Escala: {scale:,} facturas", flush=True)
+        load = load_invoices(args.mongo_uri, args.db, scale, args.seed, args.workers)
+        plans, sample = explain_queries(db)
+        timings = asyncio.run(run_scale(args.repeat, sample))
+        results.append({
+            "documents": db["invoices"].estimated_document_count(),
+            "load": load,
+            "indexes": sorted(db["invoices"].index_information()),
+            "timings": timings,
+            "plans": plans,
+        })
+    client.close()
+
+    output = json.dumps({
+        "benchmark": "queries",
+        "revision": git_revision(),
+        "params": vars(args),
+        "scales": results,
+    }, indent=2, default=str)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == '__main__':
+    main_cli()
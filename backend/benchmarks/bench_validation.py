@@ -0,0 +1,57 @@
+"""
+Benchmark de validación de facturas con Pydantic (pytest-benchmark)
+
+Mide InvoiceCreate con 1, 100 y 1000 items (el máximo permitido), y la
+validación en lote de muchas facturas con el TypeAdapter cacheado.
+
+Uso (desde backend/):
+    pip install -r benchmarks/requirements.txt
+    python -m pytest benchmarks/bench_validation.py --benchmark-only
+    python -m pytest benchmarks/bench_validation.py --benchmark-json resultado.json
+"""
+import pytest
+from models.invoice import InvoiceCreate, validate_invoices
+
+def build_invoice(num_items: int) -> dict:
+    """Factura válida con num_items conceptos (fechas, moneda y totales cuadrados)"""
+    items = [
+        {
+            "descripcion": f"Concepto {i}",
+            "cantidad": 2,
+            "precioUnitario": 12.5,
+            "total": 25.0
+        }
+        for i in range(num_items)
+    ]
+    subtotal = 25.0 * num_items
+    return {
+        "numeroFactura": "F-0001",
+        "fecha": "2024-01-15",
+        "fechaVencimiento": "2024-02-15",
+        "proveedor": {"nombre": "Proveedor SA de CV", "rfc": "PSA010101AAA"},
+        "cliente": {"nombre": "Cliente SA de CV", "rfc": "CSA010101BBB"},
+        "items": items,
+        "subtotal": subtotal,
+        "iva": round(subtotal * 0.16, 2),
+        "total": round(subtotal * 1.16, 2),
+        "moneda": "mxn",
+        "metadata": {
+            "fileName": "factura.pdf",
+            "fileSize": 102400,
+            "mimeType": "application/pdf",
+            "processedAt": "2024-01-15T10:00:00"
+        }
+    }
+
+@pytest.mark.parametrize("num_items", [1, 100, 1000])
+def test_invoice_create(benchmark, num_items):
+    data = build_invoice(num_items)
+    invoice = benchmark(InvoiceCreate.model_validate, data)
+    assert len(invoice.items) == num_items
+    assert invoice.moneda == "MXN"
+
+@pytest.mark.parametrize("num_invoices", [100, 1000])
+def test_invoice_batch(benchmark, num_invoices):
+    batch = [build_invoice(10) for _ in range(num_invoices)]
+    invoices = benchmark(validate_invoices, batch)
+    assert len(invoices) == num_invoices
@@ -0,0 +1,184 @@
+"""
+Corpus de facturas con ground truth para medir precisión y latencia
+
+Descarga una sola vez el dataset de Hugging Face que usan los notebooks
+(katanaml-org/invoices-donut-data-v1) y lo guarda como archivos locales:
+
+    benchmarks/.corpus/<split>/
+        manifest.json        # lista de muestras y origen del dataset
+        0000.png             # imagen original
+        0000.pdf             # la misma imagen como PDF (para el modo rasterizado)
+        0000.json            # ground truth normalizado al esquema de InvoiceCreate
+
+Después todo funciona sin red.
+
+Uso (desde backend/):
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.corpus [--split test] [--limit 50]
+"""
+import argparse
+import io
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+DATASET_REPO = "katanaml-org/invoices-donut-data-v1"
+CORPUS_DIR = Path(__file__).parent / ".corpus"
+
+_AMOUNT_CLEAN = re.compile(r"[^\d,.\-]")
+
+def parse_amount(value: Any) -> Optional[float]:
+    """
+    Convertir montos del dataset a float
+
+    Acepta formatos como "$ 1 234,56", "1,234.56" o "7,50": el último
+    separador (punto o coma) seguido de 1-2 dígitos se toma como decimal.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = _AMOUNT_CLEAN.sub("", str(value))
+    if not text or not re.search(r"\d", text):
+        return None
+    match = re.search(r"[.,](\d{1,2})$", text)
+    if match:
+        integer = re.sub(r"[.,]", "", text[:match.start()])
+        text = f"{integer}.{match.group(1)}"
+    else:
+        text = re.sub(r"[.,]", "", text)
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def parse_date(value: Optional[str]) -> Optional[str]:
+    """Fechas del dataset (mm/dd/yyyy, dd.mm.yyyy, ...) a YYYY-MM-DD"""
+    if not value:
+        return None
+    value = value.strip()
+    for fmt in ("%m/%d/%Y", "%d.%m.%Y", "%Y-%m-%d", "%d/%m/%Y", "%m-%d-%Y"):
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+def _party_name(text: Optional[str]) -> Optional[str]:
+    # El dataset junta nombre y dirección; el nombre es la primera línea
+    if not text:
+        return None
+    return text.strip().splitlines()[0].strip() or None
+
+def normalize_ground_truth(ground_truth: Dict[str, Any]) -> Dict[str, Any]:
+    """Convertir el ground truth del dataset (formato Donut) al esquema de InvoiceCreate"""
+    parse = ground_truth.get("gt_parse", ground_truth)
+    header = parse.get("header", {})
+    summary = parse.get("summary", {})
+    items = parse.get("items", [])
+    if isinstance(items, dict):
+        items = [items]
+
+    return {
+        "numeroFactura": header.get("invoice_no"),
+        "fecha": parse_date(header.get("invoice_date")),
+        "proveedor": {
+            "nombre": _party_name(header.get("seller")),
+            "rfc": header.get("seller_tax_id"),
+        },
+        "cliente": {
+            "nombre": _party_name(header.get("client")),
+            "rfc": header.get("client_tax_id"),
+        },
+        "items": [
+            {
+                "descripcion": item.get("item_desc"),
+                "cantidad": parse_amount(item.get("item_qty")),
+                "precioUnitario": parse_amount(item.get("item_net_price")),
+                "total": parse_amount(item.get("item_gross_worth") or item.get("item_net_worth")),
+            }
+            for item in items
+        ],
+        "subtotal": parse_amount(summary.get("total_net_worth")),
+        "iva": parse_amount(summary.get("total_vat")),
+        "total": parse_amount(summary.get("total_gross_worth")),
+    }
+
+def _find_split_file(split: str) -> str:
+    from huggingface_hub import HfApi
+
+    files = HfApi().list_repo_files(DATASET_REPO, repo_type="dataset")
+    matches = sorted(f for f in files if f.endswith(".parquet") and Path(f).name.startswith(f"{split}-"))
+    if not matches:
+        raise ValueError(f"El dataset no tiene el split '{split}'")
+    return matches[0]
+
+def build_corpus(split: str = "test", limit: int = 50, corpus_dir: Path = CORPUS_DIR) -> Path:
+    """Descargar y guardar el corpus local (no hace nada si ya existe con suficientes muestras)"""
+    import pandas as pd
+    from huggingface_hub import hf_hub_download
+    from PIL import Image
+
+    target = corpus_dir / split
+    manifest_path = target / "manifest.json"
+    if manifest_path.exists() and len(json.loads(manifest_path.read_text())["samples"]) >= limit:
+        print(f"ℹ️  Corpus ya disponible en {target}")
+        return target
+
+    filename = _find_split_file(split)
+    print(f"📥 Descargando {DATASET_REPO}/{filename}...")
+    parquet_file = hf_hub_download(repo_id=DATASET_REPO, filename=filename, repo_type="dataset")
+    df = pd.read_parquet(parquet_file)
+
+    target.mkdir(parents=True, exist_ok=True)
+    samples = []
+    for index in range(min(limit, len(df))):
+        row = df.iloc[index]
+        image_field = row["image"] if "image" in row else {"bytes": row["image.bytes"]}
+        image = Image.open(io.BytesIO(image_field["bytes"])).convert("RGB")
+        ground_truth = json.loads(row["ground_truth"])
+
+        sample_id = f"{index:04d}"
+        image.save(target / f"{sample_id}.png", format="PNG")
+        image.save(target / f"{sample_id}.pdf", format="PDF", resolution=200)
+        (target / f"{sample_id}.json").write_text(json.dumps({
+            "expected": normalize_ground_truth(ground_truth),
+            "raw": ground_truth,
+        }, indent=2, ensure_ascii=False))
+        samples.append(sample_id)
+
+    manifest_path.write_text(json.dumps({
+        "dataset": DATASET_REPO,
+        "file": filename,
+        "split": split,
+        "samples": samples,
+        "createdAt": datetime.utcnow().isoformat(),
+    }, indent=2))
+    print(f"✅ Corpus guardado: {len(samples)} facturas en {target}")
+    return target
+
+def load_corpus(split: str = "test", limit: Optional[int] = None, corpus_dir: Path = CORPUS_DIR) -> List[Dict[str, Any]]:
+    """Cargar las muestras del corpus local (sin red)"""
+    target = corpus_dir / split
+    manifest_path = target / "manifest.json"
+    if not manifest_path.exists():
+        raise FileNotFoundError(f"No hay corpus en {target}; ejecuta: python -m benchmarks.corpus --split {split}")
+
+    samples = []
+    for sample_id in json.loads(manifest_path.read_text())["samples"][:limit]:
+        samples.append({
+            "id": sample_id,
+            "png": target / f"{sample_id}.png",
+            "pdf": target / f"{sample_id}.pdf",
+            "expected": json.loads((target / f"{sample_id}.json").read_text())["expected"],
+        })
+    return samples
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Descargar el corpus de facturas con ground truth")
+    parser.add_argument('--split', default="test", help="train, validation o test")
+    parser.add_argument('--limit', type=int, default=50, help="Número de facturas a guardar")
+    args = parser.parse_args()
+    build_corpus(args.split, args.limit)
@@ -0,0 +1,157 @@
+"""
+Files y Batch API falsas para el servidor de fake_openai.py
+
+Guarda en memoria los archivos subidos con purpose="batch", y cada batch
+avanza validating -> in_progress -> completed según el tiempo transcurrido
+desde su creación (se evalúa al consultarlo). Al terminar, cada línea del
+JSONL se responde con la misma lógica que /v1/chat/completions (errores y
+modelos débiles incluidos) y se generan los archivos de salida y de
+errores con el formato de la API real. Como la API real, rechaza un batch
+con custom_id repetidos o con más de un modelo, y con batch_expire_rate
+un batch expira con solo la mitad de sus peticiones resueltas (el resto va
+al archivo de errores como batch_expired).
+"""
+import json
+import time
+import uuid
+from fastapi import FastAPI, HTTPException, Request, UploadFile, Form
+from fastapi.responses import Response
+
+def install_batch_api(app: FastAPI, complete, batch_seconds: float, expire_rate: float, rng) -> None:
+    """
+    Agregar las rutas de Files y Batches a la aplicación del servidor falso
+
+    Args:
+        complete: función de fake_openai que responde un cuerpo de chat completions -> (latencia, código, cuerpo)
+        batch_seconds: Tiempo desde la creación hasta que el batch termina
+        expire_rate: Probabilidad de que un batch expire a medias
+        rng: random.Random del servidor (misma semilla)
+    """
+    files = {}
+    batches = {}
+    app.state.stats.update({"batches": 0, "batch_requests": 0})
+
+    def store_file(content: bytes, filename: str, purpose: str) -> dict:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        files[file_id] = {
+            "content": content,
+            "object": {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(content),
+                "created_at": int(time.time()),
+                "filename": filename,
+                "purpose": purpose,
+                "status": "processed"
+            }
+        }
+        return files[file_id]["object"]
+
+    def jsonl(lines: list) -> bytes:
+        return "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode("utf-8")
+
+    def run_batch(batch: dict) -> None:
+        """Resolver las peticiones del batch y dejar sus archivos de salida y errores"""
+        lines = [json.loads(line) for line in files[batch["input_file_id"]]["content"].decode("utf-8").splitlines() if line.strip()]
+        ids = [line.get("custom_id") for line in lines]
+        models = {line.get("body", {}).get("model") for line in lines}
+        if len(set(ids)) != len(ids) or len(models) > 1 or any(line.get("url") != batch["endpoint"] for line in lines):
+            batch["status"] = "failed"
+            batch["errors"] = {"object": "list", "data": [{"code": "invalid_request", "message": "custom_id repetido, más de un modelo o url distinta del endpoint", "line": None, "param": None}]}
+            return
+
+        expired = rng.random() < expire_rate
+        resolved = lines[:len(lines) // 2] if expired else lines
+        output, errors = [], []
+        for line in resolved:
+            app.state.stats["batch_requests"] += 1
+            _, status_code, payload = complete(line["body"])
+            result = {
+                "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+                "custom_id": line["custom_id"],
+                "response": {"status_code": status_code, "request_id": uuid.uuid4().hex, "body": payload},
+                "error": None
+            }
+            (output if status_code == 200 else errors).append(result)
+        for line in lines[len(resolved):]:
+            errors.append({
+                "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+                "custom_id": line["custom_id"],
+                "response": None,
+                "error": {"code": "batch_expired", "message": "This request could not be executed before the completion window expired."}
+            })
+
+        if output:
+            batch["output_file_id"] = store_file(jsonl(output), "batch_output.jsonl", "batch_output")["id"]
+        if errors:
+            batch["error_file_id"] = store_file(jsonl(errors), "batch_errors.jsonl", "batch_output")["id"]
+        batch["request_counts"] = {"total": len(lines), "completed": len(output), "failed": len(errors)}
+        batch["status"] = "expired" if expired else "completed"
+        batch["expired_at" if expired else "completed_at"] = int(time.time())
+
+    def advance(batch: dict) -> dict:
+        if batch["status"] not in ("validating", "in_progress"):
+            return batch
+        elapsed = time.time() - batch["created_at"]
+        if elapsed >= batch_seconds:
+            run_batch(batch)
+        elif elapsed >= batch_seconds / 10 and batch["status"] == "validating":
+            batch["status"] = "in_progress"
+            batch["in_progress_at"] = int(time.time())
+        return batch
+
+    @app.post("/v1/files")
+    async def create_file(file: UploadFile, purpose: str = Form(...)):
+        return store_file(await file.read(), file.filename, purpose)
+
+    @app.get("/v1/files/{file_id}")
+    async def retrieve_file(file_id: str):
+        if file_id not in files:
+            raise HTTPException(status_code=404, detail="No such file")
+        return files[file_id]["object"]
+
+    @app.get("/v1/files/{file_id}/content")
+    async def file_content(file_id: str):
+        if file_id not in files:
+            raise HTTPException(status_code=404, detail="No such file")
+        return Response(content=files[file_id]["content"], media_type="application/octet-stream")
+
+    @app.post("/v1/batches")
+    async def create_batch(request: Request):
+        body = await request.json()
+        if body.get("input_file_id") not in files:
+            raise HTTPException(status_code=400, detail="No such file")
+        app.state.stats["batches"] += 1
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "errors": None,
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": time.time(),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": body.get("metadata")
+        }
+        return {**batches[batch_id], "created_at": int(batches[batch_id]["created_at"])}
+
+    @app.get("/v1/batches/{batch_id}")
+    async def retrieve_batch(batch_id: str):
+        if batch_id not in batches:
+            raise HTTPException(status_code=404, detail="No such batch")
+        batch = advance(batches[batch_id])
+        return {**batch, "created_at": int(batch["created_at"])}
+
+    @app.post("/v1/batches/{batch_id}/cancel")
+    async def cancel_batch(batch_id: str):
+        if batch_id not in batches:
+            raise HTTPException(status_code=404, detail="No such batch")
+        batch = advance(batches[batch_id])
+        if batch["status"] in ("validating", "in_progress"):
+            batch["status"] = "cancelled"
+            batch["cancelled_at"] = int(time.time())
+        return {**batch, "created_at": int(batch["created_at"])}
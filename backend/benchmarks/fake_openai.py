@@ -0,0 +1,251 @@
+"""
+Servidor falso compatible con la API de OpenAI (chat completions)
+
+Responde con una factura de ejemplo tras una latencia aleatoria (log-normal
+alrededor de la mediana configurada) y devuelve errores 429/500 con la
+probabilidad indicada. Los modelos "-mini" responden más rápido y, con
+--weak-model-rate, a veces devuelven una factura cuyos totales no cuadran
+(para ejercitar el escalamiento de OPENAI_MODEL_TIERS). Con --items la
+factura tiene esa cantidad de conceptos y con --ms-per-token la latencia
+crece con los tokens de la respuesta, como en la API real; las peticiones
+de una franja (VISION_BANDS_ENABLED) reciben solo sus conceptos. Sirve
+para medir el backend sin gastar en la API real: basta con apuntar
+OPENAI_BASE_URL a http://host:puerto/v1. También implementa los Files y la
+Batch API (fake_batch.py) para probar batch_extract.py sin red.
+
+Uso (desde backend/):
+    python -m benchmarks.fake_openai [--port 9100] [--latency-ms 800] [--latency-sigma 0.4] [--error-rate 0.02] [--weak-model-rate 0.2] [--items 80] [--ms-per-token 15] [--batch-seconds 2]
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from benchmarks.fake_batch import install_batch_api
+
+SAMPLE_INVOICE = {
+    "numeroFactura": "A-1024",
+    "fecha": "2024-03-15",
+    "fechaVencimiento": "2024-04-14",
+    "proveedor": {
+        "nombre": "Papelería del Centro SA de CV",
+        "rfc": "PCE010203AB1",
+        "direccion": "Av. Juárez 100, CDMX",
+        "telefono": "5555555555"
+    },
+    "cliente": {
+        "nombre": "Comercializadora Norte SA de CV",
+        "rfc": "CNO040506CD2",
+        "direccion": "Calle 5 de Mayo 20, Monterrey"
+    },
+    "items": [
+        {"descripcion": "Hojas blancas carta (caja)", "cantidad": 2, "precioUnitario": 450.0, "total": 900.0},
+        {"descripcion": "Tóner negro", "cantidad": 1, "precioUnitario": 1100.0, "total": 1100.0}
+    ],
+    "subtotal": 2000.0,
+    "iva": 320.0,
+    "total": 2320.0,
+    "moneda": "MXN",
+    "formaPago": "03 - Transferencia",
+    "metodoPago": "PUE",
+    "usoCFDI": "G03",
+    "observaciones": ""
+}
+
+_REPAIR_KEYS = re.compile(r"JSON con las claves ((?:\"\w+\"(?:, )?)+)")
+_KNOWN_SECTION = re.compile(r"ya se leyeron del código QR[^\n]*\n((?:- [\w.]+: [^\n]*\n?)+)")
+_BAND = re.compile(r"franja (\d+) de (\d+)")
+_WITHOUT_ITEMS = "No incluyas items"
+
+def build_invoice(items: int = None) -> dict:
+    """SAMPLE_INVOICE, o una variante con `items` conceptos y los totales recalculados"""
+    if items is None:
+        return SAMPLE_INVOICE
+    rows = [
+        {"descripcion": f"Artículo {number:03d} de papelería", "cantidad": number % 7 + 1, "precioUnitario": 10.0 + number, "total": round((number % 7 + 1) * (10.0 + number), 2)}
+        for number in range(1, items + 1)
+    ]
+    subtotal = round(sum(row["total"] for row in rows), 2)
+    iva = round(subtotal * 0.16, 2)
+    return {**SAMPLE_INVOICE, "items": rows, "subtotal": subtotal, "iva": iva, "total": round(subtotal + iva, 2)}
+
+def band_items(items: list, number: int, count: int) -> list:
+    """Conceptos visibles en la franja `number` de `count`: partes parejas, repitiendo la última fila de la anterior"""
+    size = -(-len(items) // count)
+    start = max(0, (number - 1) * size - 1)
+    return items[start:number * size]
+
+def _prompt_texts(body: dict) -> list:
+    texts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+        texts.extend(part.get("text") or "" for part in parts if part.get("type") == "text")
+    return texts
+
+def _requested_fields(body: dict) -> list:
+    """Claves pedidas por un prompt de reparación (vacío para una extracción completa)"""
+    for text in _prompt_texts(body):
+        match = _REPAIR_KEYS.search(text)
+        if match:
+            return re.findall(r"\"(\w+)\"", match.group(1))
+    return []
+
+def _band(body: dict):
+    """(franja, total de franjas) de una petición de extracción en franjas, o None"""
+    for text in _prompt_texts(body):
+        match = _BAND.search(text)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+    return None
+
+def _known_fields(body: dict) -> list:
+    """Campos (o campo.subcampo) que el prompt da por leídos localmente y pide omitir"""
+    for text in _prompt_texts(body):
+        match = _KNOWN_SECTION.search(text)
+        if match:
+            return re.findall(r"^- ([\w.]+):", match.group(1), re.MULTILINE)
+    return []
+
+def create_fake_openai_app(
+    latency_ms: float = 800,
+    latency_sigma: float = 0.4,
+    error_rate: float = 0.0,
+    seed: int = None,
+    weak_model_rate: float = 0.0,
+    weak_model_speedup: float = 2.5,
+    items: int = None,
+    ms_per_token: float = 0.0,
+    batch_seconds: float = 2.0,
+    batch_expire_rate: float = 0.0
+) -> FastAPI:
+    """
+    Crear la aplicación del servidor falso
+
+    Args:
+        latency_ms: Mediana de la latencia de cada respuesta
+        latency_sigma: Dispersión de la distribución log-normal (0 = latencia fija)
+        error_rate: Probabilidad de responder con un error (mitad 429, mitad 500)
+        seed: Semilla para reproducir la misma secuencia de latencias y errores
+        weak_model_rate: Probabilidad de que un modelo "-mini" devuelva una factura inválida
+        weak_model_speedup: Cuántas veces más rápido responde un modelo "-mini"
+        items: Conceptos de la factura de ejemplo (None = los 2 de SAMPLE_INVOICE)
+        ms_per_token: Latencia adicional por token de la respuesta (generación)
+        batch_seconds: Tiempo que tarda en terminar un batch (Batch API, ver fake_batch.py)
+        batch_expire_rate: Probabilidad de que un batch expire con solo la mitad de los resultados
+    """
+    app = FastAPI(title="Fake OpenAI")
+    rng = random.Random(seed)
+    app.state.stats = {"requests": 0, "errors": 0, "models": {}, "bands": 0}
+    sample_invoice = build_invoice(items)
+
+    def sample_latency() -> float:
+        if latency_ms <= 0:
+            return 0.0
+        return latency_ms / 1000 * math.exp(rng.gauss(0, latency_sigma))
+
+    def complete(body: dict):
+        """(latencia en s, código HTTP, cuerpo) de una petición de chat completions; la comparten la ruta y los batches"""
+        model = body.get("model", "gpt-4o")
+        is_weak = "mini" in model
+        app.state.stats["requests"] += 1
+        app.state.stats["models"][model] = app.state.stats["models"].get(model, 0) + 1
+        latency = sample_latency()
+        latency = latency / weak_model_speedup if is_weak else latency
+
+        if rng.random() < error_rate:
+            app.state.stats["errors"] += 1
+            if rng.random() < 0.5:
+                return latency, 429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+            return latency, 500, {"error": {"message": "The server had an error", "type": "server_error", "code": None}}
+
+        invoice = sample_invoice
+        if is_weak and rng.random() < weak_model_rate:
+            # Error típico de un modelo pequeño: el total no cuadra con subtotal + IVA
+            invoice = {**sample_invoice, "total": sample_invoice["total"] + 100}
+        band = _band(body)
+        requested = _requested_fields(body)
+        if band:
+            # Extracción en franjas: solo los conceptos de la franja
+            app.state.stats["bands"] += 1
+            invoice = {"items": band_items(sample_invoice["items"], *band)}
+        elif requested:
+            # Reparación de campos (OpenAIService.repair_extraction): solo las claves pedidas
+            invoice = {key: invoice[key] for key in requested if key in invoice}
+        elif _WITHOUT_ITEMS in " ".join(_prompt_texts(body)):
+            # Encabezado de una extracción en franjas: todo salvo los conceptos
+            invoice = {key: value for key, value in invoice.items() if key != "items"}
+        known = _known_fields(body)
+        if known:
+            # Extracción con lectura local previa: los campos ya leídos (campo o campo.subcampo) no se devuelven
+            invoice = {key: value for key, value in invoice.items() if key not in known}
+            for name in known:
+                field, _, key = name.partition(".")
+                if key and isinstance(invoice.get(field), dict):
+                    invoice[field] = {k: v for k, v in invoice[field].items() if k != key}
+        content = json.dumps(invoice, ensure_ascii=False)
+        # Aproximación de tokens (~4 caracteres por token), suficiente para los reportes de uso
+        prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+        completion_tokens = len(content) // 4
+        return latency + completion_tokens * ms_per_token / 1000, 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": f"```json\n{content}\n```"},
+                    "finish_reason": "stop"
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        latency, status_code, payload = complete(await request.json())
+        await asyncio.sleep(latency)
+        if status_code != 200:
+            return JSONResponse(status_code=status_code, content=payload)
+        return payload
+
+    install_batch_api(app, complete, batch_seconds, batch_expire_rate, rng)
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.stats
+
+    return app
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Servidor falso de la API de OpenAI")
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency-ms', type=float, default=800, help="Mediana de latencia por respuesta")
+    parser.add_argument('--latency-sigma', type=float, default=0.4, help="Dispersión log-normal de la latencia")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Probabilidad de error 429/500 (0-1)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--weak-model-rate', type=float, default=0.0, help="Probabilidad de factura inválida de los modelos -mini")
+    parser.add_argument('--items', type=int, default=None, help="Conceptos de la factura de ejemplo")
+    parser.add_argument('--ms-per-token', type=float, default=0.0, help="Latencia adicional por token de la respuesta")
+    parser.add_argument('--batch-seconds', type=float, default=2.0, help="Tiempo que tarda en terminar un batch")
+    parser.add_argument('--batch-expire-rate', type=float, default=0.0, help="Probabilidad de que un batch expire a medias")
+    args = parser.parse_args()
+
+    app = create_fake_openai_app(
+        args.latency_ms, args.latency_sigma, args.error_rate, args.seed, args.weak_model_rate,
+        items=args.items, ms_per_token=args.ms_per_token,
+        batch_seconds=args.batch_seconds, batch_expire_rate=args.batch_expire_rate
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
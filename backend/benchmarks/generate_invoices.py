@@ -0,0 +1,222 @@
+"""
+Generador de facturas sintéticas a escala (100k – 10M documentos)
+
+Produce documentos con la forma de InvoiceCreate tal como los guarda
+InvoiceService, con distribuciones sesgadas como en producción:
+  - pocos proveedores concentran la mayoría de facturas (Zipf),
+  - la mayoría de facturas tiene pocos conceptos, con una cola larga,
+  - las fechas se concentran en los meses recientes,
+  - la mayoría está validada, una parte fue modificada y casi todas tienen archivo en S3.
+
+La carga se hace con insert_many sin orden en lotes, repartida entre varios
+procesos. Es determinista por semilla y número de documento, así que se
+puede completar una colección existente hasta un tamaño mayor.
+
+Uso (desde backend/):
+    python -m benchmarks.generate_invoices --count 1000000 [--mongo-uri mongodb://localhost:27017] [--db facturas_bench] [--drop] [--workers 4]
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+DEFAULT_DB = "facturas_bench"
+BATCH_SIZE = 5000
+NUM_SUPPLIERS = 5000
+NUM_CLIENTS = 800
+NUM_VALIDATORS = 40
+HISTORY_DAYS = 3 * 365
+
+PRODUCTS = [
+    "Papel bond carta", "Tóner láser", "Servicio de mantenimiento", "Licencia de software",
+    "Consultoría", "Arrendamiento de equipo", "Flete nacional", "Material eléctrico",
+    "Refacciones", "Limpieza de oficinas", "Publicidad digital", "Combustible",
+    "Honorarios profesionales", "Equipo de cómputo", "Mobiliario", "Capacitación",
+]
+FORMAS_PAGO = ["01 - Efectivo", "03 - Transferencia", "04 - Tarjeta de crédito", "28 - Tarjeta de débito", "99 - Por definir"]
+USOS_CFDI = ["G01", "G03", "I04", "P01", "S01"]
+CURRENCIES = ["MXN"] * 18 + ["USD"] + ["EUR"]
+
+def _zipf_weights(n: int, s: float = 1.1):
+    weights = [1 / (rank ** s) for rank in range(1, n + 1)]
+    total = sum(weights)
+    cumulative, acc = [], 0.0
+    for weight in weights:
+        acc += weight / total
+        cumulative.append(acc)
+    return cumulative
+
+_SUPPLIER_CDF = _zipf_weights(NUM_SUPPLIERS)
+_CLIENT_CDF = _zipf_weights(NUM_CLIENTS, 0.9)
+
+def _pick(rng: random.Random, cdf) -> int:
+    # Búsqueda binaria sobre la distribución acumulada
+    target = rng.random()
+    low, high = 0, len(cdf) - 1
+    while low < high:
+        mid = (low + high) // 2
+        if cdf[mid] < target:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+def _rfc(prefix: str, index: int) -> str:
+    digest = hashlib.md5(f"{prefix}{index}".encode()).hexdigest().upper()
+    return f"{prefix}{index % 100:02d}{(index // 100) % 12 + 1:02d}{index % 28 + 1:02d}{digest[:3]}"
+
+def _item_count(rng: random.Random) -> int:
+    # ~70% entre 1 y 3 conceptos; cola larga hasta 200
+    return min(200, 1 + int(rng.expovariate(1 / 2.5)) + (rng.randrange(50, 150) if rng.random() < 0.01 else 0))
+
+def generate_invoice(index: int, seed: int = 0, now: datetime = None) -> dict:
+    """Factura sintética número `index` (la misma para la misma semilla)"""
+    rng = random.Random(seed * 1_000_003 + index)
+    now = now or datetime(2025, 1, 1)
+
+    supplier = _pick(rng, _SUPPLIER_CDF)
+    client = _pick(rng, _CLIENT_CDF)
+    # Más facturas en los meses recientes
+    age_days = min(HISTORY_DAYS, int(rng.expovariate(1 / 180)))
+    issued = now - timedelta(days=age_days, seconds=rng.randrange(86400))
+
+    items = []
+    for _ in range(_item_count(rng)):
+        quantity = rng.choice([1, 1, 1, 2, 3, 5, 10, 12, 24, 100])
+        unit_price = round(math.exp(rng.uniform(math.log(5), math.log(50000))), 2)
+        items.append({
+            "descripcion": rng.choice(PRODUCTS),
+            "cantidad": quantity,
+            "precioUnitario": unit_price,
+            "total": round(quantity * unit_price, 2)
+        })
+    subtotal = round(sum(item["total"] for item in items), 2)
+    iva = round(subtotal * 0.16, 2)
+
+    processed_at = issued + timedelta(minutes=rng.randrange(1, 60 * 24 * 5))
+    metadata = {
+        "fileName": f"factura_{index}.{'pdf' if rng.random() < 0.7 else 'jpg'}",
+        "fileSize": rng.randrange(40_000, 1_000_000),
+        "mimeType": "application/pdf",
+        "processedAt": processed_at.isoformat(),
+        "model": "gpt-4o",
+        "wasModified": False,
+    }
+    if metadata["fileName"].endswith(".jpg"):
+        metadata["mimeType"] = "image/jpeg"
+    if rng.random() < 0.9:
+        metadata["validatedAt"] = (processed_at + timedelta(minutes=rng.randrange(1, 600))).isoformat()
+        metadata["validatedBy"] = f"validador{_pick(rng, _CLIENT_CDF) % NUM_VALIDATORS}@empresa.com"
+        metadata["wasModified"] = rng.random() < 0.15
+    if rng.random() < 0.85:
+        digest = hashlib.sha256(f"{seed}:{index}".encode()).hexdigest()
+        metadata["s3Key"] = f"sha256/{digest[:2]}/{digest[2:4]}/{digest}"
+        metadata["uploadStatus"] = "completed"
+
+    invoice = {
+        "numeroFactura": f"{chr(65 + supplier % 26)}{supplier % 10}-{index:08d}",
+        "fecha": issued.date().isoformat(),
+        "fechaVencimiento": (issued + timedelta(days=30)).date().isoformat(),
+        "proveedor": {
+            "nombre": f"Proveedor {supplier} SA de CV",
+            "rfc": _rfc("PRV", supplier),
+            "direccion": f"Calle {supplier % 300} #{supplier % 97}, CDMX"
+        },
+        "cliente": {
+            "nombre": f"Cliente {client} SA de CV",
+            "rfc": _rfc("CLI", client),
+            "direccion": f"Av. {client % 150} #{client % 53}, Monterrey"
+        },
+        "items": items,
+        "subtotal": subtotal,
+        "iva": iva,
+        "total": round(subtotal + iva, 2),
+        "moneda": rng.choice(CURRENCIES),
+        "formaPago": rng.choice(FORMAS_PAGO),
+        "metodoPago": "PUE" if rng.random() < 0.8 else "PPD",
+        "usoCFDI": rng.choice(USOS_CFDI),
+        "metadata": metadata,
+        "createdAt": processed_at + timedelta(seconds=rng.randrange(3600)),
+    }
+    invoice["updatedAt"] = invoice["createdAt"]
+    return invoice
+
+def _insert_range(mongo_uri: str, db_name: str, start: int, end: int, seed: int) -> int:
+    """Insertar las facturas [start, end) (se ejecuta en un proceso del pool)"""
+    from pymongo import MongoClient
+
+    client = MongoClient(mongo_uri)
+    collection = client[db_name]["invoices"]
+    inserted = 0
+    for batch_start in range(start, end, BATCH_SIZE):
+        batch = [generate_invoice(i, seed) for i in range(batch_start, min(end, batch_start + BATCH_SIZE))]
+        collection.insert_many(batch, ordered=False, bypass_document_validation=True)
+        inserted += len(batch)
+    client.close()
+    return inserted
+
+def load_invoices(mongo_uri: str, db_name: str, count: int, seed: int = 0, workers: int = None, drop: bool = False) -> dict:
+    """
+    Dejar la colección invoices de db_name con `count` facturas sintéticas
+
+    Si ya tiene documentos solo agrega los que faltan (continuando la numeración).
+    """
+    from pymongo import MongoClient
+
+    client = MongoClient(mongo_uri)
+    collection = client[db_name]["invoices"]
+    if drop:
+        collection.drop()
+    existing = collection.estimated_document_count()
+    client.close()
+
+    if existing >= count:
+        return {"existing": existing, "inserted": 0, "elapsed_s": 0.0}
+
+    workers = workers or os.cpu_count() or 1
+    missing = count - existing
+    chunk = max(BATCH_SIZE, math.ceil(missing / (workers * 4) / BATCH_SIZE) * BATCH_SIZE)
+    ranges = [(start, min(count, start + chunk)) for start in range(existing, count, chunk)]
+
+    start_time = time.perf_counter()
+    inserted = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_insert_range, mongo_uri, db_name, start, end, seed) for start, end in ranges]
+        for future in futures:
+            inserted += future.result()
+            print(f"  📦 {existing + inserted:,}/{count:,}", flush=True)
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "existing": existing,
+        "inserted": inserted,
+        "elapsed_s": round(elapsed, 2),
+        "docs_per_s": round(inserted / elapsed, 1) if elapsed else 0.0,
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Cargar facturas sintéticas en MongoDB")
+    parser.add_argument('--count', type=int, required=True, help="Número total de facturas en la colección")
+    parser.add_argument('--mongo-uri', default=os.environ.get("MONGODB_URI", "mongodb://localhost:27017"))
+    parser.add_argument('--db', default=DEFAULT_DB, help="Base de datos destino (nunca la de producción)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="Procesos de carga (default: CPUs)")
+    parser.add_argument('--drop', action='store_true', help="Vaciar la colección antes de cargar")
+    parser.add_argument('--sample', action='store_true', help="Solo imprimir una factura de ejemplo")
+    args = parser.parse_args()
+
+    if args.sample:
+        print(json.dumps(generate_invoice(0, args.seed), indent=2, default=str, ensure_ascii=False))
+        return
+
+    print(f"🔄 Cargando {args.count:,} facturas en {args.db}.invoices...")
+    result = load_invoices(args.mongo_uri, args.db, args.count, args.seed, args.workers, args.drop)
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,286 @@
+"""
+Prueba de carga de extremo a extremo sin servicios externos
+
+Levanta main:app con uvicorn en un hilo, apuntando a:
+  - un servidor falso de OpenAI (benchmarks/fake_openai.py) con latencia y
+    tasa de errores configurables,
+  - MongoDB en memoria (mongomock-motor) o un mongod local (--mongo-uri),
+  - un servidor S3 de moto (desactivable con --no-s3),
+  - una base de usuarios SQLite temporal.
+
+Después lanza un generador de carga asíncrono que mezcla /extract, /validate,
+listado, estadísticas y login, y reporta throughput y p50/p95/p99 por endpoint
+en JSON para comparar entre commits.
+
+Uso (desde backend/):
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.loadtest [--requests 2000] [--concurrency 50] [--mix extract=1,validate=1,list=4,stats=1,login=2]
+                                  [--openai-latency-ms 800] [--openai-error-rate 0.02] [--mongo-uri mongodb://localhost:27017]
+                                  [--output resultado.json]
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import uuid
+from typing import Dict, List
+from benchmarks._common import set_default_env, summarize_latencies, git_revision, ServerThread
+from benchmarks.bench_login import create_users_db
+from benchmarks.fake_openai import SAMPLE_INVOICE, create_fake_openai_app
+
+DEFAULT_MIX = "extract=1,validate=1,list=4,stats=1,login=2"
+BUCKET_NAME = "loadtest-facturas"
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Convertir 'extract=1,list=4' en pesos por endpoint"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Endpoint desconocido en --mix: {name} (opciones: {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+def build_images(count: int) -> List[bytes]:
+    """PNGs pequeños y distintos entre sí (para que S3 no los deduplique)"""
+    from PIL import Image
+
+    rng = random.Random(42)
+    images = []
+    for _ in range(count):
+        color = tuple(rng.randrange(256) for _ in range(3))
+        buffer = io.BytesIO()
+        Image.new("RGB", (600, 800), color).save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+def build_invoice_data(image: bytes) -> str:
+    invoice = dict(SAMPLE_INVOICE)
+    invoice["numeroFactura"] = f"LT-{uuid.uuid4().hex[:12]}"
+    invoice["metadata"] = {
+        "fileName": "factura.png",
+        "fileSize": len(image),
+        "mimeType": "image/png",
+        "processedAt": "2024-03-15T10:00:00",
+        "model": "gpt-4o"
+    }
+    return json.dumps(invoice)
+
+async def call_extract(client, ctx):
+    image = random.choice(ctx["images"])
+    return await client.post(
+        "/api/invoices/extract",
+        files={"file": ("factura.png", image, "image/png")}
+    )
+
+async def call_validate(client, ctx):
+    image = random.choice(ctx["images"])
+    return await client.post(
+        "/api/invoices/validate",
+        data={"invoice_data": build_invoice_data(image), "validatedBy": "loadtest@example.com"},
+        files={"file": ("factura.png", image, "image/png")}
+    )
+
+async def call_list(client, ctx):
+    # Una de cada cuatro consultas usa la búsqueda por número
+    params = {"limit": 50}
+    if random.random() < 0.25:
+        params["numero"] = "LT-" + uuid.uuid4().hex[:2]
+    return await client.get("/api/invoices", params=params)
+
+async def call_stats(client, ctx):
+    return await client.get("/api/invoices/stats/summary")
+
+async def call_login(client, ctx):
+    index = random.randrange(ctx["num_users"])
+    return await client.post("/api/auth/login", json={
+        "email": f"user{index}@example.com",
+        "password": f"password{index}"
+    })
+
+ENDPOINTS = {
+    "extract": call_extract,
+    "validate": call_validate,
+    "list": call_list,
+    "stats": call_stats,
+    "login": call_login,
+}
+
+async def run_load(base_url: str, ctx: dict, mix: Dict[str, float], total_requests: int,
+                   duration: float, concurrency: int, seed_invoices: int) -> dict:
+    import httpx
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    status_codes = {name: {} for name in names}
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        # Datos iniciales para que listado y estadísticas no trabajen sobre una colección vacía
+        for _ in range(seed_invoices):
+            await call_validate(client, ctx)
+
+        remaining = total_requests
+        deadline = time.monotonic() + duration if duration else None
+
+        async def worker():
+            nonlocal remaining
+            while True:
+                if deadline is not None:
+                    if time.monotonic() >= deadline:
+                        return
+                else:
+                    if remaining <= 0:
+                        return
+                    remaining -= 1
+
+                name = random.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    response = await ENDPOINTS[name](client, ctx)
+                    code = str(response.status_code)
+                    failed = response.status_code >= 400
+                except Exception as e:
+                    code = type(e).__name__
+                    failed = True
+                latencies[name].append(time.perf_counter() - start)
+                status_codes[name][code] = status_codes[name].get(code, 0) + 1
+                if failed:
+                    errors[name] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    endpoints = {}
+    for name in names:
+        endpoints[name] = summarize_latencies(latencies[name], elapsed, errors[name])
+        endpoints[name]["status_codes"] = status_codes[name]
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "total": summarize_latencies(all_latencies, elapsed, sum(errors.values())),
+        "endpoints": endpoints,
+    }
+
+def start_s3_server() -> "object":
+    """Servidor de moto con el bucket de pruebas creado"""
+    import boto3
+    from moto.server import ThreadedMotoServer
+    from benchmarks._common import free_port
+
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    endpoint = f"http://127.0.0.1:{port}"
+    boto3.client(
+        "s3",
+        region_name="us-east-1",
+        endpoint_url=endpoint,
+        aws_access_key_id="loadtest",
+        aws_secret_access_key="loadtest"
+    ).create_bucket(Bucket=BUCKET_NAME)
+    os.environ.update({
+        "AWS_S3_ENDPOINT_URL": endpoint,
+        "AWS_S3_BUCKET_NAME": BUCKET_NAME,
+        "AWS_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "loadtest",
+        "AWS_SECRET_ACCESS_KEY": "loadtest",
+    })
+    return server
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Prueba de carga del backend con OpenAI, MongoDB y S3 locales")
+    parser.add_argument('--requests', type=int, default=2000, help="Peticiones totales (ignorado si se usa --duration)")
+    parser.add_argument('--duration', type=float, default=0, help="Duración en segundos en lugar de un total fijo")
+    parser.add_argument('--concurrency', type=int, default=50, help="Clientes simultáneos")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Pesos por endpoint")
+    parser.add_argument('--seed-invoices', type=int, default=50, help="Facturas creadas antes de medir")
+    parser.add_argument('--users', type=int, default=1000, help="Usuarios en la base temporal")
+    parser.add_argument('--images', type=int, default=50, help="Imágenes distintas usadas en extract/validate")
+    parser.add_argument('--openai-latency-ms', type=float, default=800, help="Mediana de latencia del OpenAI falso")
+    parser.add_argument('--openai-latency-sigma', type=float, default=0.4, help="Dispersión log-normal de la latencia")
+    parser.add_argument('--openai-error-rate', type=float, default=0.0, help="Probabilidad de error 429/500 del OpenAI falso")
+    parser.add_argument('--mongo-uri', default=None, help="mongod local a usar (default: mongomock-motor en memoria)")
+    parser.add_argument('--no-s3', action='store_true', help="Ejecutar sin S3 (sin moto)")
+    parser.add_argument('--seed', type=int, default=None, help="Semilla para la mezcla de peticiones y el OpenAI falso")
+    parser.add_argument('--output', help="Guardar el resultado JSON en este archivo")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    logging.disable(logging.WARNING)
+
+    fake_openai = ServerThread(create_fake_openai_app(
+        args.openai_latency_ms, args.openai_latency_sigma, args.openai_error_rate, args.seed
+    )).start()
+    s3_server = None if args.no_s3 else start_s3_server()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "users.db")
+        create_users_db(db_path, args.users)
+
+        # Configurar antes de importar la aplicación
+        os.environ["OPENAI_API_KEY"] = "sk-loadtest"
+        os.environ["OPENAI_BASE_URL"] = f"{fake_openai.url}/v1"
+        os.environ["USERS_DB_PATH"] = db_path
+        os.environ["MONGODB_DB"] = f"loadtest_{uuid.uuid4().hex[:8]}"
+        # Las imágenes de prueba son lisas (mismo hash perceptual): sin estos motores
+        # cada /extract después del primero no llegaría a OpenAI
+        os.environ["NEAR_DUPLICATE_ENABLED"] = "false"
+        os.environ["TEMPLATES_ENABLED"] = "false"
+        if args.mongo_uri:
+            os.environ["MONGODB_URI"] = args.mongo_uri
+        set_default_env()
+
+        import main
+        if not args.mongo_uri:
+            from mongomock_motor import AsyncMongoMockClient
+            import database.mongodb
+            database.mongodb.AsyncIOMotorClient = AsyncMongoMockClient
+
+        app_server = ServerThread(main.app).start()
+        try:
+            ctx = {"images": build_images(args.images), "num_users": args.users}
+            result = asyncio.run(run_load(
+                app_server.url, ctx, mix, args.requests, args.duration, args.concurrency, args.seed_invoices
+            ))
+        finally:
+            if args.mongo_uri:
+                # Eliminar la base temporal del mongod real
+                from pymongo import MongoClient
+                MongoClient(args.mongo_uri).drop_database(os.environ["MONGODB_DB"])
+            app_server.stop()
+            fake_openai.stop()
+            if s3_server:
+                s3_server.stop()
+
+    result.update({
+        "benchmark": "loadtest",
+        "revision": git_revision(),
+        "params": vars(args),
+        "fake_openai": fake_openai.server.config.app.state.stats,
+        "stack": {
+            "mongo": "mongod" if args.mongo_uri else "mongomock-motor",
+            "s3": "disabled" if args.no_s3 else "moto",
+        },
+    })
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == '__main__':
+    main_cli()
@@ -1,19 +1,98 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     # OpenAI
     OPENAI_API_KEY: str
+    OPENAI_MODEL_TIERS: List[str] = ["gpt-4o-mini", "gpt-4o"]  # Se escala al siguiente si la extracción no valida
+    OPENAI_MAX_TOKENS: int = 2000
+    OPENAI_REPAIR_MAX_TOKENS: int = 400  # Reparación de campos: solo se piden los campos con error
+    ENCODED_IMAGE_CACHE_MB: int = 64  # Imágenes ya codificadas, reutilizadas al reparar
+    VISION_BANDS_ENABLED: bool = False  # Extraer las tablas de conceptos largas en franjas con llamadas concurrentes
+    VISION_BAND_MIN_LINES: int = 60  # Líneas de texto en la página a partir de las que se divide
+    VISION_BAND_LINES: int = 24  # Líneas por franja (la latencia crece con el tamaño de la franja)
+    VISION_BAND_OVERLAP_LINES: int = 2  # Líneas repetidas entre franjas para no cortar filas
+    VISION_BAND_WORKERS: int = 16  # Llamadas de franjas simultáneas en el proceso
+    PREPASS_ENABLED: bool = True  # Leer el QR del CFDI (opencv-python-headless) y la capa de texto antes de Vision
+    OPENAI_BASE_URL: Optional[str] = None  # Default: API oficial (útil para servidores compatibles o de prueba)
+    OPENAI_REPLAY_MODE: Optional[str] = None  # record | replay | auto (grabar/reproducir respuestas)
+    OPENAI_REPLAY_DIR: Optional[str] = None  # Carpeta de fixtures grabados
+    OPENAI_REPLAY_LATENCY_SCALE: float = 0.0  # 1.0 = reproducir con la latencia grabada
     
     # MongoDB
     MONGODB_URI: str
     MONGODB_DB: str = "facturas_db"
     
+    # SQLite (usuarios)
+    USERS_DB_PATH: Optional[str] = None  # Default: ../data/users.db
+    SQLITE_POOL_SIZE: int = 4
+    
+    # Sesiones (tokens firmados con HMAC)
+    SESSION_SECRET: Optional[str] = None  # Obligatorio con AUTH_REQUIRED; sin él, secreto aleatorio por proceso (solo desarrollo)
+    SESSION_TTL_SECONDS: int = 8 * 3600
+    USER_CACHE_TTL_SECONDS: int = 300
+    USER_CACHE_MAX_ENTRIES: int = 10000
+    AUTH_REQUIRED: bool = False  # Exigir token en las rutas protegidas
+    
+    # Límites de tamaño de las peticiones (bytes)
+    MAX_FILE_SIZE: int = 1 * 1024 * 1024  # Archivo de factura
+    MAX_REQUEST_BODY_SIZE: int = 1 * 1024 * 1024  # Cuerpo de las rutas sin límite propio
+    UPLOAD_LIMITS: Dict[str, int] = {  # Cuerpo completo por ruta (archivo + campos del formulario)
+        "/api/invoices/extract": 1 * 1024 * 1024 + 64 * 1024,
+        "/api/invoices/validate": 3 * 1024 * 1024,
+    }
+    
+    # Archivos en espera entre /extract y /validate (se suben una sola vez)
+    STAGING_BACKEND: Optional[str] = None  # local | s3 (default: s3 si está configurado)
+    STAGING_DIR: Optional[str] = None  # Backend local. Default: ../data/staging
+    STAGING_TTL_SECONDS: int = 24 * 3600
+    STAGING_PURGE_INTERVAL_SECONDS: int = 600  # Frecuencia mínima del barrido de expirados
+    
+    # Facturas casi idénticas (hash perceptual de la primera página)
+    NEAR_DUPLICATE_ENABLED: bool = False  # Reutilizar la extracción validada de la misma factura (confirmada por sha256, UUID o folio)
+    NEAR_DUPLICATE_MAX_DISTANCE: int = 4  # Bits de diferencia (de 64) para considerar la misma hoja
+    NEAR_DUPLICATE_REFRESH_SECONDS: int = 30  # Cada cuánto se cargan los hashes guardados por otros procesos
+    
+    # Plantillas por proveedor (RFC) aprendidas de facturas validadas
+    TEMPLATES_ENABLED: bool = True
+    TEMPLATE_MIN_SAMPLES: int = 3  # Facturas validadas necesarias antes de usar la plantilla
+    TEMPLATE_MAX_SAMPLES: int = 10  # Muestras recientes que se conservan por proveedor
+    TEMPLATE_MIN_CONFIDENCE: float = 0.9  # Por debajo se extrae con OpenAI
+    
+    # Motores de extracción (xml, template, text-layer, local-ocr, near-duplicate, vision)
+    EXTRACTION_ENGINES: List[str] = ["xml", "template", "near-duplicate", "vision"]  # Habilitados para /extract
+    ENGINE_STATS_WINDOW: int = 200  # Extracciones recientes por motor y tipo de archivo para latencia y tasa de éxito
+    ENGINE_MIN_SAMPLES: int = 20  # Con menos mediciones se usa la latencia estimada del motor
+    ENGINE_EXPLORATION_RATE: float = 0.05  # Fracción de documentos que recorre los motores en el orden configurado
+    ENGINE_SHADOW: Dict[str, float] = {}  # Motor candidato -> fracción del tráfico en que corre en sombra
+    ENGINE_SHADOW_TTL_DAYS: int = 30  # Antigüedad máxima de los resultados en sombra guardados
+    OCR_LANGUAGES: str = "spa+eng"  # Idiomas de Tesseract para el motor local-ocr
+    
+    # Backlog con la Batch API de OpenAI (python batch_extract.py)
+    BATCH_OPENAI_API_KEY: Optional[str] = None  # Otro proyecto para no consumir los límites interactivos (default: OPENAI_API_KEY)
+    BATCH_OPENAI_BASE_URL: Optional[str] = None  # Default: OPENAI_BASE_URL
+    BATCH_MAX_REQUESTS: int = 5000  # Documentos por batch (la API admite hasta 50 000)
+    BATCH_MAX_FILE_MB: int = 100  # Tamaño máximo del JSONL de un batch (la API admite hasta 200 MB)
+    BATCH_MAX_ENQUEUED_TOKENS: int = 2_000_000  # Tokens de entrada estimados en batches sin terminar, por modelo
+    BATCH_MAX_ATTEMPTS: int = 3  # Batches fallidos o expirados antes de dar un documento por fallido
+    BATCH_POLL_SECONDS: int = 60  # Espera entre consultas de batch_extract.py run
+    
+    # Idempotency-Key en /extract y /validate
+    IDEMPOTENCY_TTL_SECONDS: int = 24 * 3600  # Tiempo que se conserva la respuesta guardada
+    IDEMPOTENCY_LOCK_SECONDS: int = 600  # Tras este tiempo una petición "en curso" se da por abandonada
+    IDEMPOTENCY_WAIT_SECONDS: int = 120  # Espera máxima de una petición repetida por la original
+    
     # AWS S3 (opcional)
     AWS_REGION: Optional[str] = None
     AWS_ACCESS_KEY_ID: Optional[str] = None
     AWS_SECRET_ACCESS_KEY: Optional[str] = None
     AWS_S3_BUCKET_NAME: Optional[str] = None
+    AWS_S3_ENDPOINT_URL: Optional[str] = None  # Default: endpoint de AWS (p. ej. MinIO o moto en pruebas)
+    
+    # Miniaturas de vista previa
+    THUMBNAIL_MAX_SIZE: int = 800  # Lado mayor en píxeles
+    THUMBNAIL_QUALITY: int = 75  # Calidad WebP (0-100)
+    RASTER_POOL_WORKERS: Optional[int] = None  # Procesos para rasterizar (default: CPUs)
     
     # Server
     HOST: str = "0.0.0.0"
@@ -1,106 +1,268 @@
 import sqlite3
-import os
+import asyncio
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
+from config import settings
+
+logger = logging.getLogger(__name__)
 
 # Ruta a la base de datos SQLite del proyecto principal
 DB_PATH = Path(__file__).parent.parent.parent / "data" / "users.db"
 
+# Pragmas aplicados a cada conexión del pool
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",      # Lectores concurrentes con un escritor
+    "PRAGMA synchronous=NORMAL",    # Seguro con WAL y mucho más rápido que FULL
+    "PRAGMA busy_timeout=5000",     # Esperar al escritor en lugar de fallar con "database is locked"
+    "PRAGMA cache_size=-8000",      # ~8MB de cache de páginas por conexión
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=67108864",    # 64MB de lectura por mmap
+]
+
+class SQLiteConnectionPool:
+    """Pool de conexiones SQLite reutilizables entre hilos"""
+    
+    def __init__(self, db_path: str, size: int = 4):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._semaphore = threading.BoundedSemaphore(size)
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=256
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    @contextmanager
+    def connection(self):
+        """Tomar una conexión del pool (creándola si aún no existe) y devolverla al terminar"""
+        self._semaphore.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            reusable = True
+            try:
+                yield conn
+            except Exception:
+                try:
+                    conn.rollback()
+                except sqlite3.Error:
+                    # Una conexión que no puede deshacer su transacción no vuelve al pool
+                    reusable = False
+                    conn.close()
+                raise
+            finally:
+                if reusable:
+                    self._idle.put_nowait(conn)
+        finally:
+            self._semaphore.release()
+    
+    def close(self):
+        """Cerrar todas las conexiones inactivas"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
 class UserDatabase:
-    def __init__(self, db_path: str = None):
-        self.db_path = db_path or str(DB_PATH)
-        
-    def get_connection(self):
-        """Obtener conexión a la base de datos"""
-        return sqlite3.connect(self.db_path)
+    def __init__(self, db_path: str = None, pool_size: int = None):
+        self.db_path = db_path or settings.USERS_DB_PATH or str(DB_PATH)
+        pool_size = pool_size or settings.SQLITE_POOL_SIZE
+        self.pool = SQLiteConnectionPool(self.db_path, size=pool_size)
+        # Las consultas corren en hilos dedicados para no bloquear el event loop
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="sqlite")
+        self._fts_tokenizer = None  # trigram | unicode61 | "" (sin users_fts); se lee una sola vez
+        self._revocations_ready = False
+    
+    def _fetchone(self, sql: str, params: tuple = ()):
+        with self.pool.connection() as conn:
+            row = conn.execute(sql, params).fetchone()
+        return dict(row) if row else None
+    
+    def _fetchall(self, sql: str, params: tuple = ()):
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+    
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        with self.pool.connection() as conn:
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor.rowcount
+    
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
     
-    def get_user_by_email(self, email: str):
+    async def get_user_by_email(self, email: str):
         """Buscar usuario por email"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute(
+        return await self._run(
+            self._fetchone,
             "SELECT * FROM users WHERE email = ?",
             (email,)
         )
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return dict(row)
-        return None
     
-    def get_all_users(self):
-        """Obtener todos los usuarios"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    def _get_fts_tokenizer(self) -> str:
+        """
+        Tokenizer de la tabla users_fts creada por migrate_user_indexes.py, o "" si no existe
         
-        cursor.execute(
-            "SELECT id, name, email, role, is_active, created_at FROM users ORDER BY created_at DESC"
+        Se lee de la definición guardada en sqlite_master (el script elige
+        trigram o, en SQLite < 3.34, unicode61).
+        """
+        if self._fts_tokenizer is None:
+            row = self._fetchone("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'")
+            if row is None:
+                self._fts_tokenizer = ""
+            else:
+                self._fts_tokenizer = "trigram" if "trigram" in row["sql"] else "unicode61"
+        return self._fts_tokenizer
+    
+    async def get_all_users(self, limit: int = None, offset: int = 0):
+        """Obtener usuarios paginados (todos si no se indica limit) y el total"""
+        users = await self._run(
+            self._fetchall,
+            """SELECT id, name, email, role, is_active, created_at
+               FROM users
+               ORDER BY created_at DESC
+               LIMIT ? OFFSET ?""",
+            (limit if limit is not None else -1, offset)
         )
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [dict(row) for row in rows]
+        count = await self._run(self._fetchone, "SELECT COUNT(*) AS total FROM users")
+        return users, count["total"]
     
-    def search_users(self, query: str):
-        """Buscar usuarios por nombre o email"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    def _search_users(self, query: str, limit: int, offset: int):
+        tokenizer = self._get_fts_tokenizer()
+        # trigram necesita al menos 3 caracteres; consultas más cortas usan LIKE
+        if tokenizer == "unicode61" or (tokenizer == "trigram" and len(query) >= 3):
+            # Con trigram la frase entre comillas busca la subcadena exacta; con
+            # unicode61 solo hay palabras completas, así que la última se busca
+            # por prefijo ("q"*). rank = bm25
+            match = '"' + query.replace('"', '""') + '"'
+            if tokenizer == "unicode61":
+                match += '*'
+            users = self._fetchall(
+                """SELECT u.id, u.name, u.email, u.role, u.is_active, u.created_at
+                   FROM users_fts
+                   JOIN users u ON u.id = users_fts.rowid
+                   WHERE users_fts MATCH ?
+                   ORDER BY users_fts.rank, u.created_at DESC
+                   LIMIT ? OFFSET ?""",
+                (match, limit, offset)
+            )
+            count = self._fetchone(
+                "SELECT COUNT(*) AS total FROM users_fts WHERE users_fts MATCH ?",
+                (match,)
+            )
+            return users, count["total"]
         
         search_pattern = f"%{query}%"
-        cursor.execute(
-            """SELECT id, name, email, role, is_active, created_at 
-               FROM users 
+        users = self._fetchall(
+            """SELECT id, name, email, role, is_active, created_at
+               FROM users
                WHERE name LIKE ? OR email LIKE ?
-               ORDER BY created_at DESC""",
+               ORDER BY created_at DESC
+               LIMIT ? OFFSET ?""",
+            (search_pattern, search_pattern, limit, offset)
+        )
+        count = self._fetchone(
+            "SELECT COUNT(*) AS total FROM users WHERE name LIKE ? OR email LIKE ?",
             (search_pattern, search_pattern)
         )
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [dict(row) for row in rows]
+        return users, count["total"]
+    
+    async def search_users(self, query: str, limit: int = None, offset: int = 0):
+        """Buscar usuarios por nombre o email (ordenados por relevancia) y el total de coincidencias"""
+        return await self._run(
+            self._search_users,
+            query,
+            limit if limit is not None else -1,
+            offset
+        )
+    
+    def _ensure_revocations(self) -> None:
+        """Crear (una sola vez) la tabla con el instante de revocación de los tokens de cada usuario"""
+        if not self._revocations_ready:
+            self._execute(
+                """CREATE TABLE IF NOT EXISTS session_revocations (
+                       user_id INTEGER PRIMARY KEY,
+                       revoked_at REAL NOT NULL
+                   )"""
+            )
+            self._revocations_ready = True
+    
+    def _get_auth_record(self, user_id: int):
+        self._ensure_revocations()
+        return self._fetchone(
+            """SELECT u.id, u.role, u.is_active, r.revoked_at
+               FROM users u
+               LEFT JOIN session_revocations r ON r.user_id = u.id
+               WHERE u.id = ?""",
+            (user_id,)
+        )
+    
+    async def get_auth_record(self, user_id: int):
+        """Campos de autorización de un usuario (id, role, is_active, revoked_at), o None si no existe"""
+        return await self._run(self._get_auth_record, user_id)
     
-    def update_user_role(self, user_id: int, role: str):
+    def _revoke_sessions(self, user_id: int, revoked_at: float) -> None:
+        self._ensure_revocations()
+        self._execute(
+            """INSERT INTO session_revocations (user_id, revoked_at) VALUES (?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET revoked_at = excluded.revoked_at""",
+            (user_id, revoked_at)
+        )
+    
+    async def revoke_sessions(self, user_id: int, revoked_at: float) -> None:
+        """Invalidar para todos los procesos los tokens del usuario emitidos hasta revoked_at"""
+        await self._run(self._revoke_sessions, user_id, revoked_at)
+    
+    async def update_user_role(self, user_id: int, role: str):
         """Actualizar el rol de un usuario"""
         if role not in ['user', 'admin']:
             raise ValueError("Role must be 'user' or 'admin'")
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
+        affected_rows = await self._run(
+            self._execute,
             "UPDATE users SET role = ? WHERE id = ?",
             (role, user_id)
         )
-        
-        conn.commit()
-        affected_rows = cursor.rowcount
-        conn.close()
-        
         return affected_rows > 0
     
-    def delete_user(self, user_id: int):
+    async def delete_user(self, user_id: int):
         """Eliminar un usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
+        affected_rows = await self._run(
+            self._execute,
             "DELETE FROM users WHERE id = ?",
             (user_id,)
         )
-        
-        conn.commit()
-        affected_rows = cursor.rowcount
-        conn.close()
-        
         return affected_rows > 0
+    
+    def close(self):
+        """Cerrar el pool de conexiones y el executor"""
+        self.executor.shutdown(wait=True)
+        self.pool.close()
 
+@lru_cache(maxsize=1)
 def get_user_db():
-    """Obtener instancia de UserDatabase"""
+    """Obtener la instancia compartida de UserDatabase"""
     return UserDatabase()
+
+def close_user_db():
+    """Cerrar la instancia compartida (si se creó)"""
+    if get_user_db.cache_info().currsize:
+        get_user_db().close()
+        get_user_db.cache_clear()
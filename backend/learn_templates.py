@@ -0,0 +1,94 @@
+"""
+Aprender plantillas de proveedor a partir de facturas ya validadas
+
+Busca facturas PDF validadas (metadata.validatedAt) con RFC de proveedor y
+archivo en S3, descarga el original, lee su capa de texto y la agrega a la
+plantilla del proveedor. Solo se usan las TEMPLATE_MAX_SAMPLES facturas más
+recientes de cada proveedor.
+
+Uso:
+    python learn_templates.py [--limit N] [--concurrency N]
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from config import settings
+from database.mongodb import connect_to_mongo, close_mongo_connection, get_collection
+from services.s3_services import S3Service
+from services.template_service import TemplateService
+
+async def learn(limit: int = 0, concurrency: int = 4) -> int:
+    print('📐 Aprendiendo plantillas de proveedor...')
+    await connect_to_mongo()
+
+    try:
+        s3_service = S3Service()
+        if not s3_service.client:
+            print('❌ S3 no está configurado')
+            return 1
+        return await _learn_from_s3(s3_service, limit, concurrency)
+    finally:
+        await close_mongo_connection()
+
+async def _learn_from_s3(s3_service: S3Service, limit: int, concurrency: int) -> int:
+    template_service = TemplateService()
+    collection = get_collection("invoices")
+    query = {
+        "metadata.validatedAt": {"$ne": None},
+        "metadata.mimeType": "application/pdf",
+        "metadata.s3Key": {"$exists": True, "$ne": None},
+        "proveedor.rfc": {"$exists": True, "$nin": [None, ""]}
+    }
+
+    # Las más recientes de cada proveedor
+    per_supplier = defaultdict(list)
+    cursor = collection.find(query).sort("metadata.validatedAt", -1)
+    if limit:
+        cursor = cursor.limit(limit)
+    async for invoice in cursor:
+        samples = per_supplier[invoice["proveedor"]["rfc"].strip().upper()]
+        if len(samples) < settings.TEMPLATE_MAX_SAMPLES:
+            samples.append(invoice)
+    print(f'📋 Proveedores: {len(per_supplier)} | Facturas: {sum(len(s) for s in per_supplier.values())}')
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {"ready": 0, "pending": 0, "failed": 0}
+
+    async def process(rfc, invoices):
+        async with semaphore:
+            template = None
+            # De la más antigua a la más reciente, como si se validaran en orden
+            for invoice in reversed(invoices):
+                invoice_id = str(invoice.pop("_id"))
+                s3_key = invoice.pop("metadata")["s3Key"]
+                try:
+                    response = await asyncio.to_thread(
+                        s3_service.client.get_object,
+                        Bucket=s3_service.bucket_name,
+                        Key=s3_key
+                    )
+                    file_content = await asyncio.to_thread(response['Body'].read)
+                    text = await template_service.read_text(file_content)
+                    template = await template_service.learn(invoice, text, invoice_id) or template
+                except Exception as error:
+                    results["failed"] += 1
+                    print(f'  ⚠️  {rfc} / {invoice_id}: {error}')
+
+            if template and template["ready"]:
+                results["ready"] += 1
+                print(f'  ✅ {rfc}: {", ".join(template["fields"])}{" + conceptos" if template["items"] else ""}')
+            else:
+                results["pending"] += 1
+                print(f'  ⏳ {rfc}: sin plantilla todavía')
+
+    await asyncio.gather(*(process(rfc, invoices) for rfc, invoices in per_supplier.items()))
+
+    print(f'\n🎉 Plantillas listas: {results["ready"]} | Sin plantilla: {results["pending"]} | Errores: {results["failed"]}')
+    return 0 if results["failed"] == 0 else 1
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Aprender plantillas de proveedor de facturas validadas")
+    parser.add_argument('--limit', type=int, default=0, help="Máximo de facturas a revisar (0 = todas)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Proveedores procesados en paralelo")
+    args = parser.parse_args()
+    exit(asyncio.run(learn(limit=args.limit, concurrency=args.concurrency)))
@@ -1,7 +1,14 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers import invoices, auth
 from database.mongodb import connect_to_mongo, close_mongo_connection
+from database.sqlite import close_user_db
+from services.raster_pool import shutdown_raster_pool
+from middleware import BodySizeLimitMiddleware
+from services.auth_service import check_session_config, get_current_user
+from services.idempotency_service import IdempotencyService
+from services.near_duplicate_service import NearDuplicateService
+from services.extraction_engines import engine_registry
 from config import settings
 import uvicorn
 import logging
@@ -22,6 +29,14 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# Rechazar cuerpos demasiado grandes sin recibirlos completos (CORS se agrega después
+# para que envuelva también las respuestas 413)
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits=settings.UPLOAD_LIMITS,
+    default_limit=settings.MAX_REQUEST_BODY_SIZE
+)
+
 # Configurar CORS para permitir comunicación con el frontend
 app.add_middleware(
     CORSMiddleware,
@@ -36,7 +51,11 @@ app.add_middleware(
 async def startup_event():
     """Conectar a MongoDB al iniciar"""
     logger.info("🚀 Iniciando aplicación...")
+    check_session_config()
     await connect_to_mongo()
+    await IdempotencyService().ensure_indexes()
+    await NearDuplicateService().ensure_indexes()
+    await engine_registry.ensure_indexes()
     logger.info("✅ Aplicación lista")
 
 @app.on_event("shutdown")
@@ -44,10 +63,18 @@ async def shutdown_event():
     """Cerrar conexiones al apagar"""
     logger.info("🛑 Cerrando aplicación...")
     await close_mongo_connection()
+    close_user_db()
+    shutdown_raster_pool()
     logger.info("✅ Aplicación cerrada")
 
 # Incluir routers
-app.include_router(invoices.router, prefix="/api/invoices", tags=["invoices"])
+# Las rutas de facturas verifican el token de sesión (sin consultar la base de usuarios)
+app.include_router(
+    invoices.router,
+    prefix="/api/invoices",
+    tags=["invoices"],
+    dependencies=[Depends(get_current_user)]
+)
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 
 @app.get("/")
@@ -0,0 +1,3 @@
+from .upload_limit import BodySizeLimitMiddleware
+
+__all__ = ["BodySizeLimitMiddleware"]
@@ -0,0 +1,73 @@
+from fastapi import HTTPException, status
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Métodos sin cuerpo: no se revisan
+_BODYLESS_METHODS = {"GET", "HEAD", "OPTIONS", "DELETE"}
+
+def _too_large_detail(limit: int) -> str:
+    return f"Petición demasiado grande. Máximo permitido: {limit / 1024 / 1024:.2f}MB"
+
+class BodySizeLimitMiddleware:
+    """
+    Limitar el tamaño del cuerpo de las peticiones sin cargarlo completo
+    
+    Rechaza con 413 antes de leer nada si Content-Length supera el límite de
+    la ruta, y si no lo declara (chunked) o miente, cuenta los bytes mientras
+    se reciben y corta en cuanto se pasa el límite. Así un archivo enorme
+    nunca se termina de recibir ni de guardar en memoria.
+    """
+    
+    def __init__(self, app: ASGIApp, limits: Dict[str, int], default_limit: int):
+        self.app = app
+        self.limits = limits
+        self.default_limit = default_limit
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in _BODYLESS_METHODS:
+            await self.app(scope, receive, send)
+            return
+        
+        path = scope["path"]
+        limit = self.limits.get(path.rstrip("/") or "/", self.default_limit)
+        
+        content_length = None
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    pass
+                break
+        
+        if content_length is not None and content_length > limit:
+            logger.warning(f"⚠️ Petición rechazada por tamaño ({content_length} bytes > {limit}): {path}")
+            response = JSONResponse(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                content={"detail": _too_large_detail(limit)},
+                headers={"Connection": "close"}
+            )
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    logger.warning(f"⚠️ Cuerpo cortado al pasar el límite ({limit} bytes): {path}")
+                    # FastAPI propaga las HTTPException lanzadas al leer el cuerpo
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=_too_large_detail(limit)
+                    )
+            return message
+        
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,138 @@
+"""
+Migración de objetos de S3 al esquema direccionado por contenido
+
+Reescribe metadata.s3Key de las facturas existentes (invoices/<timestamp>_<nombre>)
+al nuevo esquema sha256/xx/yy/<hash>. Los objetos se copian del lado del servidor
+(copy_object), sin volver a subirlos, y los duplicados se copian una sola vez.
+Al final reconstruye la colección s3_objects con el conteo de referencias.
+
+Uso:
+    python migrate_s3_content_keys.py [--dry-run] [--delete-old]
+"""
+import argparse
+import hashlib
+from datetime import datetime
+from pymongo import MongoClient
+from config import settings
+from services.s3_services import S3Service, CONTENT_KEY_PREFIX
+
+def hash_object(s3_service: S3Service, s3_key: str) -> str:
+    """Calcular el sha256 de un objeto leyéndolo en bloques"""
+    response = s3_service.client.get_object(Bucket=s3_service.bucket_name, Key=s3_key)
+    digest = hashlib.sha256()
+    for chunk in response['Body'].iter_chunks(chunk_size=1024 * 1024):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def rebuild_refs(db) -> int:
+    """Reconstruir la colección s3_objects a partir de las facturas"""
+    pipeline = [
+        {"$match": {"metadata.s3Key": {"$regex": f"^{CONTENT_KEY_PREFIX}"}}},
+        {"$group": {"_id": "$metadata.s3Key", "refCount": {"$sum": 1}}}
+    ]
+    refs = db["s3_objects"]
+    refs.delete_many({})
+    now = datetime.utcnow()
+    count = 0
+    for group in db["invoices"].aggregate(pipeline):
+        refs.insert_one({
+            "_id": group["_id"],
+            "refCount": group["refCount"],
+            "createdAt": now,
+            "updatedAt": now
+        })
+        count += 1
+    return count
+
+def run_migration(dry_run: bool = False, delete_old: bool = False) -> int:
+    print('🔄 Starting S3 content-addressed key migration...')
+    
+    s3_service = S3Service()
+    if not s3_service.client:
+        print('❌ S3 no está configurado')
+        return 1
+    
+    client = MongoClient(settings.MONGODB_URI)
+    try:
+        db = client[settings.MONGODB_DB]
+        invoices = db["invoices"]
+        
+        query = {"metadata.s3Key": {"$exists": True, "$ne": None, "$not": {"$regex": f"^{CONTENT_KEY_PREFIX}"}}}
+        total = invoices.count_documents(query)
+        print(f'📋 Facturas a migrar: {total}')
+        
+        # old key -> new key, para no copiar dos veces el mismo objeto
+        migrated = {}
+        copied = 0
+        skipped = 0
+        failed = 0
+        
+        for invoice in invoices.find(query, {"metadata.s3Key": 1}):
+            old_key = invoice["metadata"]["s3Key"]
+            try:
+                new_key = migrated.get(old_key)
+                if new_key is None:
+                    digest = hash_object(s3_service, old_key)
+                    new_key = f"{CONTENT_KEY_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}"
+                    
+                    if s3_service.object_exists(new_key):
+                        skipped += 1
+                    elif not dry_run:
+                        s3_service.client.copy_object(
+                            Bucket=s3_service.bucket_name,
+                            Key=new_key,
+                            CopySource={"Bucket": s3_service.bucket_name, "Key": old_key},
+                            MetadataDirective="COPY"
+                        )
+                        copied += 1
+                    migrated[old_key] = new_key
+                
+                print(f'  {invoice["_id"]}: {old_key} -> {new_key}')
+                if not dry_run:
+                    invoices.update_one(
+                        {"_id": invoice["_id"]},
+                        {"$set": {
+                            "metadata.s3Key": new_key,
+                            "metadata.s3Url": s3_service.build_url(new_key),
+                            "updatedAt": datetime.utcnow()
+                        }}
+                    )
+            except Exception as error:
+                failed += 1
+                print(f'  ⚠️  {invoice["_id"]}: no se pudo migrar {old_key}: {error}')
+        
+        print(f'\n📦 Objetos copiados: {copied} | Ya existentes (duplicados): {skipped} | Errores: {failed}')
+        
+        if dry_run:
+            print('\nℹ️  Dry run: no se modificó nada')
+            return 0
+        
+        ref_count = rebuild_refs(db)
+        print(f'🔢 Referencias reconstruidas: {ref_count} objetos')
+        
+        if delete_old:
+            deleted = 0
+            for old_key in migrated:
+                # Solo borrar si ninguna factura sigue apuntando al key antiguo
+                if invoices.count_documents({"metadata.s3Key": old_key}, limit=1) == 0:
+                    if s3_service.delete_file(old_key):
+                        deleted += 1
+            print(f'🗑️  Objetos antiguos eliminados: {deleted}')
+        
+        print('\n🎉 Migration completed successfully!')
+        return 0 if failed == 0 else 1
+    
+    except Exception as error:
+        print(f'❌ Migration failed: {error}')
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        client.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrar metadata.s3Key al esquema sha256/xx/yy/<hash>")
+    parser.add_argument('--dry-run', action='store_true', help="Mostrar los cambios sin aplicarlos")
+    parser.add_argument('--delete-old', action='store_true', help="Eliminar los objetos antiguos tras migrar")
+    args = parser.parse_args()
+    exit(run_migration(dry_run=args.dry_run, delete_old=args.delete_old))
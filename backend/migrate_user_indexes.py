@@ -0,0 +1,107 @@
+import sqlite3
+from config import settings
+from database.sqlite import DB_PATH as DEFAULT_DB_PATH
+
+# La misma base que usa la aplicación (UserDatabase)
+DB_PATH = settings.USERS_DB_PATH or str(DEFAULT_DB_PATH)
+
+print(f"📂 Database path: {DB_PATH}")
+
+INDEXES = [
+    # Búsqueda por email en login (email ya es UNIQUE, pero se deja explícito)
+    "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)",
+    # Listado paginado ORDER BY created_at DESC
+    "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at DESC)",
+]
+
+# Triggers que mantienen users_fts sincronizada con users (tabla de contenido externo)
+FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+         INSERT INTO users_fts(rowid, name, email) VALUES (new.id, new.name, new.email);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+         INSERT INTO users_fts(users_fts, rowid, name, email) VALUES ('delete', old.id, old.name, old.email);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF name, email ON users BEGIN
+         INSERT INTO users_fts(users_fts, rowid, name, email) VALUES ('delete', old.id, old.name, old.email);
+         INSERT INTO users_fts(rowid, name, email) VALUES (new.id, new.name, new.email);
+       END""",
+]
+
+def get_fts_tokenizer() -> str:
+    """trigram permite buscar subcadenas (como LIKE '%q%'); requiere SQLite >= 3.34"""
+    version = tuple(int(part) for part in sqlite3.sqlite_version.split('.'))
+    if version >= (3, 34, 0):
+        return 'trigram'
+    print(f'⚠️  SQLite {sqlite3.sqlite_version} no soporta trigram, usando unicode61 (búsqueda por prefijo)')
+    return 'unicode61 remove_diacritics 2'
+
+def run_migration():
+    print('🔄 Starting user indexes / FTS5 migration...')
+    
+    try:
+        # Connect to database
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        
+        # Índices
+        for statement in INDEXES:
+            cursor.execute(statement)
+        conn.commit()
+        print('✅ Indexes created')
+        
+        # Check if FTS table exists
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'")
+        has_fts = cursor.fetchone() is not None
+        
+        if not has_fts:
+            print('📝 Creating users_fts (FTS5) table...')
+            tokenizer = get_fts_tokenizer()
+            cursor.execute(f"""
+                CREATE VIRTUAL TABLE users_fts USING fts5(
+                    name, email,
+                    content='users', content_rowid='id',
+                    tokenize="{tokenizer}"
+                )
+            """)
+        else:
+            print('ℹ️  users_fts table already exists')
+        
+        for statement in FTS_TRIGGERS:
+            cursor.execute(statement)
+        
+        # Reconstruir el índice a partir de los datos actuales
+        cursor.execute("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+        cursor.execute("INSERT INTO users_fts(users_fts) VALUES ('optimize')")
+        conn.commit()
+        print('✅ users_fts populated and triggers installed')
+        
+        cursor.execute("ANALYZE")
+        conn.commit()
+        
+        # Show query plans to confirm the indexes are used
+        print('\n📋 Query plans:')
+        for label, sql, params in [
+            ('login', "SELECT * FROM users WHERE email = ?", ('x@example.com',)),
+            ('list', "SELECT id FROM users ORDER BY created_at DESC LIMIT 50", ()),
+        ]:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = ' | '.join(row[-1] for row in cursor.fetchall())
+            print(f'  {label}: {plan}')
+        
+        cursor.execute('SELECT COUNT(*) FROM users_fts')
+        print(f'\n👥 Users indexed: {cursor.fetchone()[0]}')
+        
+        conn.close()
+        print('\n🎉 Migration completed successfully!')
+    
+    except Exception as error:
+        print(f'❌ Migration failed: {error}')
+        import traceback
+        traceback.print_exc()
+        return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    exit(run_migration())
@@ -1,20 +1,24 @@
-from pydantic import BaseModel, Field, field_validator, model_validator
-from typing import Optional, List
-from datetime import datetime
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, field_validator, model_validator
+from typing import Any, Dict, Optional, List
+from datetime import date, datetime
+from functools import lru_cache
+import math
 import re
 
+# Compilados una sola vez; los validadores corren por cada factura (y cada item)
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+VALID_CURRENCIES = ('MXN', 'USD', 'EUR', 'GBP', 'CAD', 'JPY', 'CNY')
+_VALID_CURRENCY_SET = frozenset(VALID_CURRENCIES)
+_CURRENCY_ERROR = f'Moneda debe ser una de: {", ".join(VALID_CURRENCIES)}'
+MAX_ITEMS = 1000
+MAX_DESCRIPTION_LENGTH = 500
+
 class Item(BaseModel):
-    descripcion: Optional[str] = Field(None, max_length=500)
+    # Field(ge=0) ya garantiza un número no negativo
+    descripcion: Optional[str] = Field(None, max_length=MAX_DESCRIPTION_LENGTH)
     cantidad: Optional[float] = Field(None, ge=0)
     precioUnitario: Optional[float] = Field(None, ge=0)
     total: Optional[float] = Field(None, ge=0)
-    
-    @field_validator('cantidad', 'precioUnitario', 'total')
-    @classmethod
-    def validate_numbers(cls, v):
-        if v is not None and (not isinstance(v, (int, float)) or v < 0):
-            raise ValueError('Debe ser un número positivo')
-        return v
 
 class Proveedor(BaseModel):
     nombre: Optional[str] = Field(None, max_length=255)
@@ -35,11 +39,16 @@ class Metadata(BaseModel):
     mimeType: Optional[str] = Field(None, max_length=100)
     processedAt: str
     model: Optional[str] = Field("gpt-4o", max_length=50)
+    engine: Optional[str] = Field(None, max_length=50)  # Motor de extracción (services/extraction_engines.py)
     validatedAt: Optional[str] = None
     validatedBy: Optional[str] = Field(None, max_length=255)
     wasModified: Optional[bool] = False
     s3Url: Optional[str] = Field(None, max_length=1000)
     s3Key: Optional[str] = Field(None, max_length=500)
+    uploadStatus: Optional[str] = Field(None, max_length=20)  # pending | completed | failed
+    thumbnailKey: Optional[str] = Field(None, max_length=500)
+    nearDuplicateOf: Optional[str] = Field(None, max_length=50)  # Extracción reutilizada de una factura casi idéntica
+    templateConfidence: Optional[float] = Field(None, ge=0, le=1)  # Extraída con la plantilla del proveedor
     
     @field_validator('fileName')
     @classmethod
@@ -57,7 +66,7 @@ class InvoiceBase(BaseModel):
     fechaVencimiento: Optional[str] = None
     proveedor: Optional[Proveedor] = None
     cliente: Optional[Cliente] = None
-    items: Optional[List[Item]] = Field(default_factory=list, max_length=1000)
+    items: Optional[List[Item]] = Field(default_factory=list, max_length=MAX_ITEMS)
     subtotal: Optional[float] = Field(None, ge=0)
     iva: Optional[float] = Field(None, ge=0)
     total: Optional[float] = Field(None, ge=0)
@@ -72,33 +81,33 @@ class InvoiceBase(BaseModel):
     def validate_date_format(cls, v):
         if v is not None and v.strip():
             # Validate YYYY-MM-DD format
-            if not re.match(r'^\d{4}-\d{2}-\d{2}$', v):
+            if not DATE_PATTERN.match(v):
                 raise ValueError('Fecha debe estar en formato YYYY-MM-DD')
-            # Try to parse to ensure it's a valid date
+            # fromisoformat es mucho más rápido; strptime cubre lo que no acepta (p. ej. dígitos no ASCII)
             try:
-                datetime.strptime(v, '%Y-%m-%d')
+                date.fromisoformat(v)
             except ValueError:
-                raise ValueError('Fecha inválida')
+                try:
+                    datetime.strptime(v, '%Y-%m-%d')
+                except ValueError:
+                    raise ValueError('Fecha inválida')
         return v
     
     @field_validator('moneda')
     @classmethod
     def validate_currency(cls, v):
         if v is not None and v.strip():
-            valid_currencies = ['MXN', 'USD', 'EUR', 'GBP', 'CAD', 'JPY', 'CNY']
-            if v.upper() not in valid_currencies:
-                raise ValueError(f'Moneda debe ser una de: {", ".join(valid_currencies)}')
-            return v.upper()
+            v = v.upper()
+            if v not in _VALID_CURRENCY_SET:
+                raise ValueError(_CURRENCY_ERROR)
         return v
     
     @field_validator('subtotal', 'iva', 'total')
     @classmethod
     def validate_amounts(cls, v):
-        if v is not None:
-            if not isinstance(v, (int, float)) or v < 0:
-                raise ValueError('Monto debe ser un número positivo')
-            if not float('-inf') < v < float('inf'):
-                raise ValueError('Monto debe ser un número finito')
+        # El signo ya lo valida Field(ge=0); aquí solo se descartan infinitos
+        if v is not None and not math.isfinite(v):
+            raise ValueError('Monto debe ser un número finito')
         return v
     
     @model_validator(mode='after')
@@ -134,3 +143,53 @@ class InvoiceResponse(BaseModel):
     message: str
     id: Optional[str] = None
     numeroFactura: Optional[str] = None
+
+@lru_cache(maxsize=None)
+def get_list_adapter(model: type) -> TypeAdapter:
+    """TypeAdapter de List[model] (construirlo es costoso, se reutiliza)"""
+    return TypeAdapter(List[model])
+
+def validate_invoices(data: List[Any], model: type = InvoiceCreate) -> list:
+    """
+    Validar muchas facturas en una sola pasada
+    
+    Raises:
+        ValidationError: Con la ubicación (índice) de cada factura inválida
+    """
+    return get_list_adapter(model).validate_python(data)
+
+# Campos implicados cuando falla la validación total = subtotal + IVA
+TOTALS_FIELDS = ('subtotal', 'iva', 'total')
+
+def invoice_field_errors(data: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Errores de validación de InvoiceBase agrupados por campo de primer nivel
+    
+    Los errores de la factura completa (la suma de totales) se asignan a
+    subtotal, iva y total. Como Pydantic solo valida la factura completa si
+    todos los campos son válidos, se repite la validación sin los campos
+    con error para no ocultar una suma que tampoco cuadra.
+    """
+    errors = {}
+    while True:
+        try:
+            InvoiceBase.model_validate({k: v for k, v in data.items() if k not in errors})
+            return errors
+        except ValidationError as e:
+            found = False
+            for error in e.errors():
+                message = error['msg'].removeprefix('Value error, ')
+                for field in (error['loc'][0],) if error['loc'] else TOTALS_FIELDS:
+                    if str(field) not in errors:
+                        errors[str(field)] = message
+                        found = True
+            if not found:
+                return errors
+
+class RepairRequest(BaseModel):
+    stagingToken: str = Field(..., min_length=64, max_length=64)
+    invoice: Dict[str, Any]
+    fields: List[str] = Field(default_factory=list, max_length=20)  # Campos señalados por el revisor aunque sean válidos
+
+class ImageBatchRequest(BaseModel):
+    keys: List[str] = Field(..., min_length=1, max_length=100)
@@ -0,0 +1,52 @@
+"""
+Reconciliador de objetos huérfanos en S3
+
+Recorre el bucket por páginas, compara contra los keys referenciados por
+las facturas en MongoDB y elimina los objetos sin referencia con
+delete_objects en lotes de hasta 1000 keys. Antes finaliza las facturas que
+quedaron con la subida pendiente (proceso caído durante /validate). Los
+objetos de facturas eliminadas se borran aquí, pasado el periodo de gracia.
+
+Uso:
+    python reconcile_s3.py [--dry-run] [--grace-hours H] [--prefix P ...]
+"""
+import argparse
+import asyncio
+from database.mongodb import connect_to_mongo, close_mongo_connection
+from services.storage_cleanup_service import StorageCleanupService, MANAGED_PREFIXES
+
+async def run(dry_run: bool, grace_hours: float, prefixes) -> int:
+    print('🔄 Reconciliando objetos de S3...')
+    await connect_to_mongo()
+    
+    try:
+        summary = await StorageCleanupService().reconcile(
+            dry_run=dry_run,
+            grace_hours=grace_hours,
+            prefixes=prefixes
+        )
+        
+        print(f'\n📦 Objetos revisados: {summary["scanned"]}')
+        print(f'🩹 Facturas con subida pendiente: {summary["pendingCompleted"]} completadas | {summary["pendingFailed"]} sin archivo')
+        print(f'🔍 Huérfanos: {summary["orphaned"]} ({summary["bytes"] / 1024 / 1024:.2f}MB)')
+        if dry_run:
+            print('ℹ️  Dry run: no se eliminó nada')
+        else:
+            print(f'🗑️  Eliminados: {summary["deleted"]} | Errores: {summary["errors"]}')
+        return 0 if summary["errors"] == 0 else 1
+    
+    except Exception as error:
+        print(f'❌ Reconciliation failed: {error}')
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        await close_mongo_connection()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Eliminar objetos de S3 que ninguna factura referencia")
+    parser.add_argument('--dry-run', action='store_true', help="Solo reportar los huérfanos")
+    parser.add_argument('--grace-hours', type=float, default=24, help="No tocar objetos más recientes que esto (default: 24)")
+    parser.add_argument('--prefix', action='append', help=f"Prefijo a revisar (default: {', '.join(MANAGED_PREFIXES)})")
+    args = parser.parse_args()
+    exit(asyncio.run(run(args.dry_run, args.grace_hours, args.prefix)))
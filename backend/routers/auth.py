@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from models.user import UserLogin, UserResponse
 from database.sqlite import get_user_db
+from services.auth_service import cache_user, create_session_token, get_current_user, require_admin, revoke_user_sessions
+from config import settings
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,7 +19,7 @@ async def login(credentials: UserLogin):
         
         # Obtener usuario de SQLite
         user_db = get_user_db()
-        user = user_db.get_user_by_email(credentials.email)
+        user = await user_db.get_user_by_email(credentials.email)
         
         if not user:
             logger.warning(f"❌ Usuario no encontrado: {credentials.email}")
@@ -44,9 +46,13 @@ async def login(credentials: UserLogin):
         
         logger.info(f"✅ Login exitoso: {credentials.email}")
         
+        cache_user(user)
+        
         return {
             "success": True,
             "message": "Login successful",
+            "token": create_session_token(user),
+            "expiresIn": settings.SESSION_TTL_SECONDS,
             "user": {
                 "id": user['id'],
                 "name": user['name'],
@@ -64,6 +70,19 @@ async def login(credentials: UserLogin):
             detail=f"Login failed: {str(e)}"
         )
 
+@router.get("/me", response_model=dict)
+async def get_me(current_user: dict = Depends(get_current_user)):
+    """
+    Usuario de la sesión actual (la base de datos solo se consulta si no está en cache)
+    """
+    if current_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return {"success": True, "user": current_user}
+
 @router.post("/signup", response_model=dict)
 async def signup(user_data: dict):
     """
@@ -75,17 +94,22 @@ async def signup(user_data: dict):
     )
 
 @router.get("/users", response_model=dict)
-async def get_users(search: str = None):
+async def get_users(
+    search: str = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=100),
+    current_user: dict = Depends(require_admin)
+):
     """
-    Obtener lista de usuarios (requiere rol admin)
+    Obtener lista paginada de usuarios (requiere rol admin)
     """
     try:
         user_db = get_user_db()
         
-        if search:
-            users = user_db.search_users(search)
+        if search and search.strip():
+            users, total = await user_db.search_users(search.strip(), limit=limit, offset=skip)
         else:
-            users = user_db.get_all_users()
+            users, total = await user_db.get_all_users(limit=limit, offset=skip)
         
         # Remover contraseñas de la respuesta
         for user in users:
@@ -93,7 +117,13 @@ async def get_users(search: str = None):
         
         return {
             "success": True,
-            "users": users
+            "users": users,
+            "pagination": {
+                "total": total,
+                "skip": skip,
+                "limit": limit,
+                "hasMore": skip + limit < total
+            }
         }
         
     except Exception as e:
@@ -104,7 +134,7 @@ async def get_users(search: str = None):
         )
 
 @router.put("/users/{user_id}/role", response_model=dict)
-async def update_user_role(user_id: int, role_data: dict):
+async def update_user_role(user_id: int, role_data: dict, current_user: dict = Depends(require_admin)):
     """
     Actualizar el rol de un usuario (requiere rol admin)
     """
@@ -117,7 +147,7 @@ async def update_user_role(user_id: int, role_data: dict):
             )
         
         user_db = get_user_db()
-        success = user_db.update_user_role(user_id, role)
+        success = await user_db.update_user_role(user_id, role)
         
         if not success:
             raise HTTPException(
@@ -125,6 +155,8 @@ async def update_user_role(user_id: int, role_data: dict):
                 detail="User not found"
             )
         
+        # Los tokens emitidos con el rol anterior dejan de ser válidos (en todos los procesos)
+        await revoke_user_sessions(user_id)
         logger.info(f"✅ Rol actualizado para usuario {user_id} a {role}")
         
         return {
@@ -142,13 +174,13 @@ async def update_user_role(user_id: int, role_data: dict):
         )
 
 @router.delete("/users/{user_id}", response_model=dict)
-async def delete_user(user_id: int):
+async def delete_user(user_id: int, current_user: dict = Depends(require_admin)):
     """
     Eliminar un usuario (requiere rol admin)
     """
     try:
         user_db = get_user_db()
-        success = user_db.delete_user(user_id)
+        success = await user_db.delete_user(user_id)
         
         if not success:
             raise HTTPException(
@@ -156,6 +188,7 @@ async def delete_user(user_id: int):
                 detail="User not found"
             )
         
+        await revoke_user_sessions(user_id)
         logger.info(f"✅ Usuario {user_id} eliminado")
         
         return {
@@ -1,10 +1,21 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, status, Query, Form
+from fastapi import APIRouter, UploadFile, File, HTTPException, status, Query, Form, BackgroundTasks, Header, Response
 from fastapi.responses import JSONResponse
-from models.invoice import InvoiceCreate, InvoiceResponse
-from services.openai_service import OpenAIService
+from models.invoice import InvoiceBase, InvoiceCreate, InvoiceResponse, ImageBatchRequest, RepairRequest, invoice_field_errors
+from services.openai_service import OpenAIService, encoded_image_cache, find_missing_fields
+from services.extraction_engines import ExtractionRequest, engine_registry, save_validated_hash
 from services.invoice_service import InvoiceService
 from services.s3_services import S3Service
+from services.thumbnail_service import ThumbnailService, THUMBNAIL_MIME_TYPES
+from services.storage_cleanup_service import StorageCleanupService
+from services.staging_service import StagingService
+from services.cfdi_parser import XML_MIME_TYPES
+from services.template_service import TemplateService, TEMPLATE_MODEL
+from services.idempotency_service import IdempotencyService, fingerprint
+from config import settings
 from datetime import datetime
+from typing import Awaitable, Optional
+import asyncio
+import hashlib
 import logging
 import json
 
@@ -12,10 +23,29 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+def _check_file_size(file_size: Optional[int]) -> None:
+    """Rechazar archivos mayores a MAX_FILE_SIZE (antes de leerlos si se conoce su tamaño)"""
+    if file_size is not None and file_size > settings.MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Archivo demasiado grande ({file_size / 1024 / 1024:.2f}MB). Máximo permitido: {settings.MAX_FILE_SIZE / 1024 / 1024:g}MB"
+        )
+
 @router.post("/extract", response_model=dict)
-async def extract_invoice(file: UploadFile = File(...)):
+async def extract_invoice(
+    background_tasks: BackgroundTasks,
+    response: Response,
+    file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255)
+):
     """
     Extraer datos de una factura (PDF o imagen)
+    
+    El original queda en espera y la respuesta incluye su stagingToken, que
+    /validate acepta en lugar de volver a subir el archivo.
+    
+    Con la cabecera Idempotency-Key, un reintento devuelve el resultado de
+    la primera extracción sin volver a llamar a OpenAI.
     """
     try:
         logger.info(f"📥 Recibiendo archivo: {file.filename}")
@@ -35,15 +65,15 @@ async def extract_invoice(file: UploadFile = File(...)):
             )
         
         # Validar tipo de archivo
-        valid_types = ['application/pdf', 'image/png', 'image/jpeg', 'image/jpg', 'image/webp']
+        valid_types = ['application/pdf', 'image/png', 'image/jpeg', 'image/jpg', 'image/webp', *XML_MIME_TYPES]
         if file.content_type not in valid_types:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Tipo de archivo no permitido: {file.content_type}. Debe ser PDF o imagen (PNG, JPG, WEBP)"
+                detail=f"Tipo de archivo no permitido: {file.content_type}. Debe ser PDF, imagen (PNG, JPG, WEBP) o CFDI XML"
             )
         
         # Validar extensión de archivo
-        valid_extensions = ['.pdf', '.png', '.jpg', '.jpeg', '.webp']
+        valid_extensions = ['.pdf', '.png', '.jpg', '.jpeg', '.webp', '.xml']
         file_ext = '.' + file.filename.lower().split('.')[-1] if '.' in file.filename else ''
         if file_ext not in valid_extensions:
             raise HTTPException(
@@ -51,18 +81,14 @@ async def extract_invoice(file: UploadFile = File(...)):
                 detail=f"Extensión de archivo no permitida: {file_ext}"
             )
         
-        # Leer contenido del archivo
+        # Leer contenido del archivo (el middleware ya acotó el tamaño del cuerpo)
+        _check_file_size(file.size)
         file_content = await file.read()
         file_size = len(file_content)
         logger.info(f"📄 Archivo leído: {file_size} bytes")
         
-        # Validar tamaño de archivo (máximo 1MB)
-        MAX_FILE_SIZE = 1 * 1024 * 1024  # 1MB
-        if file_size > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail=f"Archivo demasiado grande ({file_size / 1024 / 1024:.2f}MB). Máximo permitido: 1MB"
-            )
+        # Validar tamaño de archivo
+        _check_file_size(file_size)
         
         # Validar que el archivo no esté vacío
         if file_size == 0:
@@ -71,25 +97,37 @@ async def extract_invoice(file: UploadFile = File(...)):
                 detail="El archivo está vacío"
             )
         
-        # Extraer datos usando OpenAI
-        openai_service = OpenAIService()
+        async def run_extraction():
+            # Dejar el original en espera mientras se extrae
+            (extracted_data, extraction_info), staging_token = await asyncio.gather(
+                _extract_with_engines(background_tasks, file_content, file.filename, file.content_type),
+                _stage_upload(background_tasks, file_content, file.filename, file.content_type)
+            )
+            
+            # Agregar metadata
+            return {
+                **extracted_data,
+                "stagingToken": staging_token,
+                "metadata": {
+                    "fileName": file.filename,
+                    "fileSize": len(file_content),
+                    "mimeType": file.content_type,
+                    "processedAt": datetime.utcnow().isoformat(),
+                    **extraction_info
+                }
+            }
         
-        if file.content_type == 'application/pdf':
-            extracted_data = await openai_service.extract_from_pdf(file_content, file.filename)
+        if idempotency_key:
+            result, replayed = await IdempotencyService().run(
+                "extract",
+                idempotency_key,
+                fingerprint(file_content, file.filename, file.content_type),
+                run_extraction
+            )
+            if replayed:
+                response.headers["Idempotent-Replayed"] = "true"
         else:
-            extracted_data = await openai_service.extract_from_image(file_content, file.content_type)
-        
-        # Agregar metadata
-        result = {
-            **extracted_data,
-            "metadata": {
-                "fileName": file.filename,
-                "fileSize": len(file_content),
-                "mimeType": file.content_type,
-                "processedAt": datetime.utcnow().isoformat(),
-                "model": "gpt-4o"
-            }
-        }
+            result = await run_extraction()
         
         logger.info(f"✅ Extracción completada: {file.filename}")
         return result
@@ -111,13 +149,23 @@ async def extract_invoice(file: UploadFile = File(...)):
 
 @router.post("/validate", response_model=InvoiceResponse)
 async def validate_invoice(
+    background_tasks: BackgroundTasks,
+    response: Response,
     invoice_data: str = Form(...),
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    stagingToken: str = Form(None),
     validatedBy: str = Form(None),
-    wasModified: bool = Form(False)
+    wasModified: bool = Form(False),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255)
 ):
     """
     Validar y guardar factura en MongoDB con archivo original en S3
+    
+    El original se envía como archivo o, si ya se subió a /extract, como
+    stagingToken (410 si expiró: el cliente debe reenviar el archivo).
+    
+    Con la cabecera Idempotency-Key, un reintento devuelve la respuesta de
+    la primera validación sin volver a subir el archivo ni insertar la factura.
     """
     try:
         # Validar que se proporcionaron los datos necesarios
@@ -127,29 +175,38 @@ async def validate_invoice(
                 detail="Datos de factura son requeridos"
             )
         
-        if not file or not file.filename:
+        staging_service = None
+        file_content = None
+        if stagingToken:
+            # Archivo ya subido a /extract: no se vuelve a recibir
+            staging_service = StagingService()
+            staged = await staging_service.get_async(stagingToken)
+            if staged is None:
+                raise HTTPException(
+                    status_code=status.HTTP_410_GONE,
+                    detail="El archivo en espera expiró o no existe; vuelva a enviar el archivo"
+                )
+            file_name, content_type, content_hash = staged["fileName"], staged["mimeType"], stagingToken
+        elif file and file.filename:
+            # Validar tamaño del archivo
+            _check_file_size(file.size)
+            file_content = await file.read()
+            file_size = len(file_content)
+            _check_file_size(file_size)
+            
+            if file_size == 0:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="El archivo está vacío"
+                )
+            file_name, content_type = file.filename, file.content_type
+            content_hash = hashlib.sha256(file_content).hexdigest()
+        else:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Archivo es requerido"
             )
         
-        # Validar tamaño del archivo
-        file_content = await file.read()
-        file_size = len(file_content)
-        MAX_FILE_SIZE = 1 * 1024 * 1024  # 1MB
-        
-        if file_size > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail=f"Archivo demasiado grande ({file_size / 1024 / 1024:.2f}MB). Máximo permitido: 1MB"
-            )
-        
-        if file_size == 0:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="El archivo está vacío"
-            )
-        
         # Parsear los datos de la factura desde JSON
         try:
             invoice_dict = json.loads(invoice_data)
@@ -170,40 +227,94 @@ async def validate_invoice(
         
         logger.info(f"📥 Validando factura: {invoice.numeroFactura} por {validatedBy}")
         
-        # Subir archivo a S3
-        s3_service = S3Service()
-        if s3_service.client:  # Solo si S3 está configurado
-            try:
-                # Ya leímos el archivo antes, usar file_content existente
-                s3_data = s3_service.upload_file(
-                    file_content=file_content,
-                    file_name=file.filename,
-                    content_type=file.content_type
-                )
-                
-                # Agregar información de S3 a metadata
-                invoice.metadata.s3Key = s3_data['s3Key']
-                invoice.metadata.s3Url = s3_data['s3Url']
-                logger.info(f"✅ Archivo subido a S3: {s3_data['s3Key']}")
-            except Exception as e:
-                logger.warning(f"⚠️ No se pudo subir a S3: {e}")
-                # Continuar sin S3 si falla
-        
         # Agregar metadata de validación
         invoice.metadata.validatedAt = datetime.utcnow().isoformat()
         invoice.metadata.validatedBy = validatedBy
         invoice.metadata.wasModified = wasModified
         
-        invoice_service = InvoiceService()
-        invoice_id = await invoice_service.create_invoice(invoice)
-        
-        logger.info(f"✅ Factura guardada: {invoice_id} (Modificada: {wasModified})")
+        async def save_invoice():
+            invoice_service = InvoiceService()
+            s3_service = S3Service()
+            if s3_service.client:  # Solo si S3 está configurado
+                s3_key = s3_service.build_key_from_digest(content_hash)
+                if staging_service:
+                    upload = staging_service.promote_async(stagingToken, file_name, content_type)
+                else:
+                    upload = s3_service.upload_file_async(
+                        file_content=file_content,
+                        file_name=file_name,
+                        content_type=content_type,
+                        s3_key=s3_key
+                    )
+                invoice_id = await _save_invoice_with_upload(invoice, invoice_service, s3_service, s3_key, upload)
+                
+                # Generar miniatura de vista previa fuera del camino crítico
+                if invoice.metadata.uploadStatus == "completed" and content_type in THUMBNAIL_MIME_TYPES:
+                    background_tasks.add_task(
+                        _generate_thumbnail,
+                        invoice_id,
+                        content_type,
+                        s3_key,
+                        file_content,
+                        staging_service,
+                        stagingToken
+                    )
+            else:
+                invoice_id = await invoice_service.create_invoice(invoice)
+            
+            # Aprender la plantilla del proveedor con la factura ya revisada
+            if content_type == 'application/pdf' and settings.TEMPLATES_ENABLED:
+                background_tasks.add_task(
+                    _learn_supplier_template,
+                    invoice_id,
+                    invoice.model_dump(exclude={"metadata"}),
+                    invoice.metadata.model,
+                    invoice.metadata.engine,
+                    wasModified,
+                    file_content,
+                    staging_service,
+                    stagingToken
+                )
+            
+            # Guardar el hash perceptual con los datos revisados (no se vuelve a guardar una reutilización sin cambios)
+            if (
+                content_type in THUMBNAIL_MIME_TYPES
+                and settings.NEAR_DUPLICATE_ENABLED
+                and (invoice.metadata.engine != "near-duplicate" or wasModified)
+            ):
+                background_tasks.add_task(
+                    _save_near_duplicate_hash,
+                    invoice.model_dump(exclude={"metadata"}),
+                    invoice.metadata.model,
+                    file_name,
+                    content_type,
+                    content_hash,
+                    file_content,
+                    staging_service,
+                    stagingToken
+                )
+            
+            logger.info(f"✅ Factura guardada: {invoice_id} (Modificada: {wasModified})")
+            
+            return InvoiceResponse(
+                message="Factura validada y guardada exitosamente",
+                id=invoice_id,
+                numeroFactura=invoice.numeroFactura
+            ).model_dump()
+        
+        if idempotency_key:
+            result, replayed = await IdempotencyService().run(
+                "validate",
+                idempotency_key,
+                fingerprint(content_hash, file_name, invoice_data, validatedBy, wasModified),
+                save_invoice
+            )
+            if replayed:
+                response.headers["Idempotent-Replayed"] = "true"
+        else:
+            result = await save_invoice()
         
-        return InvoiceResponse(
-            message="Factura validada y guardada exitosamente",
-            id=invoice_id,
-            numeroFactura=invoice.numeroFactura
-        )
+        return InvoiceResponse(**result)
         
     except HTTPException:
         raise
@@ -232,6 +343,228 @@ async def validate_invoice(
             detail=f"Error al validar la factura: {str(e)}"
         )
 
+@router.post("/repair", response_model=dict)
+async def repair_invoice(request: RepairRequest):
+    """
+    Volver a extraer solo los campos con error de una extracción previa
+    
+    Los campos a reparar son los que no pasan la validación de InvoiceBase,
+    los campos clave vacíos y los que señale el revisor en `fields`. Se
+    reutiliza la imagen ya codificada de la extracción (o el archivo en
+    espera del stagingToken) y se pide a OpenAI solo esos campos.
+    """
+    try:
+        invoice = request.invoice
+        unknown = [field for field in request.fields if field not in InvoiceBase.model_fields]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Campos desconocidos: {', '.join(unknown)}"
+            )
+        
+        problems = invoice_field_errors(invoice)
+        for field in find_missing_fields(invoice):
+            problems.setdefault(field.split(".")[0], "no se extrajo")
+        for field in request.fields:
+            problems.setdefault(field, "el revisor lo marcó como incorrecto")
+        
+        if not problems:
+            return {**invoice, "repairedFields": [], "remainingErrors": {}}
+        
+        openai_service = OpenAIService()
+        image_url = encoded_image_cache.get(request.stagingToken)
+        if image_url is None:
+            # Otro proceso hizo la extracción: codificar desde el archivo en espera
+            staging_service = StagingService()
+            staged = await staging_service.get_async(request.stagingToken)
+            if staged is None:
+                raise HTTPException(
+                    status_code=status.HTTP_410_GONE,
+                    detail="El archivo en espera expiró o no existe; vuelva a extraer la factura"
+                )
+            if staged["mimeType"] in XML_MIME_TYPES:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Las facturas leídas del CFDI XML no se reparan: corrija los campos manualmente"
+                )
+            file_content = await staging_service.read_async(request.stagingToken)
+            image_url = await asyncio.to_thread(openai_service.encode_image_url, file_content, staged["mimeType"])
+        
+        repaired, changed = await openai_service.repair_extraction(invoice, problems, image_url)
+        
+        return {
+            **repaired,
+            "repairedFields": changed,
+            "remainingErrors": invoice_field_errors(repaired)
+        }
+        
+    except HTTPException:
+        raise
+    except ValueError as e:
+        logger.error(f"❌ Error de validación: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Error de validación: {str(e)}"
+        )
+    except Exception as e:
+        logger.error(f"❌ Error al reparar factura: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error al reparar la extracción: {str(e)}"
+        )
+
+async def _extract_with_engines(
+    background_tasks: BackgroundTasks,
+    file_content: bytes,
+    file_name: str,
+    content_type: str
+) -> tuple:
+    """
+    Extraer con el registro de motores (XML, plantilla, casi idénticas, Vision...)
+    
+    Returns:
+        (datos extraídos, metadata de la extracción: model, engine, nearDuplicateOf y templateConfidence)
+    """
+    result = await engine_registry.extract(
+        ExtractionRequest(file_content, file_name, content_type, defer=background_tasks.add_task)
+    )
+    return result["data"], {"model": result["model"], "engine": result["engine"], **result["metadata"]}
+
+async def _stage_upload(
+    background_tasks: BackgroundTasks,
+    file_content: bytes,
+    file_name: str,
+    content_type: str
+) -> Optional[str]:
+    """Dejar el original en espera para /validate (None si falla: el cliente reenviará el archivo)"""
+    try:
+        staging_service = StagingService()
+        token = await staging_service.stage_async(file_content, file_name, content_type)
+        background_tasks.add_task(staging_service.purge_expired_async, settings.STAGING_PURGE_INTERVAL_SECONDS)
+        return token
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo dejar el archivo en espera: {e}")
+        return None
+
+async def _generate_thumbnail(
+    invoice_id: str,
+    content_type: str,
+    s3_key: str,
+    file_content: Optional[bytes],
+    staging_service: Optional[StagingService],
+    staging_token: Optional[str]
+) -> None:
+    """Tarea en segundo plano: miniatura a partir del archivo recibido o del que estaba en espera"""
+    if file_content is None:
+        try:
+            file_content = await staging_service.read_async(staging_token)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo leer el archivo en espera para la miniatura de {invoice_id}: {e}")
+            return
+    await ThumbnailService().generate_for_invoice(invoice_id, file_content, content_type, s3_key)
+
+async def _learn_supplier_template(
+    invoice_id: str,
+    invoice_data: dict,
+    model: Optional[str],
+    engine: Optional[str],
+    was_modified: bool,
+    file_content: Optional[bytes],
+    staging_service: Optional[StagingService],
+    staging_token: Optional[str]
+) -> None:
+    """
+    Tarea en segundo plano: agregar la factura validada a la plantilla de su proveedor
+    
+    Si los datos vienen de la plantilla o de una factura casi idéntica y se
+    aceptaron sin cambios, solo se registra la revisión: aprender de ellos
+    reforzaría la plantilla con su propia salida.
+    """
+    rfc = (invoice_data.get("proveedor") or {}).get("rfc")
+    if not rfc:
+        return
+    try:
+        template_service = TemplateService()
+        if model == TEMPLATE_MODEL:
+            await template_service.record_review(rfc, was_modified)
+        if engine in ("template", "near-duplicate") and not was_modified:
+            return
+        if file_content is None:
+            file_content = await staging_service.read_async(staging_token)
+        text = await template_service.read_text(file_content)
+        await template_service.learn(invoice_data, text, invoice_id)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo actualizar la plantilla de {rfc}: {e}")
+
+async def _save_near_duplicate_hash(
+    invoice_data: dict,
+    model: Optional[str],
+    file_name: str,
+    content_type: str,
+    content_hash: str,
+    file_content: Optional[bytes],
+    staging_service: Optional[StagingService],
+    staging_token: Optional[str]
+) -> None:
+    """Tarea en segundo plano: guardar el hash perceptual de la factura validada"""
+    try:
+        if file_content is None:
+            file_content = await staging_service.read_async(staging_token)
+        await save_validated_hash(invoice_data, model, file_name, content_type, content_hash, file_content)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo guardar el hash de {file_name}: {e}")
+
+async def _save_invoice_with_upload(
+    invoice: InvoiceCreate,
+    invoice_service: InvoiceService,
+    s3_service: S3Service,
+    s3_key: str,
+    upload: Awaitable[dict]
+) -> str:
+    """
+    Subir el archivo a S3 e insertar la factura en MongoDB de forma concurrente
+    
+    El key de S3 se calcula del contenido antes de subir, el documento se
+    inserta con uploadStatus=pending y se finaliza cuando termina la subida
+    (upload: subida directa o promoción del archivo en espera). La
+    referencia al objeto se toma antes de subir, para que otra petición con
+    el mismo archivo no lo considere huérfano. Si falla la inserción se
+    libera y el objeto subido se elimina solo si ninguna otra factura lo
+    referencia; si falla la subida la factura se conserva sin archivo
+    (igual que antes).
+    """
+    invoice.metadata.s3Key = s3_key
+    invoice.metadata.s3Url = s3_service.build_url(s3_key)
+    invoice.metadata.uploadStatus = "pending"
+    
+    await invoice_service.object_refs.acquire(s3_key)
+    upload_result, insert_result = await asyncio.gather(
+        upload,
+        invoice_service.create_invoice(invoice, ref_acquired=True),
+        return_exceptions=True
+    )
+    
+    if isinstance(insert_result, BaseException):
+        # Compensar: no dejar objetos huérfanos en S3
+        remaining = await invoice_service.object_refs.release(s3_key)
+        if remaining == 0 and not isinstance(upload_result, BaseException) and upload_result.get('uploaded'):
+            logger.info(f"🧹 Eliminando objeto de S3 tras fallo al guardar: {s3_key}")
+            await s3_service.delete_file_async(s3_key)
+        raise insert_result
+    
+    invoice_id = insert_result
+    if isinstance(upload_result, BaseException):
+        logger.warning(f"⚠️ No se pudo subir a S3: {upload_result}")
+        # Continuar sin S3 si falla
+        await invoice_service.finalize_upload(invoice_id, uploaded=False)
+        invoice.metadata.uploadStatus = "failed"
+    else:
+        logger.info(f"✅ Archivo subido a S3: {s3_key}")
+        await invoice_service.finalize_upload(invoice_id, uploaded=True)
+        invoice.metadata.uploadStatus = "completed"
+    
+    return invoice_id
+
 @router.get("", response_model=dict)
 async def list_invoices(
     skip: int = Query(0, ge=0),
@@ -275,45 +608,57 @@ async def get_invoice_image(key: str = Query(...)):
         logger.info(f"🖼️ Generando URL firmada para: {key}")
         
         # Si no hay configuración de S3, retornar error amigable
-        from config import settings
-        if not settings.AWS_S3_BUCKET_NAME:
-            logger.warning("⚠️ S3 no está configurado")
+        s3_service = S3Service()
+        if not s3_service.client:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Imagen no disponible - S3 no configurado"
             )
         
-        import boto3
-        from botocore.exceptions import ClientError
-        
-        s3_client = boto3.client(
-            's3',
-            region_name=settings.AWS_REGION,
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
-        )
-        
-        # Generar URL firmada válida por 1 hora
-        url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': settings.AWS_S3_BUCKET_NAME, 'Key': key},
-            ExpiresIn=3600
-        )
+        # URL firmada válida por 1 hora (reutilizada de la cache si sigue vigente)
+        url = s3_service.get_presigned_url_cached(key, expiration=3600)
         
         logger.info(f"✅ URL firmada generada para: {key}")
         return {"url": url}
         
-    except ClientError as e:
-        logger.error(f"❌ Error de S3: {e}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error al generar URL: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Error al acceder a S3"
+            detail=f"Error al generar URL: {str(e)}"
         )
+
+@router.post("/image/batch", response_model=dict)
+async def get_invoice_images_batch(request: ImageBatchRequest):
+    """
+    Obtener URLs firmadas para varias imágenes de facturas en una sola petición
+    """
+    try:
+        logger.info(f"🖼️ Generando {len(request.keys)} URLs firmadas")
+        
+        s3_service = S3Service()
+        if not s3_service.client:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Imágenes no disponibles - S3 no configurado"
+            )
+        
+        urls, errors = s3_service.generate_presigned_urls(request.keys, expiration=3600)
+        
+        if errors:
+            logger.warning(f"⚠️ No se pudieron firmar {len(errors)} keys")
+        logger.info(f"✅ URLs firmadas generadas: {len(urls)}")
+        return {"urls": urls, "errors": errors}
+        
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"❌ Error al generar URL: {e}")
+        logger.error(f"❌ Error al generar URLs: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error al generar URL: {str(e)}"
+            detail=f"Error al generar URLs: {str(e)}"
         )
 
 @router.get("/{invoice_id}", response_model=dict)
@@ -375,9 +720,9 @@ async def update_invoice(invoice_id: str, invoice_data: dict):
         )
 
 @router.delete("/{invoice_id}", response_model=dict)
-async def delete_invoice(invoice_id: str):
+async def delete_invoice(invoice_id: str, background_tasks: BackgroundTasks):
     """
-    Eliminar una factura
+    Eliminar una factura (sus archivos en S3 se liberan en segundo plano)
     """
     try:
         logger.info(f"🗑️ Eliminando factura: {invoice_id}")
@@ -391,6 +736,14 @@ async def delete_invoice(invoice_id: str):
                 detail="Factura no encontrada"
             )
         
+        # Liberar el archivo original sin bloquear la respuesta (la reconciliación lo borra si queda sin referencias)
+        metadata = deleted.get("metadata", {})
+        if metadata.get("s3Key"):
+            background_tasks.add_task(
+                StorageCleanupService().release_invoice_objects,
+                metadata["s3Key"]
+            )
+        
         logger.info(f"✅ Factura eliminada: {invoice_id}")
         return {"message": "Factura eliminada exitosamente"}
         
@@ -403,6 +756,41 @@ async def delete_invoice(invoice_id: str):
             detail=f"Error al eliminar la factura: {str(e)}"
         )
 
+@router.get("/engines/stats", response_model=dict)
+async def get_engine_stats():
+    """
+    Latencia y tasa de éxito de cada motor de extracción (ventana móvil de
+    este proceso) y coincidencia de los motores en sombra con el principal
+    """
+    try:
+        return await engine_registry.get_stats()
+        
+    except Exception as e:
+        logger.error(f"❌ Error al obtener métricas de motores: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error al obtener métricas de motores: {str(e)}"
+        )
+
+@router.get("/templates/stats", response_model=dict)
+async def get_template_stats():
+    """
+    Métricas de las plantillas por proveedor (extracciones sin OpenAI)
+    
+    hitRate: fracción de intentos resueltos con la plantilla;
+    correctionRate: fracción de esas facturas que el revisor tuvo que corregir.
+    """
+    try:
+        templates = await TemplateService().get_stats()
+        return {"templates": templates, "total": len(templates)}
+        
+    except Exception as e:
+        logger.error(f"❌ Error al obtener métricas de plantillas: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error al obtener métricas de plantillas: {str(e)}"
+        )
+
 @router.get("/stats/summary", response_model=dict)
 async def get_stats():
     """
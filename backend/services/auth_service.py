@@ -0,0 +1,228 @@
+from config import settings
+from database.sqlite import get_user_db
+from collections import OrderedDict
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from functools import lru_cache
+from typing import Optional
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def check_session_config() -> None:
+    """
+    Validar al iniciar que los tokens puedan verificarse en todos los procesos
+
+    Con AUTH_REQUIRED un secreto aleatorio por proceso rechazaría los tokens
+    emitidos por otro worker o antes de un reinicio.
+    """
+    if settings.AUTH_REQUIRED and not settings.SESSION_SECRET:
+        raise RuntimeError("SESSION_SECRET es obligatorio con AUTH_REQUIRED=true")
+
+@lru_cache(maxsize=1)
+def _get_session_secret() -> bytes:
+    """Secreto HMAC de los tokens (uno aleatorio por proceso si no se configura, solo en desarrollo)"""
+    if settings.SESSION_SECRET:
+        return settings.SESSION_SECRET.encode("utf-8")
+    logger.warning("⚠️ SESSION_SECRET no configurado, usando un secreto temporal (los tokens no sobreviven reinicios)")
+    return secrets.token_bytes(32)
+
+def create_session_token(user: dict, ttl_seconds: Optional[int] = None) -> str:
+    """
+    Firmar un token de sesión con HMAC-SHA256
+
+    Formato: base64url(payload JSON) + "." + base64url(firma). El payload
+    lleva el id y rol del usuario, y las fechas de emisión y expiración.
+    """
+    now = time.time()
+    payload = {
+        "sub": user["id"],
+        "role": user["role"],
+        "iat": now,
+        "exp": now + (ttl_seconds or settings.SESSION_TTL_SECONDS),
+    }
+    body = _b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    signature = hmac.new(_get_session_secret(), body.encode("ascii"), hashlib.sha256).digest()
+    return f"{body}.{_b64encode(signature)}"
+
+def verify_session_token(token: str) -> dict:
+    """
+    Verificar firma y expiración de un token de sesión
+
+    Returns:
+        dict con el payload del token
+
+    Raises:
+        ValueError: Si el token está mal formado, la firma no coincide o expiró
+    """
+    try:
+        body, signature = token.split(".")
+        expected = hmac.new(_get_session_secret(), body.encode("ascii"), hashlib.sha256).digest()
+        valid = hmac.compare_digest(expected, _b64decode(signature))
+    except (ValueError, UnicodeEncodeError):
+        raise ValueError("Malformed session token")
+
+    if not valid:
+        raise ValueError("Invalid session token")
+
+    payload = json.loads(_b64decode(body))
+    if payload.get("exp", 0) < time.time():
+        raise ValueError("Session token expired")
+    return payload
+
+class UserCache:
+    """
+    Cache LRU con TTL de usuarios autenticados (id, rol, is_active)
+
+    Además guarda, por usuario, el instante a partir del cual los tokens
+    emitidos antes dejan de ser válidos (cambio de rol o eliminación). Esas
+    revocaciones no se desalojan por LRU, solo al expirar todos los tokens
+    afectados. Es local a cada proceso: la revocación también se guarda en
+    SQLite (session_revocations) y los demás procesos la leen al no tener
+    al usuario en cache.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: int = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            record, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return record
+
+    def put(self, user_id: int, record: dict) -> None:
+        with self._lock:
+            self._entries[user_id] = (record, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        """Descartar el usuario y revocar los tokens emitidos hasta ahora"""
+        now = time.time()
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._revoked[user_id] = now
+            # Las revocaciones más antiguas que la vida de un token ya no sirven
+            cutoff = now - settings.SESSION_TTL_SECONDS
+            for revoked_id in [uid for uid, at in self._revoked.items() if at < cutoff]:
+                del self._revoked[revoked_id]
+
+    def is_revoked(self, user_id: int, issued_at: float) -> bool:
+        with self._lock:
+            revoked_at = self._revoked.get(user_id)
+        return revoked_at is not None and issued_at <= revoked_at
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._revoked.clear()
+
+user_cache = UserCache(
+    max_entries=settings.USER_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.USER_CACHE_TTL_SECONDS
+)
+
+def cache_user(user: dict) -> dict:
+    """Guardar en cache los campos de autorización de un usuario (revoked_at: última revocación guardada)"""
+    record = {
+        "id": user["id"],
+        "role": user["role"],
+        "is_active": bool(user.get("is_active", True)),
+        "revoked_at": user.get("revoked_at"),
+    }
+    user_cache.put(user["id"], record)
+    return record
+
+async def revoke_user_sessions(user_id: int) -> None:
+    """Revocar los tokens emitidos hasta ahora en este proceso y, vía SQLite, en los demás"""
+    user_cache.invalidate(user_id)
+    await get_user_db().revoke_sessions(user_id, time.time())
+
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+_bearer = HTTPBearer(auto_error=False)
+
+async def get_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)
+) -> Optional[dict]:
+    """
+    Dependencia FastAPI: usuario autenticado a partir del token Bearer
+
+    Verifica la firma y consulta la cache en memoria; solo si el usuario no
+    está en cache lee de SQLite su rol, estado y última revocación. Sin token
+    devuelve None, salvo que AUTH_REQUIRED esté activo; con la autenticación
+    opcional un token que no se puede verificar (otro secreto, expirado o
+    revocado) también se trata como anónimo.
+    """
+    if credentials is None:
+        if settings.AUTH_REQUIRED:
+            raise _unauthorized("Not authenticated")
+        return None
+
+    try:
+        payload = verify_session_token(credentials.credentials)
+    except ValueError as e:
+        if not settings.AUTH_REQUIRED:
+            return None
+        raise _unauthorized(str(e))
+
+    user_id = payload["sub"]
+    record = user_cache.get(user_id)
+    if record is None:
+        user = await get_user_db().get_auth_record(user_id)
+        record = cache_user(user) if user is not None else None
+
+    # Usuario eliminado, o token emitido antes de un cambio de rol / eliminación (en este u otro proceso)
+    revoked_at = (record or {}).get("revoked_at")
+    if record is None or user_cache.is_revoked(user_id, payload["iat"]) or (revoked_at is not None and payload["iat"] <= revoked_at):
+        if not settings.AUTH_REQUIRED:
+            return None
+        raise _unauthorized("Session revoked")
+
+    if not record["is_active"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Account is disabled"
+        )
+    return {"id": record["id"], "role": record["role"], "is_active": record["is_active"]}
+
+async def require_admin(current_user: Optional[dict] = Depends(get_current_user)) -> dict:
+    """Dependencia FastAPI: exigir un usuario autenticado con rol admin (también con AUTH_REQUIRED=false)"""
+    if current_user is None:
+        raise _unauthorized("Not authenticated")
+    if current_user["role"] != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin role required"
+        )
+    return current_user
@@ -0,0 +1,469 @@
+from database.mongodb import get_collection
+from services.extraction_engines import ExtractionRequest, engine_registry
+from services.invoice_service import InvoiceService
+from services.openai_service import OpenAIService, run_local_prepass
+from services.s3_services import S3Service
+from models.invoice import InvoiceCreate
+from config import settings
+from pydantic import ValidationError
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+# Valor de Metadata.engine de las facturas extraídas por el backlog
+BATCH_ENGINE = "batch"
+
+# Tipos de archivo que acepta el backlog (los mismos que /extract)
+BATCH_MIME_TYPES = {
+    '.pdf': 'application/pdf',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.webp': 'image/webp',
+    '.xml': 'application/xml',
+}
+
+# Estados de un batch de OpenAI después de los cuales ya no cambia
+TERMINAL_BATCH_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Estimación de tokens de entrada (~4 caracteres por token de texto)
+CHARS_PER_TOKEN = 4
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Tokens de una imagen con detail=high: se ajusta a 2048, el lado menor a 768 y se cuentan mosaicos de 512"""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+def estimate_input_tokens(body: Dict[str, Any]) -> int:
+    """Tokens de entrada aproximados de una petición de chat completions (texto + imágenes)"""
+    from PIL import Image
+
+    tokens = 0
+    for message in body["messages"]:
+        for part in message["content"]:
+            if part["type"] == "text":
+                tokens += len(part["text"]) // CHARS_PER_TOKEN
+                continue
+            encoded = part["image_url"]["url"].split(",", 1)[1]
+            # Image.open solo lee el encabezado para conocer el tamaño
+            with Image.open(io.BytesIO(base64.b64decode(encoded))) as image:
+                tokens += estimate_image_tokens(*image.size)
+    return tokens
+
+class BatchService:
+    """
+    Extracción de un backlog (respaldos, cargas nocturnas) con la Batch API de OpenAI
+
+    Los documentos se encolan en batch_queue y se resuelven primero con los
+    motores locales (XML, plantillas); el resto se empaqueta en archivos
+    JSONL (uno por modelo de OPENAI_MODEL_TIERS) con la misma petición que
+    haría Vision en /extract. Los resultados se validan igual que en la
+    extracción interactiva: si no pasan se reenvían al siguiente modelo en
+    otro batch, y si pasan la factura se guarda con InvoiceService sin
+    validatedAt (queda pendiente de revisión).
+
+    Usa su propio cliente (BATCH_OPENAI_API_KEY) y un tope de tokens en cola
+    (BATCH_MAX_ENQUEUED_TOKENS) para que el backlog no consuma los límites
+    de la extracción interactiva.
+    """
+
+    def __init__(self):
+        self.queue = get_collection("batch_queue")
+        self.batches = get_collection("extraction_batches")
+        self.openai = OpenAIService(
+            api_key=settings.BATCH_OPENAI_API_KEY,
+            base_url=settings.BATCH_OPENAI_BASE_URL
+        )
+        self.client = self.openai.client
+        self.model_tiers = self.openai.model_tiers
+        self.s3_service = S3Service()
+        self.invoice_service = InvoiceService()
+
+    async def ensure_indexes(self) -> None:
+        """Un documento por contenido, y búsqueda por estado y por batch (idempotente)"""
+        await self.queue.create_index("sha256", unique=True)
+        await self.queue.create_index([("status", 1), ("tier", 1), ("createdAt", 1)])
+        await self.queue.create_index("batchId")
+        await self.batches.create_index("status")
+
+    async def enqueue(self, file_content: bytes, file_name: str, source: Dict[str, str]) -> Optional[str]:
+        """
+        Encolar un documento del backlog
+
+        Args:
+            source: {"path": ruta local} o {"s3Key": key en el bucket}, para volver a leerlo
+
+        Returns:
+            Id del documento en la cola, o None si ya estaba encolado o ya existe una factura con ese archivo
+        """
+        extension = os.path.splitext(file_name)[1].lower()
+        if extension not in BATCH_MIME_TYPES:
+            raise ValueError(f"Tipo de archivo no permitido: {file_name}")
+
+        digest = hashlib.sha256(file_content).hexdigest()
+        keys = [S3Service.build_key_from_digest(digest)] + ([source["s3Key"]] if "s3Key" in source else [])
+        stored = await self.invoice_service.collection.find_one({"metadata.s3Key": {"$in": keys}}, {"_id": 1})
+        if stored:
+            return None
+
+        now = datetime.utcnow()
+        try:
+            result = await self.queue.insert_one({
+                "sha256": digest,
+                "source": source,
+                "fileName": os.path.basename(file_name),
+                "fileSize": len(file_content),
+                "mimeType": BATCH_MIME_TYPES[extension],
+                "status": "queued",  # queued | submitted | stored | duplicate | failed
+                "tier": 0,  # Posición en OPENAI_MODEL_TIERS
+                "attempts": 0,  # Batches fallidos o expirados que incluyeron el documento
+                "createdAt": now,
+                "updatedAt": now
+            })
+        except DuplicateKeyError:
+            return None
+        return str(result.inserted_id)
+
+    async def _read_source(self, item: Dict[str, Any]) -> bytes:
+        source = item["source"]
+        if "path" in source:
+            return await asyncio.to_thread(Path(source["path"]).read_bytes)
+        if not self.s3_service.client:
+            raise ValueError("S3 no está configurado")
+        response = await asyncio.to_thread(
+            self.s3_service.client.get_object,
+            Bucket=self.s3_service.bucket_name,
+            Key=source["s3Key"]
+        )
+        return await asyncio.to_thread(response['Body'].read)
+
+    async def _enqueued_tokens(self, model: str) -> int:
+        """Tokens estimados de los batches de un modelo que OpenAI aún no termina"""
+        total = 0
+        async for batch in self.batches.find({"model": model, "status": {"$nin": list(TERMINAL_BATCH_STATUSES)}}):
+            total += batch["estimatedTokens"]
+        return total
+
+    async def submit(self) -> List[str]:
+        """
+        Enviar los documentos en cola: un batch por modelo, hasta BATCH_MAX_REQUESTS / BATCH_MAX_FILE_MB
+
+        Los documentos que resuelve un motor local se guardan sin pasar por
+        OpenAI. Un modelo deja de recibir documentos al llegar a
+        BATCH_MAX_ENQUEUED_TOKENS; el resto espera al siguiente submit.
+
+        Returns:
+            Ids de los batches creados
+        """
+        created = []
+        for tier, model in enumerate(self.model_tiers):
+            enqueued = await self._enqueued_tokens(model)
+            lines, items, size, tokens = [], [], 0, 0
+
+            async for item in self.queue.find({"status": "queued", "tier": tier}).sort("createdAt", 1):
+                try:
+                    line, line_tokens = await self._prepare(item, model)
+                except Exception as e:
+                    await self._finish(item, "failed", error=str(e)[:500])
+                    continue
+                if line is None:
+                    continue  # Resuelto con un motor local
+                # Un documento solo siempre puede enviarse si no hay nada en cola para el modelo
+                if enqueued + tokens + line_tokens > settings.BATCH_MAX_ENQUEUED_TOKENS and (enqueued or lines):
+                    logger.info(f"⏸️ {model}: tope de tokens en cola alcanzado; el resto espera al siguiente envío")
+                    break
+                if lines and (len(lines) >= settings.BATCH_MAX_REQUESTS or size + len(line) > settings.BATCH_MAX_FILE_MB * 1024 * 1024):
+                    created.append(await self._create_batch(model, lines, items, tokens))
+                    enqueued += tokens
+                    lines, items, size, tokens = [], [], 0, 0
+                lines.append(line)
+                items.append(item["_id"])
+                size += len(line)
+                tokens += line_tokens
+
+            if lines:
+                created.append(await self._create_batch(model, lines, items, tokens))
+        return created
+
+    async def _prepare(self, item: Dict[str, Any], model: str) -> Tuple[Optional[bytes], int]:
+        """
+        Línea JSONL de un documento y sus tokens estimados, o (None, 0) si lo resolvió un motor local
+        """
+        file_content = await self._read_source(item)
+        request = ExtractionRequest(file_content, item["fileName"], item["mimeType"])
+        if item["tier"] == 0 and not item.get("localChecked"):
+            try:
+                # Sin casi idénticas: el backlog no reutiliza los datos de otra factura por su parecido
+                result = await engine_registry.extract(request, exclude={"vision", "near-duplicate"})
+            except ValueError:
+                if request.kind == "xml":
+                    raise
+                result = None
+            if result is not None:
+                await self._store(item, file_content, result["data"], result["model"], result["engine"], result["metadata"])
+                return None, 0
+
+        # Mismo prompt que /extract: los campos ya leídos del QR / capa de texto no se piden
+        prepass = request.scratch.get("prepass")
+        if prepass is None:
+            prepass = await run_local_prepass(file_content, item["mimeType"])
+        known = {"known": prepass.get("known") or {}, "uuid": prepass.get("uuid")} if prepass else {}
+        image_url = await asyncio.to_thread(self.openai.encode_image_url, file_content, item["mimeType"])
+        body = self.openai.vision_request_body(image_url, model, known.get("known"))
+        tokens = await asyncio.to_thread(estimate_input_tokens, body)
+        await self.queue.update_one({"_id": item["_id"]}, {"$set": {"prepass": known, "localChecked": True}})
+
+        line = json.dumps({
+            "custom_id": str(item["_id"]),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body
+        }, ensure_ascii=False)
+        return (line + "\n").encode("utf-8"), tokens
+
+    async def _create_batch(self, model: str, lines: List[bytes], items: List[Any], tokens: int) -> str:
+        """Subir el JSONL, crear el batch y marcar sus documentos como enviados"""
+        input_file = await asyncio.to_thread(
+            self.client.files.create,
+            file=("backlog.jsonl", b"".join(lines)),
+            purpose="batch"
+        )
+        batch = await asyncio.to_thread(
+            self.client.batches.create,
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"source": "facturas-backlog", "model": model}
+        )
+        now = datetime.utcnow()
+        await self.batches.insert_one({
+            "_id": batch.id,
+            "model": model,
+            "status": batch.status,
+            "inputFileId": input_file.id,
+            "requests": len(lines),
+            "estimatedTokens": tokens,
+            "processed": False,  # Resultados ya aplicados a la cola
+            "createdAt": now,
+            "updatedAt": now
+        })
+        await self.queue.update_many(
+            {"_id": {"$in": items}},
+            {"$set": {"status": "submitted", "batchId": batch.id, "updatedAt": now}}
+        )
+        logger.info(f"📦 Batch {batch.id} enviado: {len(lines)} documentos para {model} (~{tokens} tokens)")
+        return batch.id
+
+    async def poll(self) -> Dict[str, int]:
+        """
+        Consultar los batches pendientes y aplicar los resultados de los que terminaron
+
+        Returns:
+            Conteo de documentos por resultado (stored, duplicate, escalated, retried, failed)
+        """
+        counts = {"stored": 0, "duplicate": 0, "escalated": 0, "retried": 0, "failed": 0}
+        async for batch in self.batches.find({"processed": False}):
+            remote = await asyncio.to_thread(self.client.batches.retrieve, batch["_id"])
+            request_counts = remote.request_counts.model_dump() if remote.request_counts else None
+            await self.batches.update_one(
+                {"_id": batch["_id"]},
+                {"$set": {"status": remote.status, "requestCounts": request_counts, "updatedAt": datetime.utcnow()}}
+            )
+            if remote.status not in TERMINAL_BATCH_STATUSES:
+                continue
+
+            # Un batch expirado o cancelado puede traer resultados parciales
+            results = {}
+            for file_id in (remote.output_file_id, remote.error_file_id):
+                if file_id:
+                    for line in await self._download_lines(file_id):
+                        results[line["custom_id"]] = line
+
+            usage = {"prompt_tokens": 0, "completion_tokens": 0}
+            async for item in self.queue.find({"batchId": batch["_id"], "status": "submitted"}):
+                outcome = await self._apply_result(item, results.get(str(item["_id"])), remote.status, usage)
+                counts[outcome] += 1
+
+            await self.batches.update_one(
+                {"_id": batch["_id"]},
+                {"$set": {"processed": True, "usage": usage, "completedAt": datetime.utcnow()}}
+            )
+            logger.info(f"📬 Batch {batch['_id']} ({remote.status}) aplicado: {counts}")
+        return counts
+
+    async def _download_lines(self, file_id: str) -> List[Dict[str, Any]]:
+        content = await asyncio.to_thread(self.client.files.content, file_id)
+        return [json.loads(line) for line in content.text.splitlines() if line.strip()]
+
+    async def _apply_result(
+        self,
+        item: Dict[str, Any],
+        line: Optional[Dict[str, Any]],
+        batch_status: str,
+        usage: Dict[str, int]
+    ) -> str:
+        """Guardar, escalar o reintentar un documento según su línea de resultado"""
+        response = (line or {}).get("response") or {}
+        if line is None or line.get("error") or response.get("status_code") != 200:
+            error = (line or {}).get("error") or (response.get("body") or {}).get("error") or f"batch {batch_status} sin resultado"
+            return await self._retry(item, json.dumps(error, ensure_ascii=False)[:500])
+
+        body = response["body"]
+        for key in usage:
+            usage[key] += (body.get("usage") or {}).get(key) or 0
+        model = self.model_tiers[item["tier"]]
+        is_last = item["tier"] == len(self.model_tiers) - 1
+        try:
+            data, problem = self.openai.check_vision_response(body["choices"][0]["message"]["content"] or "", item.get("prepass"))
+        except ValueError as e:
+            data, problem = None, str(e)
+
+        if problem is not None and not is_last:
+            logger.warning(f"⤴️ {item['fileName']}: extracción de {model} descartada ({problem}); se reenvía a {self.model_tiers[item['tier'] + 1]}")
+            await self.queue.update_one(
+                {"_id": item["_id"]},
+                {"$set": {"status": "queued", "tier": item["tier"] + 1, "batchId": None, "updatedAt": datetime.utcnow()}}
+            )
+            return "escalated"
+        if data is None:
+            return await self._finish(item, "failed", error=problem)
+
+        file_content = await self._read_source(item)
+        return await self._store(item, file_content, data, model, BATCH_ENGINE, {})
+
+    async def _retry(self, item: Dict[str, Any], error: str) -> str:
+        """Volver a encolar un documento sin resultado, hasta BATCH_MAX_ATTEMPTS veces"""
+        attempts = item.get("attempts", 0) + 1
+        if attempts >= settings.BATCH_MAX_ATTEMPTS:
+            return await self._finish(item, "failed", error=error, attempts=attempts)
+        await self.queue.update_one(
+            {"_id": item["_id"]},
+            {"$set": {"status": "queued", "batchId": None, "attempts": attempts, "error": error, "updatedAt": datetime.utcnow()}}
+        )
+        return "retried"
+
+    async def _finish(self, item: Dict[str, Any], status: str, **fields: Any) -> str:
+        await self.queue.update_one(
+            {"_id": item["_id"]},
+            {"$set": {"status": status, "updatedAt": datetime.utcnow(), **fields}}
+        )
+        if status == "failed":
+            logger.warning(f"⚠️ {item['fileName']}: {fields.get('error')}")
+        return status
+
+    async def _store(
+        self,
+        item: Dict[str, Any],
+        file_content: bytes,
+        data: Dict[str, Any],
+        model: str,
+        engine: str,
+        extra_metadata: Dict[str, Any]
+    ) -> str:
+        """
+        Guardar la factura extraída (pendiente de revisión) con su archivo en S3
+
+        El archivo queda con el mismo key por contenido que /validate: uno local
+        se sube y uno encolado desde S3 se copia, para que eliminar la factura
+        no borre el objeto original del cliente.
+        """
+        metadata = {
+            "fileName": item["fileName"],
+            "fileSize": item["fileSize"],
+            "mimeType": item["mimeType"],
+            "processedAt": datetime.utcnow().isoformat(),
+            "model": model,
+            "engine": engine,
+            **extra_metadata
+        }
+        try:
+            invoice = InvoiceCreate(**{**data, "metadata": metadata})
+        except ValidationError as e:
+            return await self._finish(item, "failed", error=f"no pasa la validación: {e.errors()[0]['msg']}", extraction=data)
+
+        s3_key = S3Service.build_key_from_digest(item["sha256"])
+        uploaded = False
+        if self.s3_service.client:
+            # La referencia se toma antes de subir (igual que /validate)
+            await self.invoice_service.object_refs.acquire(s3_key)
+            source_key = item["source"].get("s3Key")
+            try:
+                if source_key is None:
+                    upload = await self.s3_service.upload_file_async(file_content, item["fileName"], item["mimeType"], s3_key)
+                else:
+                    upload = await asyncio.to_thread(self.s3_service.copy_file, source_key, s3_key)
+            except Exception:
+                await self.invoice_service.object_refs.release(s3_key)
+                raise
+            uploaded = upload.get("uploaded", False)
+            invoice.metadata.s3Key = s3_key
+            invoice.metadata.s3Url = self.s3_service.build_url(s3_key)
+            invoice.metadata.uploadStatus = "completed"
+
+        try:
+            invoice_id = await self.invoice_service.create_invoice(invoice, ref_acquired=invoice.metadata.s3Key is not None)
+        except Exception as e:
+            # Compensar: no dejar objetos huérfanos en S3 (igual que /validate)
+            if invoice.metadata.s3Key is not None:
+                remaining = await self.invoice_service.object_refs.release(s3_key)
+                if uploaded and remaining == 0:
+                    await self.s3_service.delete_file_async(s3_key)
+            if not isinstance(e, ValueError):
+                raise
+            return await self._finish(item, "duplicate", error=str(e), extraction=data)
+        logger.info(f"✅ {item['fileName']}: factura {invoice_id} guardada ({engine}, {model})")
+        return await self._finish(item, "stored", invoiceId=invoice_id, error=None)
+
+    async def get_status(self) -> Dict[str, Any]:
+        """Documentos por estado y modelo, y batches sin aplicar"""
+        documents = {}
+        pipeline = [{"$group": {"_id": {"status": "$status", "tier": "$tier"}, "count": {"$sum": 1}}}]
+        async for doc in self.queue.aggregate(pipeline):
+            tier = doc["_id"].get("tier") or 0
+            model = self.model_tiers[tier] if tier < len(self.model_tiers) else str(tier)
+            documents.setdefault(doc["_id"]["status"], {})[model] = doc["count"]
+
+        batches = []
+        async for batch in self.batches.find({"processed": False}).sort("createdAt", 1):
+            batches.append({
+                "id": batch["_id"],
+                "model": batch["model"],
+                "status": batch["status"],
+                "requests": batch["requests"],
+                "estimatedTokens": batch["estimatedTokens"],
+                "requestCounts": batch.get("requestCounts"),
+                "createdAt": batch["createdAt"].isoformat()
+            })
+        return {"documents": documents, "pendingBatches": batches}
+
+    async def has_pending(self) -> bool:
+        """Quedan documentos por enviar o batches por aplicar"""
+        return (
+            await self.queue.count_documents({"status": {"$in": ["queued", "submitted"]}}, limit=1) > 0
+            or await self.batches.count_documents({"processed": False}, limit=1) > 0
+        )
+
+def iter_backlog_files(paths: Iterable[str]) -> Iterable[str]:
+    """Archivos con extensión de BATCH_MIME_TYPES bajo las rutas dadas (archivos o carpetas, recursivo)"""
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, _, names in os.walk(path):
+            for name in sorted(names):
+                if os.path.splitext(name)[1].lower() in BATCH_MIME_TYPES:
+                    yield os.path.join(root, name)
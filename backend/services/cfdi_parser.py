@@ -0,0 +1,244 @@
+from models.invoice import MAX_DESCRIPTION_LENGTH, MAX_ITEMS, VALID_CURRENCIES
+from typing import Any, Dict, List, Optional
+import io
+import logging
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+XML_MIME_TYPES = ('application/xml', 'text/xml')
+
+# Valor de Metadata.model para las facturas leídas del XML (sin modelo de lenguaje)
+CFDI_MODEL = "cfdi-xml"
+
+CFDI_NAMESPACES = {
+    "http://www.sat.gob.mx/cfd/3": "3.3",
+    "http://www.sat.gob.mx/cfd/4": "4.0",
+}
+TFD_NAMESPACE = "http://www.sat.gob.mx/TimbreFiscalDigital"
+
+# Catálogos del SAT (c_FormaPago, c_MetodoPago, c_UsoCFDI) para mostrar "clave - descripción"
+FORMAS_PAGO = {
+    "01": "Efectivo", "02": "Cheque nominativo", "03": "Transferencia electrónica de fondos",
+    "04": "Tarjeta de crédito", "05": "Monedero electrónico", "06": "Dinero electrónico",
+    "08": "Vales de despensa", "12": "Dación en pago", "13": "Pago por subrogación",
+    "14": "Pago por consignación", "15": "Condonación", "17": "Compensación", "23": "Novación",
+    "24": "Confusión", "25": "Remisión de deuda", "26": "Prescripción o caducidad",
+    "27": "A satisfacción del acreedor", "28": "Tarjeta de débito", "29": "Tarjeta de servicios",
+    "30": "Aplicación de anticipos", "31": "Intermediario pagos", "99": "Por definir",
+}
+METODOS_PAGO = {
+    "PUE": "Pago en una sola exhibición",
+    "PPD": "Pago en parcialidades o diferido",
+}
+USOS_CFDI = {
+    "G01": "Adquisición de mercancías", "G02": "Devoluciones, descuentos o bonificaciones",
+    "G03": "Gastos en general", "I01": "Construcciones", "I02": "Mobiliario y equipo de oficina por inversiones",
+    "I03": "Equipo de transporte", "I04": "Equipo de cómputo y accesorios",
+    "I05": "Dados, troqueles, moldes, matrices y herramental", "I06": "Comunicaciones telefónicas",
+    "I07": "Comunicaciones satelitales", "I08": "Otra maquinaria y equipo",
+    "D01": "Honorarios médicos, dentales y gastos hospitalarios", "D02": "Gastos médicos por incapacidad o discapacidad",
+    "D03": "Gastos funerales", "D04": "Donativos", "D05": "Intereses reales por créditos hipotecarios",
+    "D06": "Aportaciones voluntarias al SAR", "D07": "Primas por seguros de gastos médicos",
+    "D08": "Gastos de transportación escolar obligatoria", "D09": "Depósitos en cuentas para el ahorro",
+    "D10": "Pagos por servicios educativos (colegiaturas)", "S01": "Sin efectos fiscales",
+    "CP01": "Pagos", "CN01": "Nómina", "P01": "Por definir",
+}
+
+# Claves de impuesto del SAT (c_Impuesto)
+IMPUESTOS = {"001": "ISR", "002": "IVA", "003": "IEPS"}
+IVA = "002"
+
+def _split_tag(tag: str) -> tuple:
+    if tag.startswith("{"):
+        namespace, _, name = tag[1:].partition("}")
+        return namespace, name
+    return "", tag
+
+def _amount(value: Optional[str]) -> Optional[float]:
+    if value is None or value.strip() == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"Monto inválido en el CFDI: {value}")
+
+def _with_description(code: Optional[str], catalog: Dict[str, str]) -> Optional[str]:
+    if not code:
+        return None
+    description = catalog.get(code)
+    return f"{code} - {description}" if description else code
+
+def _fit_description(description: Optional[str]) -> Optional[str]:
+    if description is None or len(description) <= MAX_DESCRIPTION_LENGTH:
+        return description
+    return description[:MAX_DESCRIPTION_LENGTH - 1] + "…"
+
+def parse_cfdi(file_content: bytes) -> Dict[str, Any]:
+    """
+    Leer un CFDI 3.3 o 4.0 directamente al esquema de InvoiceCreate (sin metadata)
+
+    El XML se recorre en streaming (iterparse) liberando cada nodo al
+    terminarlo, así que la memoria no crece con el número de conceptos.
+    Los montos son los del comprobante: subtotal es SubTotal - Descuento e
+    iva es el neto de impuestos (trasladados - retenidos) para que
+    subtotal + iva = Total (vacío si el neto es negativo); el desglose por
+    impuesto va en observaciones cuando no es solo IVA trasladado.
+
+    El resultado cabe en InvoiceBase aunque el CFDI no: las descripciones
+    se recortan a MAX_DESCRIPTION_LENGTH, los conceptos a partir del
+    MAX_ITEMS se agrupan en uno solo con la suma de sus importes y una
+    moneda fuera de VALID_CURRENCIES se deja vacía; cada ajuste se anota en
+    observaciones para el revisor.
+
+    Raises:
+        ValueError: Si el archivo no es un CFDI 3.3/4.0 válido
+    """
+    if b"<!DOCTYPE" in file_content:
+        # Los CFDI no usan DTD; rechazarlos evita ataques de expansión de entidades
+        raise ValueError("El XML no debe incluir DOCTYPE")
+
+    comprobante = None
+    version = None
+    emisor: Dict[str, str] = {}
+    receptor: Dict[str, str] = {}
+    items: List[Dict[str, Any]] = []
+    impuestos: Dict[str, str] = {}
+    traslados: Dict[str, float] = {}
+    retenciones: Dict[str, float] = {}
+    uuid = None
+    path: List[str] = []
+    truncated = 0
+    # Conceptos que no caben en MAX_ITEMS: se agrupan en el último (cantidad e importe)
+    overflow: Dict[str, Any] = {"count": 0, "total": 0.0}
+
+    try:
+        for event, element in ET.iterparse(io.BytesIO(file_content), events=("start", "end")):
+            namespace, name = _split_tag(element.tag)
+
+            if event == "start":
+                path.append(name)
+                if len(path) == 1:
+                    if name != "Comprobante" or namespace not in CFDI_NAMESPACES:
+                        raise ValueError("El XML no es un CFDI (se esperaba cfdi:Comprobante 3.3 o 4.0)")
+                    comprobante = dict(element.attrib)
+                    version = CFDI_NAMESPACES[namespace]
+                elif path == ["Comprobante", "Emisor"]:
+                    emisor = dict(element.attrib)
+                elif path == ["Comprobante", "Receptor"]:
+                    receptor = dict(element.attrib)
+                elif path == ["Comprobante", "Conceptos", "Concepto"]:
+                    description = element.get("Descripcion")
+                    item = {
+                        "descripcion": _fit_description(description),
+                        "cantidad": _amount(element.get("Cantidad")),
+                        "precioUnitario": _amount(element.get("ValorUnitario")),
+                        "total": _amount(element.get("Importe")),
+                    }
+                    if len(items) < MAX_ITEMS - 1:
+                        truncated += item["descripcion"] != description
+                        items.append(item)
+                    else:
+                        overflow["count"] += 1
+                        overflow["total"] += item["total"] or 0.0
+                        overflow.setdefault("first", item)
+                elif path == ["Comprobante", "Impuestos"]:
+                    impuestos = dict(element.attrib)
+                elif path[:2] == ["Comprobante", "Impuestos"] and len(path) == 4:
+                    # Solo el resumen del comprobante (los conceptos traen su propio desglose)
+                    target = traslados if name == "Traslado" else retenciones if name == "Retencion" else None
+                    if target is not None:
+                        tax = element.get("Impuesto")
+                        target[tax] = target.get(tax, 0.0) + (_amount(element.get("Importe")) or 0.0)
+                elif name == "TimbreFiscalDigital" and namespace == TFD_NAMESPACE:
+                    uuid = element.get("UUID")
+            else:
+                path.pop()
+                # Liberar el nodo ya procesado (streaming)
+                element.clear()
+    except ET.ParseError as e:
+        raise ValueError(f"XML inválido: {e}")
+
+    if comprobante is None:
+        raise ValueError("El XML está vacío")
+
+    total = _amount(comprobante.get("Total"))
+    subtotal = _amount(comprobante.get("SubTotal"))
+    descuento = _amount(comprobante.get("Descuento")) or 0.0
+    if subtotal is not None:
+        subtotal = round(subtotal - descuento, 2)
+
+    trasladados = _amount(impuestos.get("TotalImpuestosTrasladados"))
+    retenidos = _amount(impuestos.get("TotalImpuestosRetenidos"))
+    if trasladados is None:
+        trasladados = sum(traslados.values())
+    if retenidos is None:
+        retenidos = sum(retenciones.values())
+    iva = round(trasladados - retenidos, 2)
+    if iva < 0:
+        # Retenciones mayores que los traslados (p. ej. honorarios): el neto no cabe en iva
+        iva = None
+
+    notes = []
+    if set(traslados) - {IVA} or retenciones:
+        breakdown = [f"{IMPUESTOS.get(tax, tax)} trasladado {amount:.2f}" for tax, amount in traslados.items()]
+        breakdown += [f"{IMPUESTOS.get(tax, tax)} retenido {amount:.2f}" for tax, amount in retenciones.items()]
+        notes.append(f"Impuestos: {'; '.join(breakdown)}")
+    if descuento:
+        notes.append(f"Descuento: {descuento:.2f}")
+
+    # Ajustes para que el resultado quepa en InvoiceBase (se avisan en observaciones)
+    adjustments = []
+    if truncated:
+        adjustments.append(f"{truncated} descripciones recortadas a {MAX_DESCRIPTION_LENGTH} caracteres")
+    if overflow["count"] == 1:
+        items.append(overflow["first"])
+    elif overflow["count"]:
+        items.append({
+            "descripcion": f"{overflow['count']} conceptos más (ver el XML)",
+            "cantidad": None,
+            "precioUnitario": None,
+            "total": round(overflow["total"], 2),
+        })
+        adjustments.append(f"{MAX_ITEMS - 1 + overflow['count']} conceptos, del {MAX_ITEMS} en adelante agrupados en uno")
+    moneda = comprobante.get("Moneda")
+    # XXX = sin moneda (p. ej. complementos de pago)
+    if moneda == "XXX":
+        moneda = None
+    elif moneda and moneda.upper() not in VALID_CURRENCIES:
+        tipo_cambio = comprobante.get("TipoCambio")
+        adjustments.append(f"moneda {moneda}" + (f" (tipo de cambio {tipo_cambio})" if tipo_cambio else "") + " no admitida")
+        moneda = None
+    if adjustments:
+        logger.warning(f"⚠️ CFDI ajustado al esquema de facturas: {'; '.join(adjustments)}")
+        notes.append(f"Ajustes del CFDI: {'; '.join(adjustments)}")
+    if uuid:
+        notes.append(f"UUID: {uuid}")
+
+    serie, folio = comprobante.get("Serie"), comprobante.get("Folio")
+    numero = "-".join(part for part in (serie, folio) if part) or uuid
+    fecha = comprobante.get("Fecha")
+
+    logger.info(f"🧾 CFDI {version} leído: {numero} ({len(items)} conceptos)")
+    return {
+        "numeroFactura": numero,
+        "fecha": fecha[:10] if fecha else None,
+        "fechaVencimiento": None,
+        "proveedor": {
+            "nombre": emisor.get("Nombre"),
+            "rfc": emisor.get("Rfc"),
+        },
+        "cliente": {
+            "nombre": receptor.get("Nombre"),
+            "rfc": receptor.get("Rfc"),
+        },
+        "items": items,
+        "subtotal": subtotal,
+        "iva": iva,
+        "total": total,
+        "moneda": moneda or None,
+        "formaPago": _with_description(comprobante.get("FormaPago"), FORMAS_PAGO),
+        "metodoPago": _with_description(comprobante.get("MetodoPago"), METODOS_PAGO),
+        "usoCFDI": _with_description(receptor.get("UsoCFDI"), USOS_CFDI),
+        "observaciones": " | ".join(notes) or None,
+    }
@@ -0,0 +1,210 @@
+from services.pdf_utils import get_poppler_path, render_first_page
+from services.raster_pool import run_in_raster_pool
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+import base64
+import importlib.util
+import io
+import logging
+import os
+import re
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# El decodificador de QR es opcional (pip install opencv-python-headless)
+QR_DECODER_AVAILABLE = importlib.util.find_spec("cv2") is not None
+
+# El OCR local también (pip install pytesseract y el binario tesseract con los idiomas)
+OCR_AVAILABLE = importlib.util.find_spec("pytesseract") is not None
+
+# Valor de Metadata.model cuando el QR y la capa de texto bastan (sin modelo de lenguaje)
+PREPASS_MODEL = "cfdi-qr"
+
+# Misma resolución que la imagen enviada a Vision: el render se reutiliza
+RENDER_DPI = 200
+
+_UUID_PATTERN = re.compile(r"\b[0-9A-F]{8}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{12}\b", re.IGNORECASE)
+_RFC = r"[A-ZÑ&]{3,4}\d{6}[A-Z0-9]{3}"
+_DATE = r"(\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4})"
+RFC_PATTERN = re.compile(rf"(?<![A-Z0-9Ñ&]){_RFC}(?![A-Z0-9Ñ&])")
+_TEXT_PATTERNS = {
+    "fecha": re.compile(rf"Fecha(?:\s+y\s+hora)?(?:\s+de\s+(?:emisi[oó]n|expedici[oó]n))?\s*:?\s*{_DATE}", re.IGNORECASE),
+    "serie": re.compile(r"\bSerie\s*:?\s*([A-Z0-9]{1,25})\b"),
+    "folio": re.compile(r"\bFolio(?!\s+fiscal)\s*:?\s*([A-Z0-9-]{1,40})\b", re.IGNORECASE),
+    "nombreEmisor": re.compile(r"(?:Nombre|Raz[oó]n\s+social)\s+(?:del\s+)?emisor\s*:?[ \t]*(\S[^\n]*)", re.IGNORECASE),
+    "rfcEmisor": re.compile(rf"RFC\s+(?:del\s+)?emisor\s*:?\s*({_RFC})", re.IGNORECASE),
+    "rfcReceptor": re.compile(rf"RFC\s+(?:del\s+)?receptor\s*:?\s*({_RFC})", re.IGNORECASE),
+}
+
+def parse_cfdi_qr(payload: str) -> Optional[Dict[str, Any]]:
+    """
+    Datos del QR impreso en un CFDI (URL de verificación del SAT)
+
+    El QR codifica ?id=UUID&re=RFC emisor&rr=RFC receptor&tt=total (3.3 y
+    4.0; en 3.2 el mismo query string sin URL).
+
+    Returns:
+        dict con uuid, rfcEmisor, rfcReceptor y total, o None si no es de un CFDI
+    """
+    query = payload.split("?", 1)[-1].replace("&amp;", "&")
+    params = {key.lower(): values[0].strip() for key, values in parse_qs(query).items()}
+    if "re" not in params or "tt" not in params:
+        return None
+    try:
+        total = float(params["tt"])
+    except ValueError:
+        return None
+    return {
+        "uuid": params.get("id"),
+        "rfcEmisor": params["re"],
+        "rfcReceptor": params.get("rr"),
+        "total": round(total, 2),
+    }
+
+def decode_qr_codes(image) -> List[str]:
+    """Contenido de los códigos QR de una imagen PIL (vacío si OpenCV no está instalado)"""
+    try:
+        import cv2
+        import numpy
+    except ImportError:
+        return []
+
+    pixels = numpy.asarray(image.convert("L"))
+    detector = cv2.QRCodeDetector()
+    found, payloads, _, _ = detector.detectAndDecodeMulti(pixels)
+    if found:
+        return [payload for payload in payloads if payload]
+    payload, _, _ = detector.detectAndDecode(pixels)
+    return [payload] if payload else []
+
+def extract_text_layer(file_content: bytes) -> str:
+    """Texto de la primera página de un PDF con pdftotext (Poppler); vacío si no tiene capa de texto"""
+    poppler_path = get_poppler_path()
+    command = os.path.join(poppler_path, "pdftotext") if poppler_path else "pdftotext"
+    try:
+        result = subprocess.run(
+            [command, "-layout", "-f", "1", "-l", "1", "-enc", "UTF-8", "-", "-"],
+            input=file_content,
+            capture_output=True,
+            timeout=30
+        )
+    except FileNotFoundError:
+        # Sin Poppler tampoco se puede rasterizar; eso ya se reporta al enviar a Vision
+        return ""
+    except subprocess.TimeoutExpired:
+        logger.warning("⚠️ Tiempo agotado al leer la capa de texto del PDF")
+        return ""
+    return result.stdout.decode("utf-8", errors="replace") if result.returncode == 0 else ""
+
+def parse_text_layer(text: str) -> Dict[str, str]:
+    """Campos de la representación impresa de un CFDI (etiquetas habituales: Serie, Folio, Fecha...)"""
+    found = {}
+    for field, pattern in _TEXT_PATTERNS.items():
+        match = pattern.search(text)
+        if match:
+            # Con -layout las columnas vecinas quedan en la misma línea, separadas por varios espacios
+            found[field] = re.split(r"\s{2,}", match.group(1).strip())[0]
+
+    if "fecha" in found and "/" in found["fecha"]:
+        day, month, year = found["fecha"].split("/")
+        found["fecha"] = f"{year}-{month}-{day}"
+    uuid = _UUID_PATTERN.search(text)
+    if uuid:
+        found["uuid"] = uuid.group(0).upper()
+    return found
+
+def run_prepass(file_content: bytes, mime_type: str, decode_qr: bool) -> Dict[str, Any]:
+    """
+    Lectura local de un archivo, antes de Vision (se ejecuta en el pool de procesos)
+
+    En los PDFs se lee la capa de texto y se rasteriza la primera página una
+    sola vez: la misma imagen sirve para buscar el QR y se devuelve como data
+    URL para enviarla a Vision sin volver a rasterizar.
+
+    Returns:
+        dict con qr (parse_cfdi_qr o None), text (campos de parse_text_layer),
+        layer (capa de texto completa) e imageUrl (solo PDFs)
+    """
+    from PIL import Image
+
+    result = {"qr": None, "text": {}, "layer": "", "imageUrl": None}
+    if mime_type == 'application/pdf':
+        result["layer"] = extract_text_layer(file_content)
+        result["text"] = parse_text_layer(result["layer"])
+        image = render_first_page(file_content, dpi=RENDER_DPI)
+        if image is None:
+            return result
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        result["imageUrl"] = f'data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode("utf-8")}'
+    elif decode_qr:
+        image = Image.open(io.BytesIO(file_content))
+    else:
+        return result
+
+    if decode_qr:
+        for payload in decode_qr_codes(image):
+            result["qr"] = parse_cfdi_qr(payload)
+            if result["qr"]:
+                break
+    return result
+
+def ocr_first_page(file_content: bytes, mime_type: str, languages: str) -> str:
+    """Texto de la primera página con Tesseract (se ejecuta en el pool de procesos)"""
+    import pytesseract
+    from PIL import Image
+
+    if mime_type == 'application/pdf':
+        image = render_first_page(file_content, dpi=RENDER_DPI)
+        if image is None:
+            return ""
+    else:
+        image = Image.open(io.BytesIO(file_content))
+    # Un bloque por página conservando los espacios entre columnas, como pdftotext -layout
+    return pytesseract.image_to_string(image, lang=languages, config="--psm 6 -c preserve_interword_spaces=1")
+
+def build_known_fields(qr: Optional[Dict[str, Any]], text: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Campos de la factura (forma de InvoiceCreate) leídos del QR y la capa de texto
+
+    El QR es la fuente más confiable (lo genera el PAC a partir del CFDI
+    timbrado): sus valores prevalecen sobre los del texto.
+    """
+    qr = qr or {}
+    known: Dict[str, Any] = {}
+
+    numero = "-".join(text[part] for part in ("serie", "folio") if part in text)
+    if numero:
+        known["numeroFactura"] = numero
+    if "fecha" in text:
+        known["fecha"] = text["fecha"]
+
+    proveedor = {
+        "nombre": text.get("nombreEmisor"),
+        "rfc": qr.get("rfcEmisor") or text.get("rfcEmisor"),
+    }
+    proveedor = {key: value for key, value in proveedor.items() if value}
+    if proveedor:
+        known["proveedor"] = proveedor
+    rfc_receptor = qr.get("rfcReceptor") or text.get("rfcReceptor")
+    if rfc_receptor:
+        known["cliente"] = {"rfc": rfc_receptor}
+    if qr.get("total") is not None:
+        known["total"] = qr["total"]
+    return known
+
+async def prepass_document(file_content: bytes, mime_type: str) -> Dict[str, Any]:
+    """
+    QR del CFDI y capa de texto de un archivo, leídos en el pool de procesos
+
+    Returns:
+        dict con known (build_known_fields), uuid, text (capa de texto) e imageUrl (o None)
+    """
+    result = await run_in_raster_pool(run_prepass, file_content, mime_type, QR_DECODER_AVAILABLE)
+    known = build_known_fields(result["qr"], result["text"])
+    uuid = (result["qr"] or {}).get("uuid") or result["text"].get("uuid")
+    if known:
+        sources = [name for name, found in (("QR", result["qr"]), ("texto", result["text"])) if found]
+        logger.info(f"🔳 Lectura local ({' + '.join(sources)}): {', '.join(known)}")
+    return {"known": known, "uuid": uuid, "text": result["layer"], "imageUrl": result["imageUrl"]}
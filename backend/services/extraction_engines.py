@@ -0,0 +1,527 @@
+from database.mongodb import get_collection
+from services.cfdi_parser import CFDI_MODEL, XML_MIME_TYPES, parse_cfdi
+from services.document_prepass import (
+    OCR_AVAILABLE, PREPASS_MODEL, QR_DECODER_AVAILABLE, build_known_fields, ocr_first_page, parse_text_layer
+)
+from services.near_duplicate_service import NearDuplicateService
+from services.openai_service import OpenAIService, find_missing_fields, run_local_prepass, same_value
+from services.raster_pool import run_in_raster_pool
+from services.template_service import TemplateService, TEMPLATE_MODEL
+from models.invoice import invoice_field_errors
+from config import settings
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import random
+import re
+import statistics
+import time
+
+logger = logging.getLogger(__name__)
+
+# Valor de Metadata.model para las facturas leídas con el OCR local
+OCR_MODEL = "ocr-local"
+
+# UUID del CFDI que la lectura local agrega a observaciones ("UUID: ...")
+_UUID_NOTE = re.compile(r"UUID: ([0-9A-Fa-f-]{36})")
+
+# Campos que se comparan entre el motor principal y uno en sombra ("items": misma cantidad de conceptos)
+COMPARED_FIELDS = (
+    "numeroFactura", "fecha", "subtotal", "iva", "total", "moneda",
+    "proveedor.rfc", "cliente.rfc", "items"
+)
+
+def document_kind(content_type: str) -> str:
+    """Tipo de archivo para elegir motor y agrupar estadísticas: xml, pdf o image"""
+    if content_type in XML_MIME_TYPES:
+        return "xml"
+    return "pdf" if content_type == 'application/pdf' else "image"
+
+def _field_value(data: Dict[str, Any], field: str) -> Any:
+    if field == "items":
+        items = data.get("items")
+        return len(items) if items else None
+    value = data
+    for part in field.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+def compare_extractions(primary: Dict[str, Any], candidate: Dict[str, Any]) -> Tuple[Optional[float], List[str]]:
+    """
+    Coincidencia entre dos extracciones del mismo archivo
+
+    Solo cuentan los campos de COMPARED_FIELDS que el motor principal llenó;
+    uno vacío en el candidato es una diferencia.
+
+    Returns:
+        (fracción de campos iguales o None si no hay nada que comparar, campos distintos)
+    """
+    compared = 0
+    different = []
+    for field in COMPARED_FIELDS:
+        expected = _field_value(primary, field)
+        if expected in (None, ""):
+            continue
+        compared += 1
+        if not same_value(_field_value(candidate, field), expected):
+            different.append(field)
+    if not compared:
+        return None, different
+    return round((compared - len(different)) / compared, 3), different
+
+def _extraction_from_fields(known: Dict[str, Any], uuid: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Extracción armada solo con campos leídos localmente, si cubre REQUIRED_FIELDS y valida"""
+    if not known:
+        return None
+    extracted_data = {"numeroFactura": uuid, **known, "items": []}
+    if find_missing_fields(extracted_data) or invoice_field_errors(extracted_data):
+        return None
+    if uuid:
+        extracted_data["observaciones"] = f"UUID: {uuid}"
+    return extracted_data
+
+class ExtractionRequest:
+    """
+    Un archivo a extraer, compartido por los motores que lo intentan
+
+    scratch guarda lo que un motor ya leyó del archivo (capa de texto,
+    lectura local, hash perceptual) para que el siguiente no lo repita.
+    defer agenda trabajo fuera de la respuesta (BackgroundTasks.add_task).
+    """
+
+    def __init__(
+        self,
+        file_content: bytes,
+        file_name: str,
+        content_type: str,
+        defer: Optional[Callable[..., None]] = None,
+        shadow: bool = False
+    ):
+        self.file_content = file_content
+        self.file_name = file_name
+        self.content_type = content_type
+        self.kind = document_kind(content_type)
+        self.defer = defer
+        self.shadow = shadow  # Ejecución en sombra: sin efectos (estadísticas de plantillas)
+        self.scratch: Dict[str, Any] = {}
+
+class ExtractionEngine:
+    """
+    Interfaz de un motor de extracción
+
+    extract devuelve {"data", "model", "metadata"} o None si el motor no
+    puede con este archivo (sin plantilla, sin QR...) y se intenta el
+    siguiente. Un motor terminal siempre devuelve una extracción o lanza
+    el error al cliente.
+    """
+
+    name = ""
+    kinds: Tuple[str, ...] = ()
+    expected_latency_ms = 1000.0  # Estimación mientras no haya ENGINE_MIN_SAMPLES mediciones
+    terminal = False
+
+    def is_enabled(self) -> bool:
+        return True
+
+    def supports(self, request: ExtractionRequest) -> bool:
+        return request.kind in self.kinds
+
+    async def extract(self, request: ExtractionRequest) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+async def _local_prepass(request: ExtractionRequest) -> Dict[str, Any]:
+    """run_local_prepass una sola vez por archivo (la comparten text-layer, template y vision)"""
+    if "prepass" not in request.scratch:
+        request.scratch["prepass"] = await run_local_prepass(request.file_content, request.content_type)
+    return request.scratch["prepass"]
+
+class XmlEngine(ExtractionEngine):
+    """CFDI XML leído directamente (parse_cfdi)"""
+
+    name = "xml"
+    kinds = ("xml",)
+    expected_latency_ms = 5.0
+    terminal = True
+
+    async def extract(self, request: ExtractionRequest) -> Optional[Dict[str, Any]]:
+        data = await asyncio.to_thread(parse_cfdi, request.file_content)
+        return {"data": data, "model": CFDI_MODEL}
+
+class TemplateEngine(ExtractionEngine):
+    """Plantilla del proveedor aplicada a la capa de texto del PDF"""
+
+    name = "template"
+    kinds = ("pdf",)
+    expected_latency_ms = 30.0
+
+    def is_enabled(self) -> bool:
+        return settings.TEMPLATES_ENABLED
+
+    async def extract(self, request: ExtractionRequest) -> Optional[Dict[str, Any]]:
+        service = TemplateService()
+        text = request.scratch.get("prepass", {}).get("text")
+        if text is None:
+            text = await service.read_text(request.file_content)
+        result = await service.extract(text, record=not request.shadow)
+        if result is None:
+            return None
+        data, confidence, _ = result
+        return {"data": data, "model": TEMPLATE_MODEL, "metadata": {"templateConfidence": confidence}}
+
+class TextLayerEngine(ExtractionEngine):
+    """QR del CFDI y capa de texto, sin modelo (la factura queda sin items)"""
+
+    name = "text-layer"
+    kinds = ("pdf", "image")
+    expected_latency_ms = 300.0
+
+    def is_enabled(self) -> bool:
+        return settings.PREPASS_ENABLED
+
+    def supports(self, request: ExtractionRequest) -> bool:
+        # En una imagen solo se puede leer el QR
+        return request.kind == "pdf" or (request.kind == "image" and QR_DECODER_AVAILABLE)
+
+    async def extract(self, request: ExtractionRequest) -> Optional[Dict[str, Any]]:
+        prepass = await _local_prepass(request)
+        data = _extraction_from_fields(prepass.get("known"), prepass.get("uuid"))
+        if data is None:
+            return None
+        logger.info("⚡ El QR y la capa de texto cubren los campos clave: se omite Vision")
+        return {"data": data, "model": PREPASS_MODEL}
+
+class LocalOcrEngine(ExtractionEngine):
+    """
+    OCR local con Tesseract (opcional): plantilla del proveedor o campos etiquetados
+
+    Pensado para probarse primero en sombra (ENGINE_SHADOW): las plantillas
+    se aprenden de la capa de texto y el OCR no siempre la reproduce.
+    """
+
+    name = "local-ocr"
+    kinds = ("pdf", "image")
+    expected_latency_ms = 1500.0
+
+    def is_enabled(self) -> bool:
+        return OCR_AVAILABLE
+
+    async def extract(self, request: ExtractionRequest) -> Optional[Dict[str, Any]]:
+        text = await run_in_raster_pool(ocr_first_page, request.file_content, request.content_type, settings.OCR_LANGUAGES)
+        if settings.TEMPLATES_ENABLED:
+            result = await TemplateService().extract(text, record=not request.shadow)
+            if result is not None:
+                data, confidence, _ = result
+                return {"data": data, "model": OCR_MODEL, "metadata": {"templateConfidence": confidence}}
+
+        fields = parse_text_layer(text)
+        data = _extraction_from_fields(build_known_fields(None, fields), fields.get("uuid"))
+        return {"data": data, "model": OCR_MODEL} if data is not None else None
+
+# Campos que una lectura local (QR / capa de texto) debe confirmar para reutilizar una factura casi idéntica
+NEAR_DUPLICATE_CHECKED_FIELDS = ("numeroFactura", "total", "proveedor.rfc", "cliente.rfc")
+
+def confirm_near_duplicate(candidate: Dict[str, Any], digest: str, prepass: Dict[str, Any]) -> Optional[str]:
+    """
+    Por qué una candidata casi idéntica es la misma factura, o None si no se puede confirmar
+
+    Un hash perceptual parecido solo dice que el formato es el mismo: dos
+    facturas de un proveedor con la misma plantilla quedan a 0-1 bits. Se
+    reutiliza solo con el mismo archivo (sha256), el mismo UUID del CFDI, o
+    un folio leído localmente igual al guardado y ningún otro campo leído
+    (total, RFCs) distinto.
+    """
+    if candidate.get("sha256") and candidate["sha256"] == digest:
+        return "mismo archivo"
+    uuid = prepass.get("uuid")
+    if uuid and candidate.get("uuid"):
+        return "mismo UUID" if same_value(candidate["uuid"], uuid) else None
+
+    known = prepass.get("known") or {}
+    if not _field_value(known, "numeroFactura"):
+        return None
+    for field in NEAR_DUPLICATE_CHECKED_FIELDS:
+        value = _field_value(known, field)
+        if value not in (None, "") and not same_value(_field_value(candidate["extraction"], field), value):
+            return None
+    return "mismo folio"
+
+class NearDuplicateEngine(ExtractionEngine):
+    """
+    Extracción validada de una factura casi idéntica (hash perceptual), confirmada antes de reutilizarla
+
+    Las extracciones se guardan desde /validate (save_validated_hash), con
+    los datos ya revisados.
+    """
+
+    name = "near-duplicate"
+    kinds = ("pdf", "image")
+    expected_latency_ms = 80.0
+
+    def is_enabled(self) -> bool:
+        return settings.NEAR_DUPLICATE_ENABLED
+
+    async def extract(self, request: ExtractionRequest) -> Optional[Dict[str, Any]]:
+        service = NearDuplicateService()
+        image_hash = await service.compute_hash(request.file_content, request.content_type)
+        candidates = await service.find_candidates(image_hash)
+        if not candidates:
+            return None
+
+        digest = hashlib.sha256(request.file_content).hexdigest()
+        prepass = None
+        for match in candidates:
+            if prepass is None and match.get("sha256") != digest:
+                prepass = await _local_prepass(request)
+            reason = confirm_near_duplicate(match, digest, prepass or {})
+            if reason is None:
+                continue
+            logger.info(
+                f"♻️ Factura casi idéntica a {match['fileName']} ({match['distance']} bits, {reason}): "
+                f"se reutiliza la extracción {match['id']}"
+            )
+            return {"data": match["extraction"], "model": match["model"], "metadata": {"nearDuplicateOf": match["id"]}}
+        logger.info(f"🔎 {len(candidates)} factura(s) con el mismo formato pero sin confirmar que sea la misma: se extrae")
+        return None
+
+async def save_validated_hash(
+    invoice_data: Dict[str, Any],
+    model: Optional[str],
+    file_name: str,
+    content_type: str,
+    digest: str,
+    file_content: bytes
+) -> None:
+    """Guardar el hash perceptual de una factura validada para reutilizarla con copias casi idénticas"""
+    service = NearDuplicateService()
+    image_hash = await service.compute_hash(file_content, content_type)
+    uuid = _UUID_NOTE.search(invoice_data.get("observaciones") or "")
+    await service.save(image_hash, invoice_data, model, file_name, content_type, digest, uuid.group(1) if uuid else None)
+
+class VisionEngine(ExtractionEngine):
+    """OpenAI Vision (con escalamiento de modelos); reutiliza la lectura local si ya se hizo"""
+
+    name = "vision"
+    kinds = ("pdf", "image")
+    expected_latency_ms = 6000.0
+    terminal = True
+
+    async def extract(self, request: ExtractionRequest) -> Optional[Dict[str, Any]]:
+        service = OpenAIService()
+        prepass = request.scratch.get("prepass")
+        if request.kind == "pdf":
+            data = await service.extract_from_pdf(request.file_content, request.file_name, prepass)
+        else:
+            data = await service.extract_from_image(request.file_content, request.content_type, prepass)
+        return {"data": data, "model": service.model_used}
+
+class EngineStats:
+    """Últimas ENGINE_STATS_WINDOW ejecuciones de un motor con un tipo de archivo: (ms, produjo extracción)"""
+
+    def __init__(self, window: int):
+        self._samples: "deque[Tuple[float, bool]]" = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, latency_ms: float, succeeded: bool) -> None:
+        self._samples.append((latency_ms, succeeded))
+
+    def mean_latency_ms(self) -> float:
+        return statistics.fmean(latency for latency, _ in self._samples)
+
+    def success_rate(self) -> float:
+        return sum(1 for _, succeeded in self._samples if succeeded) / len(self._samples)
+
+    def summary(self) -> Dict[str, Any]:
+        latencies = sorted(latency for latency, _ in self._samples)
+        return {
+            "runs": len(latencies),
+            "successRate": round(self.success_rate(), 3),
+            "meanMs": round(self.mean_latency_ms(), 1),
+            "p50Ms": round(latencies[len(latencies) // 2], 1),
+            "p95Ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+        }
+
+class EngineRegistry:
+    """
+    Motores de extracción registrados y elección del orden en que se intentan
+
+    Para cada archivo se intentan los motores de EXTRACTION_ENGINES que
+    aceptan su tipo hasta que uno produce la extracción. El orden que
+    minimiza la latencia esperada es de menor a mayor latencia / tasa de
+    éxito, medidas en una ventana móvil por motor y tipo de archivo (con
+    menos de ENGINE_MIN_SAMPLES mediciones se usa la estimación del motor).
+    Una fracción ENGINE_EXPLORATION_RATE de los archivos recorre el orden
+    configurado para que los motores relegados sigan midiéndose.
+
+    Los motores de ENGINE_SHADOW corren además, en segundo plano, sobre una
+    fracción del tráfico; su coincidencia con la extracción entregada se
+    guarda en la colección engine_shadow_runs.
+
+    Las estadísticas viven en memoria, por proceso.
+    """
+
+    def __init__(self):
+        self._engines: Dict[str, ExtractionEngine] = {}
+        self._stats: Dict[Tuple[str, str], EngineStats] = {}
+        self.shadow_collection_name = "engine_shadow_runs"
+
+    def register(self, engine: ExtractionEngine) -> None:
+        self._engines[engine.name] = engine
+
+    def _stats_for(self, engine: ExtractionEngine, kind: str) -> EngineStats:
+        key = (engine.name, kind)
+        if key not in self._stats:
+            self._stats[key] = EngineStats(settings.ENGINE_STATS_WINDOW)
+        return self._stats[key]
+
+    def _expected_cost(self, engine: ExtractionEngine, kind: str) -> float:
+        stats = self._stats_for(engine, kind)
+        if len(stats) < settings.ENGINE_MIN_SAMPLES:
+            return engine.expected_latency_ms
+        return stats.mean_latency_ms() / max(stats.success_rate(), 0.01)
+
+    def route(self, request: ExtractionRequest, exclude: Collection[str] = ()) -> List[ExtractionEngine]:
+        """Motores a intentar para un archivo, en orden (termina en el primer motor terminal)"""
+        candidates = [
+            self._engines[name] for name in settings.EXTRACTION_ENGINES
+            if name in self._engines and name not in exclude
+            and self._engines[name].is_enabled() and self._engines[name].supports(request)
+        ]
+        if random.random() >= settings.ENGINE_EXPLORATION_RATE:
+            candidates.sort(key=lambda engine: self._expected_cost(engine, request.kind))
+
+        for position, engine in enumerate(candidates):
+            if engine.terminal:
+                return candidates[:position + 1]
+        return candidates
+
+    async def extract(self, request: ExtractionRequest, exclude: Collection[str] = ()) -> Dict[str, Any]:
+        """
+        Extraer un archivo con el primer motor que lo resuelva
+
+        exclude: motores a no intentar (el backlog de BatchService deja fuera vision)
+
+        Returns:
+            dict con data, model, engine y metadata (nearDuplicateOf, templateConfidence)
+
+        Raises:
+            El error del motor terminal, o ValueError si ningún motor pudo
+        """
+        tried = []
+        for engine in self.route(request, exclude):
+            started = time.perf_counter()
+            try:
+                result = await engine.extract(request)
+            except Exception as e:
+                self._stats_for(engine, request.kind).record((time.perf_counter() - started) * 1000, False)
+                if engine.terminal:
+                    raise
+                # Los motores no terminales son optimizaciones: si fallan se sigue con el siguiente
+                logger.warning(f"⚠️ Motor {engine.name} falló con {request.file_name}: {e}")
+                continue
+            self._stats_for(engine, request.kind).record((time.perf_counter() - started) * 1000, result is not None)
+            if result is None:
+                tried.append(engine)
+                continue
+
+            result = {"metadata": {}, **result, "engine": engine.name}
+            self._schedule_shadow_runs(request, result, [engine.name for engine in tried])
+            return result
+
+        raise ValueError(f"Ningún motor de extracción acepta el archivo {request.file_name} ({request.content_type})")
+
+    def _schedule_shadow_runs(self, request: ExtractionRequest, primary: Dict[str, Any], declined: List[str]) -> None:
+        if request.defer is None:
+            return
+        for name, fraction in settings.ENGINE_SHADOW.items():
+            engine = self._engines.get(name)
+            # Un motor que ya se intentó con este archivo no aporta una medición nueva
+            if engine is None or name == primary["engine"] or name in declined:
+                continue
+            if not engine.is_enabled() or not engine.supports(request):
+                continue
+            if random.random() < fraction:
+                # Sin scratch compartido: la latencia medida es la del motor solo
+                shadow_request = ExtractionRequest(request.file_content, request.file_name, request.content_type, shadow=True)
+                request.defer(self._run_shadow, engine, shadow_request, primary)
+
+    async def _run_shadow(self, engine: ExtractionEngine, request: ExtractionRequest, primary: Dict[str, Any]) -> None:
+        """Tarea en segundo plano: correr un motor candidato y guardar su coincidencia con el principal"""
+        started = time.perf_counter()
+        error = None
+        try:
+            result = await engine.extract(request)
+        except Exception as e:
+            result = None
+            error = str(e)[:500]
+        latency_ms = (time.perf_counter() - started) * 1000
+        self._stats_for(engine, request.kind).record(latency_ms, result is not None)
+
+        agreement, different = compare_extractions(primary["data"], result["data"]) if result else (None, [])
+        try:
+            await get_collection(self.shadow_collection_name).insert_one({
+                "engine": engine.name,
+                "primary": primary["engine"],
+                "kind": request.kind,
+                "fileName": request.file_name,
+                "produced": result is not None,
+                "agreement": agreement,
+                "differentFields": different,
+                "latencyMs": round(latency_ms, 1),
+                "error": error,
+                "createdAt": datetime.utcnow()
+            })
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo guardar la ejecución en sombra de {engine.name}: {e}")
+            return
+        outcome = f"coincidencia {agreement:.0%}" if agreement is not None else ("sin extracción" if result is None else "sin campos que comparar")
+        logger.info(f"👥 Sombra {engine.name} vs {primary['engine']} ({request.file_name}): {outcome} en {latency_ms:.0f} ms")
+
+    async def ensure_indexes(self) -> None:
+        """Índice por motor y expiración de los resultados en sombra (idempotente; se llama al iniciar)"""
+        collection = get_collection(self.shadow_collection_name)
+        await collection.create_index([("engine", 1), ("primary", 1)])
+        await collection.create_index("createdAt", expireAfterSeconds=settings.ENGINE_SHADOW_TTL_DAYS * 86400)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Latencia y tasa de éxito de cada motor por tipo de archivo, y resumen de las ejecuciones en sombra"""
+        engines = []
+        for (name, kind), stats in sorted(self._stats.items()):
+            if len(stats):
+                engine = self._engines[name]
+                engines.append({
+                    "engine": name,
+                    "kind": kind,
+                    "enabled": name in settings.EXTRACTION_ENGINES and engine.is_enabled(),
+                    **stats.summary(),
+                    "expectedCostMs": round(self._expected_cost(engine, kind), 1)
+                })
+
+        pipeline = [
+            {"$group": {
+                "_id": {"engine": "$engine", "primary": "$primary", "kind": "$kind"},
+                "runs": {"$sum": 1},
+                "produced": {"$sum": {"$cond": ["$produced", 1, 0]}},
+                "agreement": {"$avg": "$agreement"},
+                "latencyMs": {"$avg": "$latencyMs"}
+            }},
+            {"$sort": {"_id.engine": 1, "_id.primary": 1, "_id.kind": 1}}
+        ]
+        shadow = []
+        async for doc in get_collection(self.shadow_collection_name).aggregate(pipeline):
+            shadow.append({
+                **doc["_id"],
+                "runs": doc["runs"],
+                "producedRate": round(doc["produced"] / doc["runs"], 3),
+                "meanAgreement": round(doc["agreement"], 3) if doc["agreement"] is not None else None,
+                "meanLatencyMs": round(doc["latencyMs"], 1)
+            })
+        return {"engines": engines, "shadow": shadow}
+
+engine_registry = EngineRegistry()
+for _engine in (XmlEngine(), TemplateEngine(), TextLayerEngine(), LocalOcrEngine(), NearDuplicateEngine(), VisionEngine()):
+    engine_registry.register(_engine)
@@ -0,0 +1,131 @@
+from database.mongodb import get_collection
+from config import settings
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+def fingerprint(*parts: Any) -> str:
+    """Huella de una petición (archivo, datos del formulario...) para detectar claves reutilizadas"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b""
+        elif not isinstance(part, bytes):
+            part = str(part).encode("utf-8")
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+class IdempotencyService:
+    """
+    Soporte de la cabecera Idempotency-Key
+
+    La primera petición con una clave queda registrada "en curso" en la
+    colección idempotency_keys; al terminar bien se guarda su respuesta. Las
+    peticiones repetidas (o concurrentes) con la misma clave esperan a la
+    original y devuelven la misma respuesta sin repetir el trabajo. Si la
+    original falla la clave se libera para permitir el reintento. Los
+    registros expiran por un índice TTL.
+    """
+
+    def __init__(self):
+        self.collection = get_collection("idempotency_keys")
+
+    async def ensure_indexes(self) -> None:
+        """Crear el índice TTL (idempotente; se llama al iniciar la aplicación)"""
+        await self.collection.create_index("expiresAt", expireAfterSeconds=0)
+
+    async def _claim(self, doc_id: str, request_hash: str) -> bool:
+        """Registrar la clave como en curso; False si ya existía y sigue vigente"""
+        now = datetime.utcnow()
+        lock = {
+            "status": "in_progress",
+            "fingerprint": request_hash,
+            "lockedUntil": now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS),
+            "createdAt": now,
+            "expiresAt": now + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+        }
+        try:
+            await self.collection.insert_one({"_id": doc_id, **lock})
+            return True
+        except DuplicateKeyError:
+            pass
+
+        # Tomar el control si el dueño anterior murió sin terminar (lock vencido)
+        taken = await self.collection.find_one_and_update(
+            {"_id": doc_id, "status": "in_progress", "lockedUntil": {"$lt": now}},
+            {"$set": lock},
+            return_document=ReturnDocument.AFTER
+        )
+        return taken is not None
+
+    async def _wait_for_result(self, doc_id: str, request_hash: str) -> Optional[dict]:
+        """Esperar la respuesta de la petición original (None si esta falló y liberó la clave)"""
+        deadline = asyncio.get_running_loop().time() + settings.IDEMPOTENCY_WAIT_SECONDS
+        delay = 0.1
+        while True:
+            doc = await self.collection.find_one({"_id": doc_id})
+            if doc is None:
+                return None
+            if doc.get("fingerprint") != request_hash:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="Idempotency-Key ya fue usada con una petición distinta"
+                )
+            if doc["status"] == "completed":
+                return doc
+            if asyncio.get_running_loop().time() >= deadline:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Hay una petición en curso con la misma Idempotency-Key"
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    async def run(
+        self,
+        scope: str,
+        key: str,
+        request_hash: str,
+        func: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """
+        Ejecutar func una sola vez por (scope, key)
+
+        Returns:
+            (respuesta, replayed): replayed es True si la respuesta es la
+            guardada de una petición anterior
+        """
+        doc_id = f"{scope}:{key}"
+        while not await self._claim(doc_id, request_hash):
+            doc = await self._wait_for_result(doc_id, request_hash)
+            if doc is not None:
+                logger.info(f"♻️ Respuesta idempotente reutilizada: {doc_id}")
+                return doc["response"], True
+            # La petición original falló y liberó la clave: intentar de nuevo
+
+        try:
+            result = await func()
+        except BaseException:
+            await self.collection.delete_one({"_id": doc_id, "status": "in_progress"})
+            raise
+
+        await self.collection.update_one(
+            {"_id": doc_id},
+            {
+                "$set": {
+                    "status": "completed",
+                    "response": result,
+                    "completedAt": datetime.utcnow(),
+                    "expiresAt": datetime.utcnow() + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+                },
+                "$unset": {"lockedUntil": ""}
+            }
+        )
+        return result, False
@@ -1,7 +1,9 @@
 from database.mongodb import get_collection
 from models.invoice import Invoice, InvoiceCreate
+from services.object_ref_service import ObjectRefService
 from bson import ObjectId
 from datetime import datetime
+from typing import Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,9 +11,17 @@ logger = logging.getLogger(__name__)
 class InvoiceService:
     def __init__(self):
         self.collection = get_collection("invoices")
+        self.object_refs = ObjectRefService()
     
-    async def create_invoice(self, invoice_data: InvoiceCreate) -> str:
-        """Crear una nueva factura en MongoDB"""
+    async def create_invoice(self, invoice_data: InvoiceCreate, ref_acquired: bool = False) -> str:
+        """
+        Crear una nueva factura en MongoDB
+        
+        La referencia al objeto de S3 se registra antes de insertar y se
+        libera si la inserción falla. Con ref_acquired el llamador ya la tomó
+        (antes de subir el archivo) y es quien la libera si algo falla.
+        """
+        acquired = False
         try:
             # Verificar duplicados
             if invoice_data.numeroFactura:
@@ -26,6 +36,11 @@ class InvoiceService:
             invoice_dict["createdAt"] = datetime.utcnow()
             invoice_dict["updatedAt"] = datetime.utcnow()
             
+            # Registrar la referencia al objeto de S3 (puede compartirse entre facturas)
+            if invoice_data.metadata.s3Key and not ref_acquired:
+                await self.object_refs.acquire(invoice_data.metadata.s3Key)
+                acquired = True
+            
             # Insertar en MongoDB
             result = await self.collection.insert_one(invoice_dict)
             logger.info(f"✅ Factura creada: {result.inserted_id}")
@@ -34,6 +49,34 @@ class InvoiceService:
             
         except Exception as e:
             logger.error(f"❌ Error al crear factura: {e}")
+            if acquired:
+                await self.object_refs.release(invoice_data.metadata.s3Key)
+            raise
+    
+    async def finalize_upload(self, invoice_id: str, uploaded: bool) -> None:
+        """Marcar el resultado de la subida a S3 de una factura creada con uploadStatus=pending"""
+        try:
+            if uploaded:
+                await self.collection.update_one(
+                    {"_id": ObjectId(invoice_id)},
+                    {"$set": {"metadata.uploadStatus": "completed"}}
+                )
+                return
+            
+            # La subida falló: el documento no debe apuntar a un objeto inexistente
+            invoice = await self.collection.find_one_and_update(
+                {"_id": ObjectId(invoice_id)},
+                {
+                    "$set": {"metadata.uploadStatus": "failed"},
+                    "$unset": {"metadata.s3Key": "", "metadata.s3Url": ""}
+                },
+                projection={"metadata.s3Key": 1}
+            )
+            s3_key = (invoice or {}).get("metadata", {}).get("s3Key")
+            if s3_key:
+                await self.object_refs.release(s3_key)
+        except Exception as e:
+            logger.error(f"❌ Error al finalizar subida de factura {invoice_id}: {e}")
             raise
     
     async def get_invoice(self, invoice_id: str) -> dict:
@@ -100,11 +143,19 @@ class InvoiceService:
             logger.error(f"❌ Error al actualizar factura: {e}")
             raise
     
-    async def delete_invoice(self, invoice_id: str) -> bool:
-        """Eliminar una factura"""
+    async def delete_invoice(self, invoice_id: str) -> Optional[dict]:
+        """
+        Eliminar una factura
+        
+        Retorna la factura eliminada (solo _id y los keys de S3, para liberar
+        sus objetos en segundo plano) o None si no existía.
+        """
         try:
-            result = await self.collection.delete_one({"_id": ObjectId(invoice_id)})
-            return result.deleted_count > 0
+            invoice = await self.collection.find_one_and_delete(
+                {"_id": ObjectId(invoice_id)},
+                projection={"metadata.s3Key": 1, "metadata.thumbnailKey": 1}
+            )
+            return invoice
         except Exception as e:
             logger.error(f"❌ Error al eliminar factura: {e}")
             raise
@@ -0,0 +1,253 @@
+from database.mongodb import get_collection
+from services.pdf_utils import render_first_page
+from services.raster_pool import run_in_raster_pool
+from config import settings
+from bson import Int64, ObjectId
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import io
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+
+def compute_dhash(file_content: bytes, mime_type: str) -> int:
+    """
+    Hash perceptual (dHash de 64 bits) de la primera página (se ejecuta en el pool de procesos)
+
+    La página se normaliza (orientación EXIF, escala de grises, contraste)
+    y se reduce a 9x8; cada bit indica si un píxel es más claro que su
+    vecino de la derecha. Una foto y un escaneo de la misma factura quedan
+    a pocos bits de distancia aunque sus bytes no tengan nada en común.
+    """
+    from PIL import Image, ImageOps
+
+    if mime_type == 'application/pdf':
+        # La resolución apenas importa: la imagen termina en 9x8
+        image = render_first_page(file_content, dpi=36)
+        if image is None:
+            raise ValueError("El PDF no tiene páginas")
+    else:
+        image = Image.open(io.BytesIO(file_content))
+        image.draft('L', (64, 64))
+        image = ImageOps.exif_transpose(image)
+
+    image = ImageOps.autocontrast(image.convert('L'))
+    pixels = list(image.resize((9, 8), Image.LANCZOS).getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def _to_signed(value: int) -> int:
+    # MongoDB guarda enteros de 64 bits con signo
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+class HammingIndex:
+    """
+    Índice en memoria de hashes de 64 bits por distancia de Hamming (LSH por bandas)
+
+    El hash se parte en max_distance + 1 bandas; si dos hashes están a
+    max_distance bits o menos, por el principio del palomar coinciden
+    exactamente en al menos una banda. Una búsqueda solo compara contra los
+    hashes que comparten alguna banda con el buscado.
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        widths = [HASH_BITS // bands + (1 if i < HASH_BITS % bands else 0) for i in range(bands)]
+        self._bands: List[Tuple[int, int]] = []
+        shift = 0
+        for width in widths:
+            self._bands.append((shift, (1 << width) - 1))
+            shift += width
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in self._bands]
+        self._hashes: List[int] = []
+        self._ids: List[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, value: int, item_id: str) -> None:
+        with self._lock:
+            position = len(self._hashes)
+            self._hashes.append(value)
+            self._ids.append(item_id)
+            for buckets, (shift, mask) in zip(self._buckets, self._bands):
+                buckets.setdefault((value >> shift) & mask, []).append(position)
+
+    def candidates(self, value: int, limit: int) -> List[Tuple[str, int]]:
+        """Hasta limit elementos a max_distance bits o menos, del más cercano al más lejano: [(id, distancia)]"""
+        found = {}
+        hashes = self._hashes
+        for buckets, (shift, mask) in zip(self._buckets, self._bands):
+            for position in buckets.get((value >> shift) & mask, ()):
+                distance = (hashes[position] ^ value).bit_count()
+                if distance <= self.max_distance:
+                    found[position] = distance
+        ranked = sorted(found.items(), key=lambda entry: (entry[1], -entry[0]))[:limit]
+        return [(self._ids[position], distance) for position, distance in ranked]
+
+    def find(self, value: int) -> Optional[Tuple[str, int]]:
+        """Elemento más cercano a max_distance bits o menos: (id, distancia), o None"""
+        best = None
+        best_distance = self.max_distance + 1
+        hashes = self._hashes
+        for buckets, (shift, mask) in zip(self._buckets, self._bands):
+            for position in buckets.get((value >> shift) & mask, ()):
+                distance = (hashes[position] ^ value).bit_count()
+                if distance < best_distance:
+                    best, best_distance = position, distance
+                    if distance == 0:
+                        return self._ids[position], 0
+        if best is None:
+            return None
+        return self._ids[best], best_distance
+
+# Índice compartido por el proceso; se completa desde MongoDB al primer uso
+_index: Optional[HammingIndex] = None
+_index_lock = asyncio.Lock()
+_last_loaded_at: Optional[datetime] = None
+_last_refresh = 0.0
+# Ids ya indexados dentro de la ventana de recarga, con su createdAt (para no agregarlos dos veces)
+_recent_ids: Dict[str, datetime] = {}
+
+# Cada recarga vuelve a pedir los documentos de este margen antes del último createdAt visto:
+# otro proceso puede confirmar su inserción después de que este ya leyó documentos más nuevos
+RELOAD_OVERLAP = timedelta(minutes=2)
+
+class NearDuplicateService:
+    """
+    Detección de facturas casi idénticas antes de llamar a OpenAI
+
+    Cada factura validada en /validate se guarda en la colección
+    image_hashes con el dHash de su primera página, el sha256 del archivo y
+    el UUID del CFDI. Las facturas cuyo hash está a
+    NEAR_DUPLICATE_MAX_DISTANCE bits o menos de uno guardado son candidatas;
+    un dHash de 64 bits no distingue dos facturas distintas con el mismo
+    formato, así que el motor near-duplicate solo reutiliza una candidata
+    que confirma (mismo archivo, mismo UUID o mismos folio y montos leídos
+    localmente). Las búsquedas se hacen contra un HammingIndex en memoria
+    que se actualiza con los documentos nuevos cada
+    NEAR_DUPLICATE_REFRESH_SECONDS (otros procesos también insertan); la
+    recarga es por createdAt con un margen de RELOAD_OVERLAP.
+    """
+
+    def __init__(self):
+        self.collection = get_collection("image_hashes")
+
+    async def ensure_indexes(self) -> None:
+        """Crear el índice por hash (idempotente; se llama al iniciar la aplicación)"""
+        await self.collection.create_index("hash")
+        await self.collection.create_index("createdAt")
+
+    async def _get_index(self) -> HammingIndex:
+        """Índice en memoria con todos los hashes guardados (carga incremental por createdAt)"""
+        global _index, _last_loaded_at, _last_refresh
+        if _index is not None and time.monotonic() - _last_refresh < settings.NEAR_DUPLICATE_REFRESH_SECONDS:
+            return _index
+
+        async with _index_lock:
+            if _index is None:
+                _index = HammingIndex(settings.NEAR_DUPLICATE_MAX_DISTANCE)
+            if time.monotonic() - _last_refresh < settings.NEAR_DUPLICATE_REFRESH_SECONDS:
+                return _index
+
+            # Los _id de distintos procesos no llegan en orden: se recarga por createdAt con margen
+            query = {"createdAt": {"$gte": _last_loaded_at - RELOAD_OVERLAP}} if _last_loaded_at else {}
+            loaded = 0
+            cursor = self.collection.find(query, {"hash": 1, "createdAt": 1}).sort("createdAt", 1).batch_size(10000)
+            async for doc in cursor:
+                created_at = doc.get("createdAt")
+                if created_at is not None and (_last_loaded_at is None or created_at > _last_loaded_at):
+                    _last_loaded_at = created_at
+                doc_id = str(doc["_id"])
+                if doc_id in _recent_ids:
+                    continue
+                _index.add(_to_unsigned(doc["hash"]), doc_id)
+                if created_at is not None:
+                    _recent_ids[doc_id] = created_at
+                loaded += 1
+            if _last_loaded_at is not None:
+                window_start = _last_loaded_at - RELOAD_OVERLAP
+                for doc_id in [doc_id for doc_id, created_at in _recent_ids.items() if created_at < window_start]:
+                    del _recent_ids[doc_id]
+            _last_refresh = time.monotonic()
+            if loaded:
+                logger.info(f"🧮 Hashes perceptuales cargados: {loaded} (total: {len(_index)})")
+            return _index
+
+    async def compute_hash(self, file_content: bytes, mime_type: str) -> int:
+        """dHash de la primera página, calculado en el pool de procesos"""
+        return await run_in_raster_pool(compute_dhash, file_content, mime_type)
+
+    async def find_candidates(self, value: int, limit: int = 5) -> List[dict]:
+        """
+        Extracciones guardadas de facturas con la primera página casi idéntica (sin confirmar)
+
+        Returns:
+            dicts con id, distance, fileName, extraction, model, sha256 y uuid, del más cercano al más lejano
+        """
+        index = await self._get_index()
+        matches = index.candidates(value, limit)
+        if not matches:
+            return []
+
+        docs = {}
+        async for doc in self.collection.find({"_id": {"$in": [ObjectId(doc_id) for doc_id, _ in matches]}}):
+            docs[str(doc["_id"])] = doc
+        return [
+            {
+                "id": doc_id,
+                "distance": distance,
+                "fileName": docs[doc_id].get("fileName"),
+                "extraction": docs[doc_id]["extraction"],
+                "model": docs[doc_id].get("model"),
+                "sha256": docs[doc_id].get("sha256"),
+                "uuid": docs[doc_id].get("uuid")
+            }
+            # Los registros sin sha256 son anteriores a guardar solo facturas validadas: no se reutilizan
+            for doc_id, distance in matches if doc_id in docs and docs[doc_id].get("sha256")
+        ]
+
+    async def save(
+        self,
+        value: int,
+        extraction: dict,
+        model: str,
+        file_name: str,
+        mime_type: str,
+        sha256: str,
+        uuid: Optional[str] = None
+    ) -> str:
+        """Guardar el hash con la extracción validada y agregarlo al índice local"""
+        created_at = datetime.utcnow()
+        result = await self.collection.insert_one({
+            "hash": Int64(_to_signed(value)),
+            "extraction": extraction,
+            "model": model,
+            "fileName": file_name,
+            "mimeType": mime_type,
+            "sha256": sha256,
+            "uuid": uuid,
+            "createdAt": created_at
+        })
+        doc_id = str(result.inserted_id)
+        index = await self._get_index()
+        if doc_id not in _recent_ids:
+            index.add(value, doc_id)
+            _recent_ids[doc_id] = created_at
+        return doc_id
@@ -0,0 +1,76 @@
+from database.mongodb import get_collection
+from pymongo import ReturnDocument
+from datetime import datetime
+from typing import Set
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ObjectRefService:
+    """
+    Conteo de referencias de objetos de S3 desde las facturas
+    
+    Con almacenamiento direccionado por contenido varias facturas pueden
+    apuntar al mismo objeto; solo se puede borrar cuando refCount llega a 0.
+    Al llegar a 0 se marca con releasedAt y el borrado queda para la
+    reconciliación (pasado el periodo de gracia), porque otra petición con el
+    mismo archivo puede estar reutilizándolo sin volver a subirlo.
+    """
+    
+    def __init__(self):
+        self.collection = get_collection("s3_objects")
+    
+    async def acquire(self, s3_key: str) -> int:
+        """Sumar una referencia al objeto y retornar el nuevo conteo"""
+        try:
+            result = await self.collection.find_one_and_update(
+                {"_id": s3_key},
+                {
+                    "$inc": {"refCount": 1},
+                    "$set": {"updatedAt": datetime.utcnow()},
+                    "$unset": {"releasedAt": ""},
+                    "$setOnInsert": {"createdAt": datetime.utcnow()}
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return result["refCount"]
+        except Exception as e:
+            logger.error(f"❌ Error al sumar referencia de {s3_key}: {e}")
+            raise
+    
+    async def release(self, s3_key: str) -> int:
+        """Restar una referencia al objeto y retornar el conteo restante"""
+        try:
+            result = await self.collection.find_one_and_update(
+                {"_id": s3_key, "refCount": {"$gt": 0}},
+                {
+                    "$inc": {"refCount": -1},
+                    "$set": {"updatedAt": datetime.utcnow()}
+                },
+                return_document=ReturnDocument.AFTER
+            )
+            if result is None or result["refCount"] > 0:
+                return result["refCount"] if result else 0
+            # Marca de liberación (solo si nadie tomó una referencia entretanto)
+            await self.collection.update_one(
+                {"_id": s3_key, "refCount": {"$lte": 0}},
+                {"$set": {"releasedAt": datetime.utcnow()}}
+            )
+            return 0
+        except Exception as e:
+            logger.error(f"❌ Error al restar referencia de {s3_key}: {e}")
+            raise
+    
+    async def get_protected_keys(self, released_after: datetime) -> Set[str]:
+        """Keys con referencias registradas o liberados después de released_after (aún en periodo de gracia)"""
+        cursor = self.collection.find(
+            {"$or": [{"refCount": {"$gt": 0}}, {"releasedAt": {"$gt": released_after}}]},
+            {"_id": 1}
+        ).batch_size(5000)
+        return {doc["_id"] async for doc in cursor}
+    
+    async def get_count(self, s3_key: str) -> int:
+        """Obtener el número de referencias actuales del objeto"""
+        doc = await self.collection.find_one({"_id": s3_key}, {"refCount": 1})
+        return doc["refCount"] if doc else 0
@@ -0,0 +1,182 @@
+from config import settings
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import base64
+import hashlib
+import httpx
+import json
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+REPLAY_MODES = ("record", "replay", "auto")
+
+# Cabeceras de respuesta que vale la pena conservar en los fixtures
+_KEPT_HEADERS = ("content-type", "openai-processing-ms", "openai-model", "x-request-id")
+
+def request_key(request: httpx.Request) -> str:
+    """
+    Hash estable de una petición: método, ruta y cuerpo
+
+    Se ignoran el host (para que base_url no importe) y las cabeceras
+    (API key, user-agent, reintentos). Los cuerpos JSON se canonizan y en
+    los multipart se neutraliza el boundary aleatorio.
+    """
+    body = request.content
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+        except ValueError:
+            pass
+    elif content_type.startswith("multipart/form-data"):
+        match = re.search(r"boundary=([^;]+)", content_type)
+        if match:
+            body = body.replace(match.group(1).encode("ascii"), b"BOUNDARY")
+
+    digest = hashlib.sha256()
+    digest.update(request.method.encode("ascii"))
+    digest.update(b" ")
+    digest.update(request.url.raw_path)
+    digest.update(b"\n")
+    digest.update(body)
+    return digest.hexdigest()
+
+class RecordReplayTransport(httpx.BaseTransport):
+    """
+    Transporte httpx que graba y reproduce las respuestas de OpenAI
+
+    Cada respuesta se guarda en `<dir>/<hash>-<n>.json`, donde n es el
+    número de veces que esta instancia ya vio la misma petición (por ejemplo
+    el polling de un run de Assistants). Modos:
+
+        record  reenvía a la API real y graba la respuesta
+        replay  responde solo desde los fixtures, sin red
+        auto    reproduce si existe el fixture y si no graba
+
+    En replay se puede esperar la latencia grabada (multiplicada por
+    latency_scale) para reproducir también los tiempos.
+    """
+
+    def __init__(
+        self,
+        fixtures_dir: str,
+        mode: str = "replay",
+        latency_scale: float = 0.0,
+        inner: Optional[httpx.BaseTransport] = None
+    ):
+        if mode not in REPLAY_MODES:
+            raise ValueError(f"Modo de replay inválido: {mode} (opciones: {', '.join(REPLAY_MODES)})")
+        self.fixtures_dir = Path(fixtures_dir)
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.inner = inner
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def _next_path(self, key: str) -> Path:
+        with self._lock:
+            occurrence = self._seen.get(key, 0)
+            self._seen[key] = occurrence + 1
+        return self.fixtures_dir / f"{key}-{occurrence}.json"
+
+    def _replay(self, request: httpx.Request, path: Path, key: str) -> httpx.Response:
+        if not path.exists():
+            # Peticiones repetidas más veces que al grabar: usar la primera grabación
+            path = self.fixtures_dir / f"{key}-0.json"
+            if not path.exists():
+                # Un 404 no se reintenta en el SDK: la prueba falla de inmediato con un mensaje claro
+                message = f"Sin respuesta grabada para {request.method} {request.url.path} ({key[:12]})"
+                logger.warning(f"⚠️ {message}")
+                return httpx.Response(
+                    status_code=404,
+                    json={"error": {"message": message, "type": "replay_miss", "code": None}},
+                    request=request
+                )
+
+        fixture = json.loads(path.read_text())
+        if self.latency_scale > 0:
+            time.sleep(fixture["elapsed_s"] * self.latency_scale)
+
+        response = fixture["response"]
+        if response["encoding"] == "base64":
+            content = base64.b64decode(response["body"])
+        else:
+            content = response["body"].encode("utf-8")
+        return httpx.Response(
+            status_code=response["status_code"],
+            headers=response["headers"],
+            content=content,
+            request=request
+        )
+
+    def _record(self, request: httpx.Request, path: Path, key: str) -> httpx.Response:
+        if self.inner is None:
+            self.inner = httpx.HTTPTransport()
+
+        start = time.perf_counter()
+        response = self.inner.handle_request(request)
+        content = response.read()
+        elapsed = time.perf_counter() - start
+        response.close()
+
+        try:
+            body, encoding = content.decode("utf-8"), "utf-8"
+        except UnicodeDecodeError:
+            body, encoding = base64.b64encode(content).decode("ascii"), "base64"
+        headers = {name: response.headers[name] for name in _KEPT_HEADERS if name in response.headers}
+
+        self.fixtures_dir.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({
+            "key": key,
+            "request": {
+                "method": request.method,
+                "path": request.url.path,
+                "bodyBytes": len(request.content),
+            },
+            "response": {
+                "status_code": response.status_code,
+                "headers": headers,
+                "body": body,
+                "encoding": encoding,
+            },
+            "elapsed_s": round(elapsed, 4),
+            "recordedAt": datetime.utcnow().isoformat(),
+        }, indent=2, ensure_ascii=False))
+        logger.info(f"📼 Respuesta grabada: {request.method} {request.url.path} -> {path.name}")
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=headers,
+            content=content,
+            request=request
+        )
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        key = request_key(request)
+        path = self._next_path(key)
+
+        if self.mode == "replay" or (self.mode == "auto" and path.exists()):
+            return self._replay(request, path, key)
+        return self._record(request, path, key)
+
+    def close(self) -> None:
+        if self.inner is not None:
+            self.inner.close()
+
+def get_replay_transport() -> Optional[RecordReplayTransport]:
+    """Transporte de grabación/reproducción según la configuración (None si está desactivado)"""
+    if not settings.OPENAI_REPLAY_MODE:
+        return None
+    if not settings.OPENAI_REPLAY_DIR:
+        raise ValueError("OPENAI_REPLAY_DIR es requerido cuando OPENAI_REPLAY_MODE está activo")
+    return RecordReplayTransport(
+        settings.OPENAI_REPLAY_DIR,
+        mode=settings.OPENAI_REPLAY_MODE,
+        latency_scale=settings.OPENAI_REPLAY_LATENCY_SCALE
+    )
@@ -1,106 +1,198 @@
-from openai import OpenAI, APIError, APIConnectionError, RateLimitError, APITimeoutError
+from openai import OpenAI, DefaultHttpxClient, APIError, APIConnectionError, RateLimitError, APITimeoutError
 from config import settings
+from services.openai_replay import get_replay_transport
+from services.pdf_utils import render_first_page
+from services.document_prepass import QR_DECODER_AVAILABLE, prepass_document
+from services.page_bands import merge_band_items, split_page_bands
+from services.raster_pool import run_in_raster_pool
+from models.invoice import InvoiceBase, Item, get_list_adapter
+from pydantic import ValidationError
+import asyncio
+import base64
+import hashlib
+import io
 import json
 import re
 import logging
 import os
+import threading
 import time
-from typing import Dict, Any
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Campos sin los que una extracción se considera incompleta (se escala al siguiente modelo)
+REQUIRED_FIELDS = ("numeroFactura", "fecha", "total", "proveedor.nombre")
+
+# Campos leídos localmente (QR / capa de texto) que se comparan con la respuesta de Vision;
+# el nombre y el número de factura no se comparan porque su formato varía
+CHECKED_FIELDS = ("total", "fecha", "proveedor.rfc", "cliente.rfc")
+
+def find_missing_fields(extracted_data: Dict[str, Any]) -> List[str]:
+    """Campos de REQUIRED_FIELDS vacíos en una extracción"""
+    missing = []
+    for field in REQUIRED_FIELDS:
+        value = extracted_data
+        for part in field.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if value in (None, ""):
+            missing.append(field)
+    return missing
+
+def same_value(extracted: Any, known: Any) -> bool:
+    """Comparar un valor extraído con uno leído localmente (montos con tolerancia de centavos)"""
+    if isinstance(known, (int, float)):
+        try:
+            return abs(float(extracted) - known) <= 0.01
+        except (TypeError, ValueError):
+            return False
+    return str(extracted).strip().upper() == str(known).strip().upper()
+
+class EncodedImageCache:
+    """
+    Cache LRU de las imágenes ya codificadas (data URL en base64) por sha256 del archivo
+    
+    Una reparación de campos (repair_extraction) reutiliza la imagen de la
+    extracción original sin volver a rasterizar el PDF ni codificar.
+    Acotada por el tamaño total de las data URLs.
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            url = self._entries.get(key)
+            if url is not None:
+                self._entries.move_to_end(key)
+            return url
+    
+    def put(self, key: str, url: str) -> None:
+        if len(url) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = url
+            self._size += len(url)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+encoded_image_cache = EncodedImageCache(settings.ENCODED_IMAGE_CACHE_MB * 1024 * 1024)
+
+# Hilos propios para las llamadas de las franjas: no compiten con el executor por defecto (S3, staging)
+_band_executor = ThreadPoolExecutor(max_workers=settings.VISION_BAND_WORKERS, thread_name_prefix="vision-band")
+
+async def run_local_prepass(file_content: bytes, mime_type: str) -> Dict[str, Any]:
+    """
+    Lectura local (QR del CFDI y capa de texto) antes de Vision
+    
+    La primera página rasterizada queda en encoded_image_cache.
+    
+    Returns:
+        Resultado de prepass_document, o {} si está desactivada o falla
+    """
+    if not settings.PREPASS_ENABLED:
+        return {}
+    if mime_type != 'application/pdf' and not QR_DECODER_AVAILABLE:
+        # En una imagen solo se puede leer el QR
+        return {}
+    try:
+        prepass = await prepass_document(file_content, mime_type)
+    except Exception as e:
+        # Es una optimización: la extracción sigue sin ella
+        logger.warning(f"⚠️ Lectura local omitida: {e}")
+        return {}
+    if prepass["imageUrl"]:
+        encoded_image_cache.put(OpenAIService.image_key(file_content), prepass["imageUrl"])
+    return prepass
+
 class OpenAIService:
-    def __init__(self):
-        if not settings.OPENAI_API_KEY:
+    def __init__(
+        self,
+        model_tiers: Optional[List[str]] = None,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None
+    ):
+        """api_key / base_url: otra cuenta o proyecto (p. ej. el backlog de BatchService); default: los de config"""
+        api_key = api_key or settings.OPENAI_API_KEY
+        if not api_key:
             raise ValueError("OPENAI_API_KEY no está configurada")
         
+        # Modelos de Vision en orden: se escala al siguiente solo si la extracción no pasa las validaciones
+        self.model_tiers = list(model_tiers or settings.OPENAI_MODEL_TIERS)
+        if not self.model_tiers:
+            raise ValueError("OPENAI_MODEL_TIERS no puede estar vacío")
+        self.model_used = None  # Modelo que produjo la última extracción
+        self._usage_lock = threading.Lock()  # Las llamadas de las franjas corren en hilos
+        
+        # Consumo acumulado de esta instancia (tokens, bytes enviados y tiempo en la API)
+        self.usage = {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+            "request_bytes": 0,
+            "api_seconds": 0.0,
+            "escalations": 0,
+            "band_extractions": 0,  # Páginas extraídas en franjas paralelas (tablas largas)
+            "prepass_mismatches": 0  # Campos en que Vision no coincidió con la lectura local
+        }
+        
         self.client = OpenAI(
-            api_key=settings.OPENAI_API_KEY,
+            api_key=api_key,
+            base_url=base_url or settings.OPENAI_BASE_URL,
             max_retries=3,
-            timeout=120.0
+            timeout=120.0,
+            http_client=DefaultHttpxClient(
+                # Grabación/reproducción de respuestas para pruebas sin red (OPENAI_REPLAY_MODE)
+                transport=get_replay_transport(),
+                event_hooks={
+                    "request": [self._on_request],
+                    "response": [self._on_response]
+                }
+            )
         )
         self.max_retries = 3
         self.retry_delay = 2  # seconds
     
-    async def extract_from_pdf(self, file_content: bytes, filename: str) -> Dict[str, Any]:
-        """Extraer datos de un PDF - detecta si es imagen y usa Vision API"""
+    async def extract_from_pdf(
+        self,
+        file_content: bytes,
+        filename: str,
+        prepass: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Extraer datos de un PDF - detecta si es imagen y usa Vision API
+        
+        prepass: resultado de run_local_prepass si ya se leyó el archivo (otro motor de extracción)
+        """
         logger.info(f"📄 Procesando PDF: {filename}")
         
         try:
-            # Intentar convertir PDF a imagen (para PDFs que son solo imágenes)
-            from pdf2image import pdfinfo_from_bytes, convert_from_bytes
-            import base64
+            # QR del CFDI y capa de texto (de paso deja la primera página rasterizada en cache)
+            if prepass is None:
+                prepass = await run_local_prepass(file_content, 'application/pdf')
             
+            # Intentar convertir PDF a imagen (para PDFs que son solo imágenes)
             logger.info("🔍 Detectando tipo de PDF...")
             
             try:
-                # Configurar path de Poppler para Windows
-                poppler_path = None
-                if os.name == 'nt':  # Windows
-                    # Intentar obtener de variable de entorno primero
-                    poppler_path = os.environ.get('POPPLER_PATH')
-                    # Si no existe, usar ruta común de instalación
-                    if not poppler_path:
-                        common_paths = [
-                            r'C:\poppler-25.11.0\Library\bin',
-                            r'C:\Program Files\poppler\Library\bin',
-                            r'C:\poppler\Library\bin',
-                        ]
-                        for path in common_paths:
-                            if os.path.exists(path):
-                                poppler_path = path
-                                logger.info(f"✅ Poppler encontrado en: {poppler_path}")
-                                break
-                
                 # Convertir primera página del PDF a imagen
-                if poppler_path:
-                    images = convert_from_bytes(file_content, first_page=1, last_page=1, poppler_path=poppler_path)
-                else:
-                    images = convert_from_bytes(file_content, first_page=1, last_page=1)
+                image_url = self._pdf_image_url(file_content)
                 
-                if images:
+                if image_url is not None:
                     logger.info("📸 PDF detectado como imagen - usando Vision API")
                     
-                    # Convertir imagen a bytes
-                    import io
-                    img_byte_arr = io.BytesIO()
-                    images[0].save(img_byte_arr, format='PNG')
-                    img_byte_arr = img_byte_arr.getvalue()
-                    
                     # Usar Vision API en lugar de Assistants
-                    base64_image = base64.b64encode(img_byte_arr).decode('utf-8')
-                    
-                    logger.info("📤 Enviando a Vision API...")
-                    response = self._call_openai_with_retry(
-                        lambda: self.client.chat.completions.create(
-                            model='gpt-4o',
-                            messages=[
-                                {
-                                    'role': 'user',
-                                    'content': [
-                                        {
-                                            'type': 'text',
-                                            'text': self._get_vision_prompt()
-                                        },
-                                        {
-                                            'type': 'image_url',
-                                            'image_url': {
-                                                'url': f'data:image/png;base64,{base64_image}'
-                                            }
-                                        }
-                                    ]
-                                }
-                            ],
-                            max_tokens=2000
-                        )
-                    )
-                    
-                    logger.info("✅ Respuesta recibida de Vision API")
-                    response_text = response.choices[0].message.content
-                    logger.info(f"📝 Respuesta (primeros 500 chars): {response_text[:500]}...")
-                    extracted_data = self._parse_json_response(response_text)
-                    
-                    return extracted_data
+                    return await self._extract_page(image_url, prepass)
                     
             except ImportError:
                 logger.warning("⚠️  pdf2image no disponible - intentando con Assistants API")
@@ -122,10 +214,11 @@ class OpenAIService:
             assistant = self.client.beta.assistants.create(
                 name='Invoice Extractor',
                 instructions=self._get_extraction_instructions(),
-                model='gpt-4o',
+                model=self.model_tiers[-1],
                 tools=[{'type': 'file_search'}]
             )
             logger.info(f"✅ Asistente creado: {assistant.id}")
+            self.model_used = self.model_tiers[-1]
             
             # Crear thread con el archivo
             logger.info("💬 Creando conversación...")
@@ -152,6 +245,7 @@ class OpenAIService:
                 assistant_id=assistant.id
             )
             logger.info(f"✅ Procesamiento completado: {run.status}")
+            self._record_usage(run)
             
             if run.status != 'completed':
                 raise Exception(f"El asistente no completó el procesamiento: {run.status}")
@@ -171,7 +265,7 @@ class OpenAIService:
             response_text = "\n".join(parts)
             
             logger.info(f"📝 Respuesta del asistente (primeros 500 chars): {response_text[:500]}...")
-            extracted_data = self._parse_json_response(response_text)
+            extracted_data, _ = self._merge_known(self._parse_json_response(response_text), prepass)
             
             # Limpiar recursos
             logger.info("🧹 Limpiando recursos...")
@@ -197,60 +291,372 @@ class OpenAIService:
             logger.error(f"❌ Error al procesar PDF: {e}")
             raise
     
-    async def extract_from_image(self, file_content: bytes, mime_type: str) -> Dict[str, Any]:
-        """Extraer datos de una imagen usando Vision API"""
+    async def extract_from_image(
+        self,
+        file_content: bytes,
+        mime_type: str,
+        prepass: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Extraer datos de una imagen usando Vision API (prepass: como en extract_from_pdf)"""
         logger.info(f"🖼️ Procesando imagen: {mime_type}")
         
         try:
-            import base64
-            base64_image = base64.b64encode(file_content).decode('utf-8')
+            if prepass is None:
+                prepass = await run_local_prepass(file_content, mime_type)
+            return await self._extract_page(self.encode_image_url(file_content, mime_type), prepass)
             
-            logger.info("📤 Enviando a Vision API...")
-            response = self._call_openai_with_retry(
+        except RateLimitError as e:
+            logger.error(f"❌ Rate limit excedido: {e}")
+            raise Exception("Límite de solicitudes excedido. Por favor, inténtelo más tarde.")
+        except APITimeoutError as e:
+            logger.error(f"❌ Timeout al procesar imagen: {e}")
+            raise Exception("Tiempo de espera agotado al procesar el archivo. Por favor, inténtelo nuevamente.")
+        except APIConnectionError as e:
+            logger.error(f"❌ Error de conexión con OpenAI: {e}")
+            raise Exception("Error de conexión con el servicio de procesamiento. Verifique su conexión a internet.")
+        except APIError as e:
+            logger.error(f"❌ Error de API de OpenAI: {e}")
+            raise Exception(f"Error al procesar el archivo: {str(e)}")
+        except Exception as e:
+            logger.error(f"❌ Error al procesar imagen: {e}")
+            raise
+    
+    def _merge_known(self, extracted_data: Any, prepass: Dict[str, Any]) -> Tuple[Any, List[str]]:
+        """
+        Combinar una extracción con los campos leídos localmente (prevalecen estos)
+        
+        Returns:
+            (extracción combinada, campos de CHECKED_FIELDS en que la extracción difería)
+        """
+        if not prepass or not isinstance(extracted_data, dict):
+            return extracted_data, []
+        
+        merged = dict(extracted_data)
+        mismatches = []
+        for field, value in prepass["known"].items():
+            if isinstance(value, dict):
+                current = merged.get(field) if isinstance(merged.get(field), dict) else {}
+                pairs = [(f"{field}.{key}", current.get(key), known) for key, known in value.items()]
+                merged[field] = {**current, **value}
+            else:
+                pairs = [(field, merged.get(field), value)]
+                merged[field] = value
+            for name, extracted, known in pairs:
+                if name in CHECKED_FIELDS and extracted not in (None, "") and not same_value(extracted, known):
+                    mismatches.append(name)
+                    logger.warning(f"⚠️ {name}: la extracción dice {extracted!r} y la lectura local {known!r}")
+        
+        uuid = prepass.get("uuid")
+        if uuid and uuid not in (merged.get("observaciones") or ""):
+            merged["observaciones"] = " | ".join(filter(None, [merged.get("observaciones"), f"UUID: {uuid}"]))
+        with self._usage_lock:
+            self.usage["prepass_mismatches"] += len(mismatches)
+        return merged, mismatches
+    
+    @staticmethod
+    def image_key(file_content: bytes) -> str:
+        """Key de un archivo en la cache de imágenes (su sha256, igual que el stagingToken)"""
+        return hashlib.sha256(file_content).hexdigest()
+    
+    def _pdf_image_url(self, file_content: bytes) -> Optional[str]:
+        """Primera página del PDF como data URL PNG (None si el PDF no tiene páginas)"""
+        key = self.image_key(file_content)
+        image_url = encoded_image_cache.get(key)
+        if image_url is not None:
+            return image_url
+        
+        first_page = render_first_page(file_content)
+        if first_page is None:
+            return None
+        img_byte_arr = io.BytesIO()
+        first_page.save(img_byte_arr, format='PNG')
+        image_url = f'data:image/png;base64,{base64.b64encode(img_byte_arr.getvalue()).decode("utf-8")}'
+        encoded_image_cache.put(key, image_url)
+        return image_url
+    
+    def encode_image_url(self, file_content: bytes, mime_type: str) -> str:
+        """Data URL que se envía a Vision para un archivo (reutiliza la cache de imágenes)"""
+        if mime_type == 'application/pdf':
+            image_url = self._pdf_image_url(file_content)
+            if image_url is None:
+                raise ValueError("El PDF no tiene páginas")
+            return image_url
+        
+        key = self.image_key(file_content)
+        image_url = encoded_image_cache.get(key)
+        if image_url is None:
+            image_url = f'data:{mime_type};base64,{base64.b64encode(file_content).decode("utf-8")}'
+            encoded_image_cache.put(key, image_url)
+        return image_url
+    
+    async def repair_extraction(
+        self,
+        previous: Dict[str, Any],
+        problems: Dict[str, str],
+        image_url: str
+    ) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Volver a pedir solo los campos con problemas de una extracción previa
+        
+        Envía la misma imagen con un prompt corto que lista los campos y su
+        error, y combina la respuesta con la extracción previa. Pide muchos
+        menos tokens de salida que una extracción completa.
+        
+        Args:
+            previous: Extracción previa
+            problems: Mensaje de error por campo de primer nivel
+            image_url: Data URL de la factura (encode_image_url)
+        
+        Returns:
+            (extracción combinada, campos que cambiaron)
+        """
+        model = self.model_tiers[-1]
+        logger.info(f"🩹 Reparando campos {', '.join(problems)} ({model})...")
+        
+        try:
+            # Cliente síncrono de OpenAI: la llamada (con sus reintentos) va en un hilo
+            response = await asyncio.to_thread(
+                self._call_openai_with_retry,
                 lambda: self.client.chat.completions.create(
-                    model='gpt-4o',
+                    model=model,
                     messages=[
                         {
                             'role': 'user',
                             'content': [
                                 {
                                     'type': 'text',
-                                    'text': self._get_vision_prompt()
+                                    'text': self._get_repair_prompt(previous, problems)
                                 },
                                 {
                                     'type': 'image_url',
                                     'image_url': {
-                                        'url': f'data:{mime_type};base64,{base64_image}'
+                                        'url': image_url
                                     }
                                 }
                             ]
                         }
                     ],
-                    max_tokens=2000
+                    max_tokens=settings.OPENAI_REPAIR_MAX_TOKENS
                 )
             )
-            
-            logger.info("✅ Respuesta recibida de Vision API")
-            response_text = response.choices[0].message.content
-            extracted_data = self._parse_json_response(response_text)
-            
-            return extracted_data
-            
         except RateLimitError as e:
             logger.error(f"❌ Rate limit excedido: {e}")
             raise Exception("Límite de solicitudes excedido. Por favor, inténtelo más tarde.")
-        except APITimeoutError as e:
-            logger.error(f"❌ Timeout al procesar imagen: {e}")
-            raise Exception("Tiempo de espera agotado al procesar el archivo. Por favor, inténtelo nuevamente.")
-        except APIConnectionError as e:
+        except (APITimeoutError, APIConnectionError) as e:
             logger.error(f"❌ Error de conexión con OpenAI: {e}")
-            raise Exception("Error de conexión con el servicio de procesamiento. Verifique su conexión a internet.")
+            raise Exception("Error de conexión con el servicio de procesamiento. Por favor, inténtelo nuevamente.")
         except APIError as e:
             logger.error(f"❌ Error de API de OpenAI: {e}")
-            raise Exception(f"Error al procesar el archivo: {str(e)}")
+            raise Exception(f"Error al reparar la extracción: {str(e)}")
+        
+        self.model_used = model
+        answer = self._parse_json_response(response.choices[0].message.content or "")
+        
+        repaired = dict(previous)
+        changed = []
+        for field in problems:
+            if field not in answer:
+                continue
+            value = answer[field]
+            if isinstance(value, dict) and isinstance(repaired.get(field), dict):
+                value = {**repaired[field], **value}
+            if value != repaired.get(field):
+                repaired[field] = value
+                changed.append(field)
+        logger.info(f"✅ Campos reparados: {', '.join(changed) or 'ninguno'}")
+        return repaired, changed
+    
+    async def _extract_page(self, image_url: str, prepass: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Extraer una página con Vision: en franjas paralelas si su tabla de conceptos es larga (VISION_BANDS_ENABLED)"""
+        if settings.VISION_BANDS_ENABLED:
+            bands = await self._split_bands(image_url)
+            if bands:
+                try:
+                    return await self._extract_with_bands(image_url, bands, prepass)
+                except Exception as e:
+                    logger.warning(f"⚠️ Extracción en franjas fallida ({e}); se extrae la página completa")
+        # Cliente síncrono de OpenAI: la llamada va en un hilo para no bloquear el event loop
+        return await asyncio.get_running_loop().run_in_executor(None, self._extract_with_vision, image_url, prepass)
+    
+    async def _split_bands(self, image_url: str) -> List[str]:
+        """Franjas de la página (split_page_bands en el pool de procesos), o [] si no es larga"""
+        try:
+            image_bytes = base64.b64decode(image_url.split(",", 1)[1])
+            return await run_in_raster_pool(
+                split_page_bands,
+                image_bytes,
+                settings.VISION_BAND_MIN_LINES,
+                settings.VISION_BAND_LINES,
+                settings.VISION_BAND_OVERLAP_LINES
+            )
         except Exception as e:
-            logger.error(f"❌ Error al procesar imagen: {e}")
-            raise
+            logger.warning(f"⚠️ No se pudo dividir la página en franjas: {e}")
+            return []
+    
+    async def _extract_with_bands(self, image_url: str, bands: List[str], prepass: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Extraer una página larga con llamadas concurrentes
+        
+        Una llamada ve la página completa y devuelve todo salvo los items
+        (respuesta corta); cada franja devuelve solo sus conceptos. Como el
+        tiempo lo domina la generación de tokens, la latencia crece con el
+        tamaño de una franja y no con el de toda la tabla (y ninguna
+        respuesta se acerca a OPENAI_MAX_TOKENS).
+        """
+        logger.info(f"✂️ Tabla larga: encabezado + {len(bands)} franjas en paralelo")
+        loop = asyncio.get_running_loop()
+        header, *band_items = await asyncio.gather(
+            loop.run_in_executor(_band_executor, self._extract_with_vision, image_url, prepass, False),
+            *(
+                loop.run_in_executor(_band_executor, self._extract_band_items, url, index + 1, len(bands))
+                for index, url in enumerate(bands)
+            )
+        )
+        header["items"] = merge_band_items(band_items, settings.VISION_BAND_OVERLAP_LINES)
+        with self._usage_lock:
+            self.usage["band_extractions"] += 1
+        logger.info(f"🧩 {len(header['items'])} conceptos de {len(bands)} franjas")
+        return header
+    
+    def _extract_band_items(self, image_url: str, number: int, count: int) -> List[Dict[str, Any]]:
+        """Conceptos de una franja, escalando de modelo si la respuesta no es una lista de items válida"""
+        for tier, model in enumerate(self.model_tiers):
+            response = self._call_openai_with_retry(
+                lambda: self.client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {
+                            'role': 'user',
+                            'content': [
+                                {'type': 'text', 'text': self._get_band_prompt(number, count)},
+                                {'type': 'image_url', 'image_url': {'url': image_url}}
+                            ]
+                        }
+                    ],
+                    max_tokens=settings.OPENAI_MAX_TOKENS
+                )
+            )
+            try:
+                data = self._parse_json_response(response.choices[0].message.content or "")
+                items = data.get("items") if isinstance(data, dict) else data
+                if not isinstance(items, list):
+                    raise ValueError("la respuesta no tiene items")
+                get_list_adapter(Item).validate_python(items)
+                return items
+            except ValueError as e:
+                # ValidationError de Pydantic también es un ValueError
+                if tier == len(self.model_tiers) - 1:
+                    raise ValueError(f"franja {number}: {e}")
+                with self._usage_lock:
+                    self.usage["escalations"] += 1
+                logger.warning(f"⤴️ Franja {number} de {model} descartada; escalando a {self.model_tiers[tier + 1]}")
+    
+    def _extract_with_vision(
+        self,
+        image_url: str,
+        prepass: Optional[Dict[str, Any]] = None,
+        include_items: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Extraer con Vision probando los modelos de model_tiers en orden
+        
+        Se escala al siguiente modelo si la respuesta no es JSON válido, no
+        pasa las validaciones de InvoiceBase (p. ej. total = subtotal + IVA),
+        le faltan campos clave o contradice la lectura local (QR / capa de
+        texto). El último modelo se acepta tal cual. Los campos ya leídos
+        localmente no se piden y prevalecen sobre la respuesta. Con
+        include_items=False no se piden los conceptos (extracción en franjas).
+        """
+        known = (prepass or {}).get("known") or {}
+        for tier, model in enumerate(self.model_tiers):
+            is_last = tier == len(self.model_tiers) - 1
+            
+            logger.info(f"📤 Enviando a Vision API ({model})...")
+            body = self.vision_request_body(image_url, model, known, include_items)
+            response = self._call_openai_with_retry(lambda: self.client.chat.completions.create(**body))
+            
+            logger.info("✅ Respuesta recibida de Vision API")
+            response_text = response.choices[0].message.content or ""
+            logger.info(f"📝 Respuesta (primeros 500 chars): {response_text[:500]}...")
+            try:
+                extracted_data, problem = self.check_vision_response(response_text, prepass)
+            except ValueError as e:
+                if is_last:
+                    raise
+                problem = str(e)
+            
+            if problem is None or is_last:
+                self.model_used = model
+                return extracted_data
+            
+            with self._usage_lock:
+                self.usage["escalations"] += 1
+            logger.warning(f"⤴️ Extracción de {model} descartada ({problem}); escalando a {self.model_tiers[tier + 1]}")
+    
+    def vision_request_body(
+        self,
+        image_url: str,
+        model: str,
+        known: Optional[Dict[str, Any]] = None,
+        include_items: bool = True
+    ) -> Dict[str, Any]:
+        """Cuerpo de la petición de chat completions de una extracción con Vision (también va en los JSONL de la Batch API)"""
+        return {
+            'model': model,
+            'messages': [
+                {
+                    'role': 'user',
+                    'content': [
+                        {
+                            'type': 'text',
+                            'text': self._get_vision_prompt(known, include_items)
+                        },
+                        {
+                            'type': 'image_url',
+                            'image_url': {
+                                'url': image_url
+                            }
+                        }
+                    ]
+                }
+            ],
+            'max_tokens': settings.OPENAI_MAX_TOKENS
+        }
+    
+    def check_vision_response(
+        self,
+        response_text: str,
+        prepass: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Dict[str, Any], Optional[str]]:
+        """
+        Parsear la respuesta de Vision y decidir si es aceptable
+        
+        Returns:
+            (datos extraídos con la lectura local aplicada, motivo para escalar de modelo o None)
+        
+        Raises:
+            ValueError: Si la respuesta no contiene JSON
+        """
+        extracted_data, mismatches = self._merge_known(self._parse_json_response(response_text), prepass or {})
+        problem = self._find_extraction_problem(extracted_data)
+        if problem is None and mismatches:
+            problem = f"{mismatches[0]} no coincide con la lectura local"
+        return extracted_data, problem
+    
+    def _find_extraction_problem(self, extracted_data: Any) -> Optional[str]:
+        """Motivo por el que una extracción no es aceptable, o None si lo es"""
+        if not isinstance(extracted_data, dict):
+            return "la respuesta no es un objeto JSON"
+        
+        missing = find_missing_fields(extracted_data)
+        if missing:
+            return f"falta {missing[0]}"
+        
+        try:
+            InvoiceBase.model_validate(extracted_data)
+        except ValidationError as e:
+            return f"no pasa la validación: {e.errors()[0]['msg']}"
+        return None
     
     def _get_extraction_instructions(self) -> str:
         """Instrucciones para el asistente"""
@@ -274,9 +680,9 @@ Campos a extraer:
 
 Devuelve SOLO el JSON sin texto adicional."""
     
-    def _get_vision_prompt(self) -> str:
-        """Prompt para Vision API"""
-        return """Extrae TODOS los datos de esta factura y devuélvelos en formato JSON con esta estructura:
+    def _get_vision_prompt(self, known: Optional[Dict[str, Any]] = None, include_items: bool = True) -> str:
+        """Prompt para Vision API (sin pedir los campos ya leídos localmente, ni los items si se extraen en franjas)"""
+        prompt = """Extrae TODOS los datos de esta factura y devuélvelos en formato JSON con esta estructura:
 {
   "numeroFactura": "string",
   "fecha": "YYYY-MM-DD",
@@ -295,6 +701,45 @@ Devuelve SOLO el JSON sin texto adicional."""
 }
 
 Devuelve SOLO el JSON sin texto adicional."""
+        if not include_items:
+            prompt = prompt.replace(
+                '  "items": [{"descripcion": "string", "cantidad": number, "precioUnitario": number, "total": number}],\n', ''
+            )
+            prompt += "\n\nNo incluyas items: los conceptos de la tabla se extraen por separado."
+        if known:
+            lines = []
+            for field, value in known.items():
+                values = value.items() if isinstance(value, dict) else [(None, value)]
+                for key, item in values:
+                    name = f"{field}.{key}" if key else field
+                    lines.append(f"- {name}: {json.dumps(item, ensure_ascii=False)}")
+            prompt += f"""
+
+Estos datos ya se leyeron del código QR y del texto de la factura y son exactos:
+{chr(10).join(lines)}
+Omítelos en tu respuesta y devuelve todos los demás campos (incluidos los otros datos de proveedor y cliente)."""
+        return prompt
+    
+    def _get_band_prompt(self, number: int, count: int) -> str:
+        """Prompt para una franja de una página larga (solo los conceptos)"""
+        return f"""Esta imagen es la franja {number} de {count} de una factura con una tabla de conceptos larga (las franjas se traslapan unas líneas).
+Devuelve en formato JSON solo los conceptos (filas de la tabla) que aparecen completos en esta franja, en el orden en que aparecen:
+{{"items": [{{"descripcion": "string", "cantidad": number, "precioUnitario": number, "total": number}}]}}
+
+Omite encabezados de la tabla, subtotales, totales y filas cortadas por el borde superior o inferior de la imagen.
+Si no hay conceptos devuelve {{"items": []}}. Devuelve SOLO el JSON sin texto adicional."""
+    
+    def _get_repair_prompt(self, previous: Dict[str, Any], problems: Dict[str, str]) -> str:
+        """Prompt corto para corregir solo los campos con problemas"""
+        lines = [
+            f'- {field}: {json.dumps(previous.get(field), ensure_ascii=False)} ({message})'
+            for field, message in problems.items()
+        ]
+        fields = ", ".join(f'"{field}"' for field in problems)
+        return f"""En una extracción previa de esta factura estos campos quedaron mal:
+{chr(10).join(lines)}
+
+Vuelve a leerlos en la imagen. Devuelve SOLO un JSON con las claves {fields} corregidas (mismo formato que antes: fechas YYYY-MM-DD, montos como número)."""
     
     def _parse_json_response(self, response_text: str) -> Dict[str, Any]:
         """Parsear respuesta JSON de OpenAI de forma robusta"""
@@ -336,6 +781,28 @@ Devuelve SOLO el JSON sin texto adicional."""
             logger.error(f"Respuesta completa del asistente:\n{response_text}")
             raise ValueError(f'No se pudo parsear el JSON: {e}')
     
+    def _on_request(self, request):
+        with self._usage_lock:
+            self.usage["requests"] += 1
+            self.usage["request_bytes"] += int(request.headers.get("content-length", 0))
+        request.extensions["usage_started_at"] = time.perf_counter()
+    
+    def _on_response(self, response):
+        started_at = response.request.extensions.get("usage_started_at")
+        if started_at is not None:
+            with self._usage_lock:
+                self.usage["api_seconds"] += time.perf_counter() - started_at
+    
+    def _record_usage(self, result) -> None:
+        """Sumar los tokens reportados por una respuesta (chat completion o run)"""
+        usage = getattr(result, "usage", None)
+        if usage is None:
+            return
+        with self._usage_lock:
+            self.usage["prompt_tokens"] += usage.prompt_tokens or 0
+            self.usage["completion_tokens"] += usage.completion_tokens or 0
+            self.usage["total_tokens"] += usage.total_tokens or 0
+    
     def _call_openai_with_retry(self, func, max_retries=None):
         """Ejecutar llamada a OpenAI con reintentos exponenciales"""
         if max_retries is None:
@@ -345,7 +812,9 @@ Devuelve SOLO el JSON sin texto adicional."""
         
         for attempt in range(max_retries):
             try:
-                return func()
+                result = func()
+                self._record_usage(result)
+                return result
             except RateLimitError as e:
                 last_exception = e
                 if attempt < max_retries - 1:
@@ -0,0 +1,144 @@
+from typing import Any, Dict, List, Optional, Tuple
+import base64
+import io
+import logging
+import math
+import re
+
+logger = logging.getLogger(__name__)
+
+# Ancho al que se reduce la página para buscar líneas (~120 dpi en tamaño carta)
+WORK_WIDTH = 1000
+
+# Gris por debajo del cual un píxel cuenta como tinta
+INK_LEVEL = 160
+
+# Una columna con tinta en más de esta fracción de la página es una regla vertical de tabla
+RULE_COLUMN_FRACTION = 0.25
+
+# Altura mínima (px a WORK_WIDTH) de una línea de texto; las reglas horizontales miden menos
+MIN_LINE_HEIGHT = 4
+
+def find_text_lines(image) -> List[Tuple[int, int]]:
+    """
+    Líneas de texto de una página como (arriba, abajo) en píxeles de la imagen original
+
+    Perfil de proyección horizontal: una fila con algo de tinta pertenece a
+    una línea y las filas en blanco las separan. Las reglas verticales de
+    las tablas se descartan antes (si no, toda la tabla sería una sola
+    línea). Todo se calcula con reducciones de PIL, sin recorrer píxeles en
+    Python.
+    """
+    from PIL import Image, ImageChops
+
+    gray = image.convert("L")
+    scale = gray.width / WORK_WIDTH
+    height = max(1, round(gray.height / scale))
+    gray = gray.resize((WORK_WIDTH, height), Image.BOX)
+
+    ink = gray.point(lambda value: 255 if value < INK_LEVEL else 0)
+    columns = ink.resize((WORK_WIDTH, 1), Image.BOX)
+    keep = columns.point(lambda value: 0 if value > 255 * RULE_COLUMN_FRACTION else 255)
+    ink = ImageChops.darker(ink, keep.resize((WORK_WIDTH, height), Image.NEAREST))
+    rows = list(ink.resize((1, height), Image.BOX).getdata())
+
+    lines = []
+    top = None
+    for y, value in enumerate(rows + [0]):
+        if value and top is None:
+            top = y
+        elif not value and top is not None:
+            if y - top >= MIN_LINE_HEIGHT:
+                lines.append((round(top * scale), round(y * scale)))
+            top = None
+    return lines
+
+def plan_bands(line_count: int, band_lines: int, overlap_lines: int) -> List[Tuple[int, int]]:
+    """
+    Rangos de líneas [inicio, fin) de cada franja, de tamaño parejo y traslapados overlap_lines
+
+    El traslape garantiza que una fila de la tabla aparezca completa en al
+    menos una franja aunque ocupe dos líneas.
+    """
+    step = max(1, band_lines - overlap_lines)
+    count = max(1, math.ceil((line_count - overlap_lines) / step))
+    size = math.ceil((line_count + (count - 1) * overlap_lines) / count)
+    bands = []
+    for index in range(count):
+        start = min(index * (size - overlap_lines), max(0, line_count - size))
+        bands.append((start, min(line_count, start + size)))
+    return bands
+
+def split_page_bands(image_bytes: bytes, min_lines: int, band_lines: int, overlap_lines: int) -> List[str]:
+    """
+    Franjas horizontales de una página larga como data URLs PNG (se ejecuta en el pool de procesos)
+
+    Los cortes caen a la mitad del espacio en blanco entre dos líneas, nunca
+    sobre texto.
+
+    Returns:
+        Una data URL por franja, o [] si la página tiene menos de min_lines líneas
+    """
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+    lines = find_text_lines(image)
+    if len(lines) < min_lines:
+        return []
+
+    urls = []
+    for start, end in plan_bands(len(lines), band_lines, overlap_lines):
+        top = (lines[start - 1][1] + lines[start][0]) // 2 if start > 0 else 0
+        bottom = (lines[end - 1][1] + lines[end][0]) // 2 if end < len(lines) else image.height
+        buffer = io.BytesIO()
+        image.crop((0, top, image.width, bottom)).save(buffer, format='PNG')
+        urls.append(f'data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode("utf-8")}')
+    return urls
+
+def _normalize_description(value: Any) -> str:
+    return re.sub(r"\s+", " ", str(value or "")).strip().upper()
+
+def _same_item(previous: Dict[str, Any], current: Dict[str, Any]) -> bool:
+    """La misma fila leída en dos franjas: mismos montos y una descripción contiene el inicio de la otra"""
+    for key in ("cantidad", "total"):
+        a, b = previous.get(key), current.get(key)
+        if a is None or b is None:
+            if a != b:
+                return False
+            continue
+        try:
+            if abs(float(a) - float(b)) > 0.01:
+                return False
+        except (TypeError, ValueError):
+            return False
+    first, second = _normalize_description(previous.get("descripcion")), _normalize_description(current.get("descripcion"))
+    return first.startswith(second) or second.startswith(first)
+
+def _overlap_length(merged: List[Dict[str, Any]], items: List[Dict[str, Any]], overlap_rows: int) -> int:
+    """Filas con que empieza items que ya son las últimas de merged (la zona de traslape, a lo más overlap_rows)"""
+    for length in range(min(overlap_rows, len(merged), len(items)), 0, -1):
+        if all(_same_item(a, b) for a, b in zip(merged[-length:], items[:length])):
+            return length
+    return 0
+
+def merge_band_items(bands: List[Optional[List[Dict[str, Any]]]], overlap_rows: int) -> List[Dict[str, Any]]:
+    """
+    Unir los items de franjas consecutivas quitando las filas repetidas en los traslapes
+
+    Solo se buscan repetidas entre las primeras overlap_rows filas de cada
+    franja (las líneas de traslape, VISION_BAND_OVERLAP_LINES): una tabla
+    con filas idénticas pierde a lo más esas filas en cada borde y no toda
+    la franja. Si una fila aparece en las dos franjas se conserva la
+    descripción más larga (una franja pudo verla cortada).
+    """
+    merged: List[Dict[str, Any]] = []
+    for items in bands:
+        items = [item for item in items or [] if isinstance(item, dict)]
+        overlap = _overlap_length(merged, items, overlap_rows)
+        for position, item in enumerate(items[:overlap]):
+            previous = merged[len(merged) - overlap + position]
+            if len(str(item.get("descripcion") or "")) > len(str(previous.get("descripcion") or "")):
+                previous["descripcion"] = item["descripcion"]
+        merged.extend(items[overlap:])
+    return merged
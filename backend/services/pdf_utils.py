@@ -0,0 +1,49 @@
+import logging
+import os
+from functools import lru_cache
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=1)
+def get_poppler_path() -> Optional[str]:
+    """Obtener la ruta de Poppler (solo necesaria en Windows)"""
+    if os.name != 'nt':
+        return None
+    
+    # Intentar obtener de variable de entorno primero
+    poppler_path = os.environ.get('POPPLER_PATH')
+    if poppler_path:
+        return poppler_path
+    
+    # Si no existe, usar ruta común de instalación
+    common_paths = [
+        r'C:\poppler-25.11.0\Library\bin',
+        r'C:\Program Files\poppler\Library\bin',
+        r'C:\poppler\Library\bin',
+    ]
+    for path in common_paths:
+        if os.path.exists(path):
+            logger.info(f"✅ Poppler encontrado en: {path}")
+            return path
+    return None
+
+def render_first_page(file_content: bytes, dpi: int = 200):
+    """
+    Convertir la primera página de un PDF a imagen (PIL)
+    
+    Args:
+        file_content: Contenido del PDF en bytes
+        dpi: Resolución de rasterización
+    
+    Returns:
+        Imagen PIL de la primera página, o None si el PDF no tiene páginas
+    """
+    from pdf2image import convert_from_bytes
+    
+    poppler_path = get_poppler_path()
+    if poppler_path:
+        images = convert_from_bytes(file_content, dpi=dpi, first_page=1, last_page=1, poppler_path=poppler_path)
+    else:
+        images = convert_from_bytes(file_content, dpi=dpi, first_page=1, last_page=1)
+    return images[0] if images else None
@@ -0,0 +1,31 @@
+from concurrent.futures import ProcessPoolExecutor
+from config import settings
+from typing import Optional
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Pool de procesos compartido para trabajo de CPU (rasterizar PDFs, redimensionar imágenes)
+_raster_pool: Optional[ProcessPoolExecutor] = None
+
+def get_raster_pool() -> ProcessPoolExecutor:
+    """Obtener (creando si hace falta) el pool de procesos de rasterización"""
+    global _raster_pool
+    if _raster_pool is None:
+        _raster_pool = ProcessPoolExecutor(max_workers=settings.RASTER_POOL_WORKERS)
+        logger.info(f"✅ Pool de rasterización iniciado ({_raster_pool._max_workers} procesos)")
+    return _raster_pool
+
+async def run_in_raster_pool(func, *args):
+    """Ejecutar una función (importable a nivel de módulo) en el pool de procesos"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_raster_pool(), func, *args)
+
+def shutdown_raster_pool():
+    """Cerrar el pool de procesos al apagar la aplicación"""
+    global _raster_pool
+    if _raster_pool is not None:
+        _raster_pool.shutdown(wait=False, cancel_futures=True)
+        _raster_pool = None
+        logger.info("🔌 Pool de rasterización cerrado")
@@ -1,12 +1,75 @@
 import boto3
 from botocore.exceptions import ClientError
 from config import settings
+import asyncio
+import hashlib
 import logging
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
 import os
 
 logger = logging.getLogger(__name__)
 
+# Prefijo de los objetos direccionados por contenido (sha256/xx/yy/<hash>)
+CONTENT_KEY_PREFIX = "sha256/"
+
+# Máximo de keys por llamada a delete_objects (límite de S3)
+DELETE_BATCH_SIZE = 1000
+
+@lru_cache(maxsize=1)
+def _get_s3_client():
+    """Cliente de boto3 compartido por todo el proceso (es thread-safe)"""
+    return boto3.client(
+        's3',
+        region_name=settings.AWS_REGION,
+        endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
+    )
+
+class PresignedUrlCache:
+    """
+    Cache LRU de URLs firmadas por key de S3
+    
+    Una URL se reutiliza mientras le quede más de `min_remaining` segundos
+    de vigencia; cerca de expirar se vuelve a firmar.
+    """
+    
+    def __init__(self, max_entries: int = 10000, min_remaining: int = 300):
+        self.max_entries = max_entries
+        self.min_remaining = min_remaining
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, s3_key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(s3_key)
+            if entry is None:
+                return None
+            url, expires_at = entry
+            if expires_at - time.monotonic() <= self.min_remaining:
+                del self._entries[s3_key]
+                return None
+            self._entries.move_to_end(s3_key)
+            return url
+    
+    def put(self, s3_key: str, url: str, expiration: int) -> None:
+        with self._lock:
+            self._entries[s3_key] = (url, time.monotonic() + expiration)
+            self._entries.move_to_end(s3_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, s3_key: str) -> None:
+        with self._lock:
+            self._entries.pop(s3_key, None)
+
+presigned_url_cache = PresignedUrlCache()
+
 class S3Service:
     def __init__(self):
         if not settings.AWS_S3_BUCKET_NAME:
@@ -15,26 +78,67 @@ class S3Service:
             self.bucket_name = None
             return
             
-        self.client = boto3.client(
-            's3',
-            region_name=settings.AWS_REGION,
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
-        )
+        self.client = _get_s3_client()
         self.bucket_name = settings.AWS_S3_BUCKET_NAME
         logger.info(f"✅ S3 Service inicializado - Bucket: {self.bucket_name}")
     
-    def upload_file(self, file_content: bytes, file_name: str, content_type: str) -> dict:
+    @staticmethod
+    def build_key(file_content: bytes) -> str:
+        """
+        Calcular el key de S3 (direccionado por contenido) de un archivo
+        
+        Los archivos se guardan bajo sha256/xx/yy/<hash>, de modo que el mismo
+        contenido siempre tiene el mismo key y el key se conoce antes de subir.
+        
+        Args:
+            file_content: Contenido del archivo en bytes
+            
+        Returns:
+            Key de S3 donde se guardará el archivo
+        """
+        if not file_content:
+            raise ValueError("Contenido del archivo está vacío")
+        
+        return S3Service.build_key_from_digest(hashlib.sha256(file_content).hexdigest())
+    
+    @staticmethod
+    def build_key_from_digest(digest: str) -> str:
+        """Key de S3 de un archivo cuyo sha256 (hex) ya se conoce"""
+        return f"{CONTENT_KEY_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}"
+    
+    def build_url(self, s3_key: str) -> str:
+        """Construir URL (no firmada) de un objeto en el bucket"""
+        return f"https://{self.bucket_name}.s3.{settings.AWS_REGION}.amazonaws.com/{s3_key}"
+    
+    def object_exists(self, s3_key: str) -> bool:
+        """Verificar con HEAD si un objeto existe en el bucket"""
+        if not self.client:
+            raise ValueError("S3 no está configurado")
+        
+        try:
+            self.client.head_object(Bucket=self.bucket_name, Key=s3_key)
+            return True
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+            if error_code in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+    
+    def upload_file(self, file_content: bytes, file_name: str, content_type: str, s3_key: Optional[str] = None, check_exists: bool = True) -> dict:
         """
         Subir archivo a S3 y retornar la información del archivo
         
+        Si ya existe un objeto con el mismo contenido no se vuelve a subir.
+        
         Args:
             file_content: Contenido del archivo en bytes
             file_name: Nombre original del archivo
             content_type: Tipo MIME del archivo
+            s3_key: Key calculado con build_key (opcional, se calcula si no se indica)
+            check_exists: Hacer HEAD antes de subir para omitir duplicados
             
         Returns:
-            dict con s3Key y s3Url
+            dict con s3Key, s3Url y uploaded (False si el objeto ya existía)
         """
         if not self.client:
             raise ValueError("S3 no está configurado")
@@ -51,14 +155,22 @@ class S3Service:
         if len(file_content) > MAX_FILE_SIZE:
             raise ValueError(f"Archivo demasiado grande ({len(file_content) / 1024 / 1024:.2f}MB). Máximo: 50MB")
         
-        # Sanitizar nombre de archivo
-        safe_file_name = file_name.replace('..', '').replace('/', '_').replace('\\', '_')
-        
         try:
-            # Generar key único usando timestamp y nombre de archivo
+            if not s3_key:
+                s3_key = self.build_key(file_content)
             timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-            file_extension = os.path.splitext(safe_file_name)[1]
-            s3_key = f"invoices/{timestamp}_{safe_file_name}"
+            
+            # Generar URL (no firmada, asumiendo bucket público o con políticas)
+            s3_url = self.build_url(s3_key)
+            
+            # Contenido duplicado: el objeto ya está en S3, no repetir el PUT
+            if check_exists and self.object_exists(s3_key):
+                logger.info(f"♻️ Archivo ya existe en S3, se omite la subida: {s3_key}")
+                return {
+                    's3Key': s3_key,
+                    's3Url': s3_url,
+                    'uploaded': False
+                }
             
             # Subir a S3
             self.client.put_object(
@@ -72,14 +184,12 @@ class S3Service:
                 }
             )
             
-            # Generar URL (no firmada, asumiendo bucket público o con políticas)
-            s3_url = f"https://{self.bucket_name}.s3.{settings.AWS_REGION}.amazonaws.com/{s3_key}"
-            
             logger.info(f"✅ Archivo subido a S3: {s3_key}")
             
             return {
                 's3Key': s3_key,
-                's3Url': s3_url
+                's3Url': s3_url,
+                'uploaded': True
             }
             
         except ClientError as e:
@@ -98,6 +208,44 @@ class S3Service:
             logger.error(f"❌ Error inesperado al subir a S3: {e}")
             raise
     
+    def copy_file(self, source_key: str, s3_key: str, check_exists: bool = True) -> dict:
+        """
+        Copiar un objeto dentro del bucket (server-side, sin pasar por el backend)
+        
+        Args:
+            source_key: Key del objeto a copiar
+            s3_key: Key de destino
+            check_exists: Hacer HEAD antes de copiar para omitir duplicados
+            
+        Returns:
+            dict con s3Key, s3Url y uploaded (False si el destino ya existía)
+        """
+        if not self.client:
+            raise ValueError("S3 no está configurado")
+        
+        s3_url = self.build_url(s3_key)
+        if check_exists and self.object_exists(s3_key):
+            logger.info(f"♻️ Archivo ya existe en S3, se omite la copia: {s3_key}")
+            return {'s3Key': s3_key, 's3Url': s3_url, 'uploaded': False}
+        
+        try:
+            # Conserva ContentType y metadata del objeto origen
+            self.client.copy_object(
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                CopySource={'Bucket': self.bucket_name, 'Key': source_key},
+                MetadataDirective='COPY'
+            )
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+            logger.error(f"❌ Error al copiar en S3 ({error_code}): {e}")
+            if error_code in ('NoSuchKey', '404'):
+                raise Exception(f"Archivo no encontrado en S3: {source_key}")
+            raise Exception(f"Error al copiar archivo en S3: {str(e)}")
+        
+        logger.info(f"✅ Archivo copiado en S3: {source_key} -> {s3_key}")
+        return {'s3Key': s3_key, 's3Url': s3_url, 'uploaded': True}
+    
     def delete_file(self, s3_key: str) -> bool:
         """
         Eliminar archivo de S3
@@ -116,6 +264,7 @@ class S3Service:
                 Bucket=self.bucket_name,
                 Key=s3_key
             )
+            presigned_url_cache.invalidate(s3_key)
             logger.info(f"✅ Archivo eliminado de S3: {s3_key}")
             return True
             
@@ -131,6 +280,76 @@ class S3Service:
             logger.error(f"❌ Error inesperado al eliminar de S3: {e}")
             return False
     
+    def iter_object_pages(self, prefix: str = "") -> Iterator[List[dict]]:
+        """
+        Recorrer los objetos del bucket página por página (sin cargar el listado completo)
+        
+        Args:
+            prefix: Prefijo de los keys a listar
+            
+        Yields:
+            Listas de hasta 1000 dicts de list_objects_v2 (Key, Size, LastModified, ...)
+        """
+        if not self.client:
+            raise ValueError("S3 no está configurado")
+        
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            yield page.get('Contents', [])
+    
+    def delete_files(self, s3_keys: List[str]) -> Tuple[List[str], Dict[str, str]]:
+        """
+        Eliminar varios archivos con delete_objects en lotes de hasta 1000 keys
+        
+        Args:
+            s3_keys: Keys de los archivos en S3
+            
+        Returns:
+            Tupla (keys eliminados, errores por key)
+        """
+        if not self.client:
+            raise ValueError("S3 no está configurado")
+        
+        deleted = []
+        errors = {}
+        for start in range(0, len(s3_keys), DELETE_BATCH_SIZE):
+            batch = s3_keys[start:start + DELETE_BATCH_SIZE]
+            try:
+                response = self.client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={
+                        'Objects': [{'Key': key} for key in batch],
+                        'Quiet': True
+                    }
+                )
+            except ClientError as e:
+                logger.error(f"❌ Error al eliminar lote de S3: {e}")
+                errors.update({key: str(e) for key in batch})
+                continue
+            
+            # En modo Quiet solo se reportan los errores
+            batch_errors = {err['Key']: err.get('Message', err.get('Code', 'Unknown')) for err in response.get('Errors', [])}
+            errors.update(batch_errors)
+            for key in batch:
+                if key not in batch_errors:
+                    deleted.append(key)
+                    presigned_url_cache.invalidate(key)
+        
+        logger.info(f"🗑️ Archivos eliminados de S3: {len(deleted)} (errores: {len(errors)})")
+        return deleted, errors
+    
+    async def upload_file_async(self, file_content: bytes, file_name: str, content_type: str, s3_key: Optional[str] = None) -> dict:
+        """Subir archivo a S3 en un hilo, sin bloquear el event loop"""
+        return await asyncio.to_thread(self.upload_file, file_content, file_name, content_type, s3_key)
+    
+    async def delete_file_async(self, s3_key: str) -> bool:
+        """Eliminar archivo de S3 en un hilo, sin bloquear el event loop"""
+        return await asyncio.to_thread(self.delete_file, s3_key)
+    
+    async def delete_files_async(self, s3_keys: List[str]) -> Tuple[List[str], Dict[str, str]]:
+        """Eliminar varios archivos de S3 en un hilo, sin bloquear el event loop"""
+        return await asyncio.to_thread(self.delete_files, s3_keys)
+    
     def generate_presigned_url(self, s3_key: str, expiration: int = 3600) -> str:
         """
         Generar URL firmada para acceso temporal
@@ -169,3 +388,40 @@ class S3Service:
         except Exception as e:
             logger.error(f"❌ Error inesperado al generar URL firmada: {e}")
             raise
+    
+    def get_presigned_url_cached(self, s3_key: str, expiration: int = 3600) -> str:
+        """
+        Obtener URL firmada reutilizando la cache mientras siga vigente
+        
+        Args:
+            s3_key: Key del archivo en S3
+            expiration: Tiempo de expiración en segundos de las URLs nuevas
+            
+        Returns:
+            URL firmada
+        """
+        url = presigned_url_cache.get(s3_key)
+        if url is None:
+            url = self.generate_presigned_url(s3_key, expiration)
+            presigned_url_cache.put(s3_key, url, expiration)
+        return url
+    
+    def generate_presigned_urls(self, s3_keys: List[str], expiration: int = 3600) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """
+        Firmar varios keys en una sola llamada
+        
+        Args:
+            s3_keys: Keys de los archivos en S3
+            expiration: Tiempo de expiración en segundos de las URLs nuevas
+            
+        Returns:
+            Tupla (urls, errores), ambos dicts indexados por key
+        """
+        urls = {}
+        errors = {}
+        for s3_key in dict.fromkeys(s3_keys):
+            try:
+                urls[s3_key] = self.get_presigned_url_cached(s3_key, expiration)
+            except Exception as e:
+                errors[s3_key] = str(e)
+        return urls, errors
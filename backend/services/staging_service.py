@@ -0,0 +1,248 @@
+from services.s3_services import S3Service
+from botocore.exceptions import ClientError
+from config import settings
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote, unquote
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Prefijo de los originales en espera de validación (backend s3)
+STAGING_PREFIX = "staging/"
+
+# Carpeta por defecto del backend local
+STAGING_DIR = Path(__file__).parent.parent.parent / "data" / "staging"
+
+STAGING_BACKENDS = ("local", "s3")
+
+# Los tokens son el sha256 del contenido
+_TOKEN_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Último barrido de expirados en este proceso
+_last_purge = 0.0
+_purge_lock = threading.Lock()
+
+class StagingService:
+    """
+    Área de espera de los archivos subidos a /extract
+
+    El original se guarda una sola vez, direccionado por contenido, y
+    /extract devuelve un token (su sha256). /validate recibe el token en
+    lugar de volver a subir el archivo y lo promueve a su key definitivo:
+    con el backend s3 mediante una copia dentro del bucket, con el backend
+    local subiéndolo desde el disco del servidor. Los archivos en espera
+    expiran después de STAGING_TTL_SECONDS.
+    """
+
+    def __init__(self):
+        self.s3_service = S3Service()
+        backend = settings.STAGING_BACKEND or ("s3" if self.s3_service.client else "local")
+        if backend not in STAGING_BACKENDS:
+            raise ValueError(f"Backend de staging inválido: {backend} (opciones: {', '.join(STAGING_BACKENDS)})")
+        if backend == "s3" and not self.s3_service.client:
+            raise ValueError("STAGING_BACKEND=s3 requiere S3 configurado")
+        self.backend = backend
+        self.directory = Path(settings.STAGING_DIR) if settings.STAGING_DIR else STAGING_DIR
+        self.ttl = settings.STAGING_TTL_SECONDS
+
+    @staticmethod
+    def build_token(file_content: bytes) -> str:
+        """Token de un archivo: sha256 de su contenido"""
+        return hashlib.sha256(file_content).hexdigest()
+
+    @staticmethod
+    def is_valid_token(token: str) -> bool:
+        return bool(token) and _TOKEN_PATTERN.match(token) is not None
+
+    def _s3_key(self, token: str) -> str:
+        return f"{STAGING_PREFIX}{token}"
+
+    def _local_paths(self, token: str) -> tuple:
+        folder = self.directory / token[:2]
+        return folder / token, folder / f"{token}.json"
+
+    def _is_expired(self, staged_at: float) -> bool:
+        return time.time() - staged_at > self.ttl
+
+    def stage(self, file_content: bytes, file_name: str, content_type: str) -> str:
+        """
+        Guardar un archivo en espera y retornar su token
+
+        Si el mismo contenido ya está en espera solo se renueva su vigencia.
+        """
+        if not file_content:
+            raise ValueError("Contenido del archivo está vacío")
+
+        token = self.build_token(file_content)
+        info = {
+            "fileName": file_name,
+            "mimeType": content_type,
+            "fileSize": len(file_content),
+            "stagedAt": time.time()
+        }
+
+        if self.backend == "s3":
+            existing = self.get(token)
+            # Reutilizar mientras le quede al menos la mitad de la vigencia
+            if existing and time.time() - existing["stagedAt"] < self.ttl / 2:
+                return token
+            self.s3_service.client.put_object(
+                Bucket=self.s3_service.bucket_name,
+                Key=self._s3_key(token),
+                Body=file_content,
+                ContentType=content_type,
+                Metadata={'original-filename': quote(file_name)}
+            )
+        else:
+            data_path, info_path = self._local_paths(token)
+            data_path.parent.mkdir(parents=True, exist_ok=True)
+            if not data_path.exists():
+                # Escritura atómica: nunca queda un archivo a medias con el nombre final
+                tmp_path = data_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+                tmp_path.write_bytes(file_content)
+                os.replace(tmp_path, data_path)
+            info_path.write_text(json.dumps(info))
+
+        logger.info(f"📦 Archivo en espera ({self.backend}): {token[:12]} ({len(file_content)} bytes)")
+        return token
+
+    def get(self, token: str) -> Optional[dict]:
+        """Información del archivo en espera (None si no existe o ya expiró)"""
+        if not self.is_valid_token(token):
+            return None
+
+        if self.backend == "s3":
+            try:
+                head = self.s3_service.client.head_object(
+                    Bucket=self.s3_service.bucket_name,
+                    Key=self._s3_key(token)
+                )
+            except ClientError as e:
+                error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+                if error_code in ('404', 'NoSuchKey', 'NotFound'):
+                    return None
+                raise
+            info = {
+                "fileName": unquote(head.get('Metadata', {}).get('original-filename', token)),
+                "mimeType": head.get('ContentType'),
+                "fileSize": head.get('ContentLength'),
+                "stagedAt": head['LastModified'].timestamp()
+            }
+        else:
+            data_path, info_path = self._local_paths(token)
+            try:
+                info = json.loads(info_path.read_text())
+            except (FileNotFoundError, ValueError):
+                return None
+            if not data_path.exists():
+                return None
+
+        if self._is_expired(info["stagedAt"]):
+            return None
+        return {"token": token, **info}
+
+    def read(self, token: str) -> bytes:
+        """Contenido del archivo en espera"""
+        if self.backend == "s3":
+            response = self.s3_service.client.get_object(
+                Bucket=self.s3_service.bucket_name,
+                Key=self._s3_key(token)
+            )
+            return response['Body'].read()
+        return self._local_paths(token)[0].read_bytes()
+
+    def promote(self, token: str, file_name: str, content_type: str) -> dict:
+        """
+        Mover el archivo en espera a su key definitivo en S3
+
+        El key definitivo también se deriva del sha256, así que coincide con
+        el que tendría el archivo subido directamente.
+
+        Returns:
+            dict con s3Key, s3Url y uploaded (False si el objeto ya existía)
+        """
+        s3_key = self.s3_service.build_key_from_digest(token)
+        if self.backend == "s3":
+            return self.s3_service.copy_file(self._s3_key(token), s3_key)
+        return self.s3_service.upload_file(self.read(token), file_name, content_type, s3_key)
+
+    def purge_expired(self, min_interval: Optional[float] = None) -> int:
+        """
+        Eliminar los archivos en espera ya expirados
+
+        Args:
+            min_interval: Omitir el barrido si ya se hizo uno hace menos de
+                estos segundos en este proceso
+
+        Returns:
+            Número de archivos eliminados
+        """
+        global _last_purge
+        with _purge_lock:
+            now = time.time()
+            if min_interval and now - _last_purge < min_interval:
+                return 0
+            _last_purge = now
+
+        removed = 0
+        if self.backend == "s3":
+            cutoff = datetime.now(timezone.utc).timestamp() - self.ttl
+            expired = [
+                obj['Key']
+                for page in self.s3_service.iter_object_pages(STAGING_PREFIX)
+                for obj in page
+                if obj['LastModified'].timestamp() < cutoff
+            ]
+            if expired:
+                deleted, _ = self.s3_service.delete_files(expired)
+                removed = len(deleted)
+        elif self.directory.exists():
+            for info_path in self.directory.glob("*/*.json"):
+                try:
+                    staged_at = json.loads(info_path.read_text())["stagedAt"]
+                except (FileNotFoundError, ValueError, KeyError):
+                    staged_at = info_path.stat().st_mtime if info_path.exists() else 0
+                if not self._is_expired(staged_at):
+                    continue
+                info_path.with_suffix("").unlink(missing_ok=True)
+                info_path.unlink(missing_ok=True)
+                removed += 1
+            # Temporales de escrituras interrumpidas
+            for tmp_path in self.directory.glob("*/*.tmp"):
+                if self._is_expired(tmp_path.stat().st_mtime):
+                    tmp_path.unlink(missing_ok=True)
+
+        if removed:
+            logger.info(f"🧹 Archivos en espera expirados eliminados: {removed}")
+        return removed
+
+    async def stage_async(self, file_content: bytes, file_name: str, content_type: str) -> str:
+        """Guardar un archivo en espera en un hilo, sin bloquear el event loop"""
+        return await asyncio.to_thread(self.stage, file_content, file_name, content_type)
+
+    async def get_async(self, token: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.get, token)
+
+    async def read_async(self, token: str) -> bytes:
+        return await asyncio.to_thread(self.read, token)
+
+    async def promote_async(self, token: str, file_name: str, content_type: str) -> dict:
+        """Promover el archivo en espera en un hilo, sin bloquear el event loop"""
+        return await asyncio.to_thread(self.promote, token, file_name, content_type)
+
+    async def purge_expired_async(self, min_interval: Optional[float] = None) -> int:
+        """Barrido de expirados en segundo plano (nunca falla la petición que lo dispara)"""
+        try:
+            return await asyncio.to_thread(self.purge_expired, min_interval)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron eliminar archivos en espera expirados: {e}")
+            return 0
@@ -0,0 +1,151 @@
+from database.mongodb import get_collection
+from services.invoice_service import InvoiceService
+from services.object_ref_service import ObjectRefService
+from services.s3_services import S3Service, CONTENT_KEY_PREFIX, DELETE_BATCH_SIZE
+from services.thumbnail_service import THUMBNAIL_PREFIX, ThumbnailService
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Set
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Prefijos administrados por el backend (los únicos que el reconciliador revisa)
+MANAGED_PREFIXES = [CONTENT_KEY_PREFIX, THUMBNAIL_PREFIX, "invoices/"]
+
+class StorageCleanupService:
+    def __init__(self):
+        self.s3_service = S3Service()
+        self.object_refs = ObjectRefService()
+        self.invoices = get_collection("invoices")
+    
+    async def release_invoice_objects(self, s3_key: Optional[str]) -> None:
+        """
+        Liberar la referencia al original de una factura eliminada (tarea en segundo plano)
+        
+        No se borra nada aquí: si era la última referencia el objeto queda
+        marcado con releasedAt y la reconciliación lo elimina (con su
+        miniatura) pasado el periodo de gracia. Borrarlo de inmediato compite
+        con un /validate del mismo archivo, que lo ve en S3, omite la subida
+        y quedaría apuntando a un key eliminado.
+        """
+        if not s3_key:
+            return
+        
+        try:
+            remaining = await self.object_refs.release(s3_key)
+            if remaining > 0:
+                logger.info(f"ℹ️ Objeto de S3 aún referenciado ({remaining}): {s3_key}")
+            else:
+                logger.info(f"🪦 Objeto de S3 sin referencias, se elimina en la reconciliación: {s3_key}")
+        except Exception as e:
+            # El reconciliador se encarga de lo que quede pendiente
+            logger.error(f"❌ Error al liberar objetos de S3 ({s3_key}): {e}")
+    
+    async def get_referenced_keys(self) -> Set[str]:
+        """Construir el conjunto de keys de S3 referenciados desde las facturas"""
+        referenced = set()
+        cursor = self.invoices.find(
+            {"metadata.s3Key": {"$exists": True, "$ne": None}},
+            {"metadata.s3Key": 1, "metadata.thumbnailKey": 1}
+        ).batch_size(5000)
+        async for invoice in cursor:
+            metadata = invoice.get("metadata", {})
+            referenced.add(metadata["s3Key"])
+            # La miniatura se deriva del original aunque aún no esté registrada
+            referenced.add(metadata.get("thumbnailKey") or ThumbnailService.build_key(metadata["s3Key"]))
+        return referenced
+    
+    async def repair_pending_uploads(self, grace_hours: float, dry_run: bool = False) -> dict:
+        """
+        Finalizar las facturas que quedaron con uploadStatus=pending más allá del periodo de gracia
+        
+        /validate inserta la factura como pending mientras sube el archivo;
+        si el proceso se cae entre ambas cosas nunca se finaliza. Si el
+        objeto está en S3 la factura pasa a completed; si no, a failed sin
+        s3Key (igual que una subida fallida).
+        
+        Returns:
+            dict con conteos de facturas completadas y fallidas
+        """
+        invoice_service = InvoiceService()
+        cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+        summary = {"pendingCompleted": 0, "pendingFailed": 0}
+        cursor = self.invoices.find(
+            {"metadata.uploadStatus": "pending", "createdAt": {"$lt": cutoff}},
+            {"metadata.s3Key": 1}
+        )
+        async for invoice in cursor:
+            s3_key = invoice.get("metadata", {}).get("s3Key")
+            uploaded = bool(s3_key) and await asyncio.to_thread(self.s3_service.object_exists, s3_key)
+            summary["pendingCompleted" if uploaded else "pendingFailed"] += 1
+            if not dry_run:
+                await invoice_service.finalize_upload(str(invoice["_id"]), uploaded=uploaded)
+        if any(summary.values()):
+            logger.info(f"🩹 Facturas con subida pendiente finalizadas: {summary}")
+        return summary
+    
+    async def reconcile(self, dry_run: bool = False, grace_hours: float = 24, prefixes: Optional[List[str]] = None) -> dict:
+        """
+        Eliminar de S3 los objetos que ninguna factura referencia
+        
+        Primero finaliza las facturas con subida pendiente más antiguas que
+        el periodo de gracia (repair_pending_uploads). Luego recorre el
+        listado del bucket por páginas y borra los huérfanos con
+        delete_objects en lotes de hasta 1000 keys. Los objetos más recientes
+        que el periodo de gracia se conservan (subidas en curso), igual que
+        los que tienen referencias registradas en s3_objects o se liberaron
+        (releasedAt) dentro del periodo de gracia.
+        
+        Returns:
+            dict con conteos de objetos revisados, huérfanos y eliminados, y de facturas pendientes finalizadas
+        """
+        if not self.s3_service.client:
+            raise ValueError("S3 no está configurado")
+        
+        repaired = await self.repair_pending_uploads(grace_hours, dry_run)
+        referenced = await self.get_referenced_keys()
+        logger.info(f"📋 Keys referenciados en MongoDB: {len(referenced)}")
+        
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=grace_hours)
+        # Referencias tomadas antes de insertar la factura y objetos liberados hace poco
+        for key in await self.object_refs.get_protected_keys(cutoff.replace(tzinfo=None)):
+            referenced.update((key, ThumbnailService.build_key(key)))
+        summary = {"scanned": 0, "orphaned": 0, "deleted": 0, "errors": 0, "bytes": 0, **repaired}
+        batch = []
+        
+        async def flush():
+            if not batch:
+                return
+            if not dry_run:
+                # Volver a revisar justo antes de borrar: un objeto puede haberse referenciado durante el recorrido
+                reused = set(await self.object_refs.collection.distinct("_id", {"_id": {"$in": batch}, "refCount": {"$gt": 0}}))
+                keys = [key for key in batch if key not in reused]
+                deleted, errors = await self.s3_service.delete_files_async(keys)
+                summary["deleted"] += len(deleted)
+                summary["errors"] += len(errors)
+                await self.object_refs.collection.delete_many({"_id": {"$in": deleted}, "refCount": {"$lte": 0}})
+            batch.clear()
+        
+        for prefix in prefixes or MANAGED_PREFIXES:
+            pages = self.s3_service.iter_object_pages(prefix)
+            while True:
+                # Cada página del listado se pide en un hilo para no bloquear el event loop
+                page = await asyncio.to_thread(next, pages, None)
+                if page is None:
+                    break
+                
+                for obj in page:
+                    summary["scanned"] += 1
+                    if obj['Key'] in referenced or obj['LastModified'] > cutoff:
+                        continue
+                    
+                    summary["orphaned"] += 1
+                    summary["bytes"] += obj.get('Size', 0)
+                    batch.append(obj['Key'])
+                    if len(batch) >= DELETE_BATCH_SIZE:
+                        await flush()
+        
+        await flush()
+        logger.info(f"✅ Reconciliación de S3 completada: {summary}")
+        return summary
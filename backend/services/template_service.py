@@ -0,0 +1,379 @@
+from database.mongodb import get_collection
+from services.document_prepass import RFC_PATTERN, extract_text_layer
+from services.openai_service import find_missing_fields
+from models.invoice import InvoiceBase
+from config import settings
+from pydantic import ValidationError
+from pymongo import ReturnDocument
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import math
+import re
+
+logger = logging.getLogger(__name__)
+
+# Valor de Metadata.model para las facturas extraídas con una plantilla
+TEMPLATE_MODEL = "plantilla"
+
+# Campos que cambian en cada factura y se leen junto a su etiqueta (ancla) en el texto
+ANCHORED_FIELDS = {
+    "numeroFactura": "text",
+    "fecha": "date",
+    "fechaVencimiento": "date",
+    "subtotal": "amount",
+    "iva": "amount",
+    "total": "amount",
+}
+
+# Campos que suelen repetirse en todas las facturas de un proveedor
+CONSTANT_FIELDS = ("proveedor", "cliente", "moneda", "formaPago", "metodoPago", "usoCFDI")
+
+ITEM_AMOUNTS = ("cantidad", "precioUnitario", "total")
+
+_NUMBER_PATTERN = re.compile(r"(?<![\w.,/-])\$?\s?(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)(?![\w/-]|\.\d)")
+_DATE_PATTERNS = (
+    (re.compile(r"(?<!\d)(\d{4})-(\d{2})-(\d{2})(?!\d)"), (1, 2, 3)),
+    (re.compile(r"(?<!\d)(\d{2})[/-](\d{2})[/-](\d{4})(?!\d)"), (3, 2, 1)),
+)
+
+def _parse_number(token: str) -> float:
+    return float(token.replace(",", ""))
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def _shape(value: str) -> str:
+    """Forma de un valor de texto ("A-1024" -> "A-9") para no confundirlo con otro junto a la misma etiqueta"""
+    return re.sub(r"\d+", "9", re.sub(r"[^\W\d_]+", "A", value.upper()))
+
+def _label_before(line: str, start: int) -> str:
+    """Etiqueta a la izquierda de un valor en la misma línea (última columna antes del valor)"""
+    segment = line[:start].rstrip()
+    if not segment:
+        return ""
+    label = _normalize(re.split(r"\s{2,}", segment)[-1]).rstrip(" :$#")[-40:]
+    return label if re.search(r"[a-záéíóúñ]", label) else ""
+
+def _dates_in(line: str) -> List[Tuple[str, int, int]]:
+    """Fechas de una línea como (YYYY-MM-DD, inicio, fin)"""
+    found = []
+    for pattern, (year, month, day) in _DATE_PATTERNS:
+        for match in pattern.finditer(line):
+            found.append((f"{match.group(year)}-{match.group(month)}-{match.group(day)}", match.start(), match.end()))
+    return sorted(found, key=lambda date: date[1])
+
+def _numbers_in(line: str) -> List[Tuple[float, int, int]]:
+    return [(_parse_number(match.group(1)), match.start(), match.end()) for match in _NUMBER_PATTERN.finditer(line)]
+
+def _find_anchors(lines: List[str], value: Any, kind: str) -> List[str]:
+    """Etiquetas junto a las que aparece un valor validado"""
+    anchors = []
+    for line in lines:
+        if kind == "amount":
+            spans = [(start, end) for number, start, end in _numbers_in(line) if abs(number - value) < 0.005]
+        elif kind == "date":
+            spans = [(start, end) for date, start, end in _dates_in(line) if date == value]
+        else:
+            spans = [(match.start(), match.end()) for match in re.finditer(re.escape(str(value)), line, re.IGNORECASE)]
+        for start, _ in spans:
+            label = _label_before(line, start)
+            if label and label not in anchors:
+                anchors.append(label)
+    return anchors
+
+def _value_after(line: str, anchor: str, kind: str, shape: Optional[str] = None) -> Optional[Any]:
+    """Valor que sigue a un ancla en una línea (None si la línea no lo tiene o no tiene la forma esperada)"""
+    match = re.search(rf"(?<![\w]){re.escape(anchor)}(?![\w])", line.lower())
+    if match is None:
+        return None
+    rest = line[match.end():]
+    if kind == "amount":
+        numbers = _numbers_in(rest)
+        return numbers[0][0] if numbers and not rest[:numbers[0][1]].strip(" :$\t") else None
+    if kind == "date":
+        dates = _dates_in(rest)
+        return dates[0][0] if dates and not rest[:dates[0][1]].strip(" :\t") else None
+    value = re.split(r"\s{2,}", rest.lstrip(" :#\t"))[0].strip()
+    if not 0 < len(value) <= 100 or (shape and _shape(value) != shape):
+        return None
+    return value
+
+def _learn_items(lines: List[str], items: List[dict]) -> Optional[dict]:
+    """
+    Posición de la tabla de conceptos: encabezado y columnas de los montos
+
+    Cada columna se guarda como índice desde el final entre los números de
+    la línea (las claves de producto o unidad a la izquierda varían).
+    """
+    columns: Dict[str, Counter] = {field: Counter() for field in ITEM_AMOUNTS}
+    # Columnas a la izquierda de la descripción (clave de producto, unidad...)
+    leading = Counter()
+    first_line = None
+    for item in items:
+        description = _normalize(item.get("descripcion") or "")[:20]
+        if not description:
+            continue
+        for index, line in enumerate(lines):
+            if description not in _normalize(line):
+                continue
+            leading[len(line[:line.lower().find(description[:10])].split())] += 1
+            numbers = [number for number, _, _ in _numbers_in(line)]
+            for field in ITEM_AMOUNTS:
+                value = item.get(field)
+                positions = [position - len(numbers) for position, number in enumerate(numbers)
+                             if value is not None and abs(number - value) < 0.005]
+                if positions:
+                    columns[field][positions[-1]] += 1
+            first_line = index if first_line is None else min(first_line, index)
+            break
+
+    if first_line is None or any(not counter for counter in columns.values()):
+        return None
+    header = next((_normalize(line) for line in reversed(lines[:first_line]) if line.strip()), "")
+    if not header:
+        return None
+    return {
+        "header": header,
+        "columns": {field: counter.most_common(1)[0][0] for field, counter in columns.items()},
+        "leading": leading.most_common(1)[0][0] if leading else 0
+    }
+
+def _read_items(lines: List[str], layout: dict) -> Optional[List[dict]]:
+    """Conceptos bajo el encabezado aprendido; None si no se encuentra el encabezado"""
+    header_index = next((index for index, line in enumerate(lines) if _normalize(line) == layout["header"]), None)
+    if header_index is None:
+        return None
+    columns = layout["columns"]
+    needed = max(-position for position in columns.values())
+    items = []
+    for line in lines[header_index + 1:]:
+        if not line.strip():
+            continue
+        numbers = _numbers_in(line)
+        if len(numbers) < needed:
+            break
+        values = {field: numbers[position][0] for field, position in columns.items()}
+        # Una fila de conceptos cumple cantidad x precio = importe
+        expected = values["cantidad"] * values["precioUnitario"]
+        if abs(expected - values["total"]) > max(0.02, values["total"] * 0.01):
+            break
+        description = line
+        for _, start, end in sorted({numbers[position] for position in columns.values()}, key=lambda number: -number[1]):
+            description = description[:start] + " " + description[end:]
+        description = " ".join(description.split()[layout.get("leading", 0):])
+        items.append({"descripcion": description or None, **values})
+    return items
+
+def learn_sample(text: str, invoice: Dict[str, Any]) -> dict:
+    """Anclas, valores constantes y tabla de conceptos de una factura validada"""
+    lines = text.splitlines()
+    anchors = {}
+    shapes = {}
+    for field, kind in ANCHORED_FIELDS.items():
+        value = invoice.get(field)
+        if value in (None, ""):
+            continue
+        found = _find_anchors(lines, value, kind)
+        if found:
+            anchors[field] = found
+            if kind == "text":
+                shapes[field] = _shape(str(value))
+    return {
+        "anchors": anchors,
+        "shapes": shapes,
+        "values": {field: invoice.get(field) for field in CONSTANT_FIELDS if invoice.get(field) not in (None, "", {})},
+        "items": _learn_items(lines, invoice.get("items") or []),
+    }
+
+def _majority(values: List[Any], total: int) -> Optional[Any]:
+    """Valor presente en al menos 2/3 de las muestras (None si no hay)"""
+    if not values:
+        return None
+    counts = Counter(json.dumps(value, sort_keys=True, ensure_ascii=False) for value in values)
+    value, support = counts.most_common(1)[0]
+    return json.loads(value) if support >= math.ceil(total * 2 / 3) else None
+
+def compile_template(samples: List[dict], min_samples: int) -> dict:
+    """Plantilla a partir de las muestras aprendidas: lo que coincide en la mayoría de ellas"""
+    total = len(samples)
+    fields = {}
+    shapes = {}
+    for field, kind in ANCHORED_FIELDS.items():
+        anchor = _majority([anchor for sample in samples for anchor in sample["anchors"].get(field, [])], total)
+        if anchor is None:
+            continue
+        fields[field] = anchor
+        if kind == "text":
+            # Sin forma mayoritaria (p. ej. folios de largo variable) se acepta cualquier valor
+            shapes[field] = _majority([sample["shapes"][field] for sample in samples if field in sample.get("shapes", {})], total)
+    constants = {}
+    for field in CONSTANT_FIELDS:
+        value = _majority([sample["values"][field] for sample in samples if field in sample["values"]], total)
+        if value is not None:
+            constants[field] = value
+    items = _majority([sample["items"] for sample in samples if sample.get("items")], total)
+
+    ready = (
+        total >= min_samples
+        and all(field in fields for field in ("numeroFactura", "fecha", "total"))
+        and bool((constants.get("proveedor") or {}).get("nombre"))
+    )
+    return {"fields": fields, "shapes": shapes, "constants": constants, "items": items, "ready": ready}
+
+def apply_template(template: dict, text: str) -> Tuple[Dict[str, Any], float]:
+    """
+    Extraer una factura con una plantilla
+
+    Returns:
+        (datos, confianza): la confianza es la fracción de campos de la
+        plantilla encontrados, 0 si el resultado no pasa las validaciones de
+        InvoiceBase y la mitad si los conceptos no suman el subtotal
+    """
+    lines = text.splitlines()
+    data: Dict[str, Any] = {key: value for key, value in template["constants"].items()}
+    found = 0
+    for field, anchor in template["fields"].items():
+        kind = ANCHORED_FIELDS[field]
+        shape = (template.get("shapes") or {}).get(field)
+        for line in lines:
+            value = _value_after(line, anchor, kind, shape)
+            if value is not None:
+                data[field] = value
+                found += 1
+                break
+
+    expected = len(template["fields"])
+    items_ok = True
+    if template.get("items"):
+        expected += 1
+        items = _read_items(lines, template["items"])
+        if items:
+            data["items"] = items
+            found += 1
+            if data.get("subtotal") is not None:
+                items_ok = abs(sum(item["total"] for item in items) - data["subtotal"]) <= 0.05
+    data.setdefault("items", [])
+
+    confidence = found / expected if expected else 0.0
+    if find_missing_fields(data):
+        return data, 0.0
+    try:
+        InvoiceBase.model_validate(data)
+    except ValidationError:
+        return data, 0.0
+    if not items_ok:
+        confidence /= 2
+    return data, round(confidence, 3)
+
+class TemplateService:
+    """
+    Plantillas por proveedor (proveedor.rfc) para extraer sin OpenAI
+
+    Cada factura validada de un PDF con capa de texto deja una muestra: las
+    etiquetas junto a las que aparecen sus valores (anclas), los datos que
+    se repiten (proveedor, cliente...) y la posición de la tabla de
+    conceptos. Con TEMPLATE_MIN_SAMPLES muestras lo que coincide en la
+    mayoría forma la plantilla. Las facturas siguientes del mismo RFC se
+    leen de la capa de texto en milisegundos; si la confianza no alcanza
+    TEMPLATE_MIN_CONFIDENCE se usa OpenAI. Las plantillas viven en la
+    colección supplier_templates junto con sus métricas de uso.
+    """
+
+    def __init__(self):
+        self.collection = get_collection("supplier_templates")
+
+    async def read_text(self, file_content: bytes) -> str:
+        """Capa de texto de la primera página (pdftotext corre como subproceso, basta un hilo)"""
+        return await asyncio.to_thread(extract_text_layer, file_content)
+
+    async def extract(self, text: str, record: bool = True) -> Optional[Tuple[Dict[str, Any], float, str]]:
+        """
+        Extraer un PDF con la plantilla de su proveedor
+
+        Args:
+            text: capa de texto (read_text) u OCR de la primera página
+            record: contar el intento en stats (no en las ejecuciones en sombra)
+
+        Returns:
+            (datos, confianza, rfc) si una plantilla lo resolvió; None si no
+            hay texto, plantilla lista o confianza suficiente
+        """
+        rfcs = list(dict.fromkeys(RFC_PATTERN.findall(text)))
+        if not rfcs:
+            return None
+
+        templates = {doc["_id"]: doc async for doc in self.collection.find({"_id": {"$in": rfcs}, "ready": True})}
+        # El emisor suele aparecer antes que el receptor en la representación impresa
+        for rfc in rfcs:
+            template = templates.get(rfc)
+            if template is None:
+                continue
+            data, confidence = apply_template(template, text)
+            if confidence >= settings.TEMPLATE_MIN_CONFIDENCE:
+                if record:
+                    await self.collection.update_one({"_id": rfc}, {"$inc": {"stats.hits": 1}})
+                logger.info(f"📐 Extraída con la plantilla de {rfc} (confianza {confidence:.2f})")
+                return data, confidence, rfc
+            if record:
+                await self.collection.update_one({"_id": rfc}, {"$inc": {"stats.fallbacks": 1}})
+            logger.info(f"📐 Plantilla de {rfc} con confianza {confidence:.2f}: se usa OpenAI")
+        return None
+
+    async def learn(self, invoice: Dict[str, Any], text: str, invoice_id: str) -> Optional[dict]:
+        """
+        Agregar una factura validada a la plantilla de su proveedor
+
+        Returns:
+            Plantilla recompilada, o None si la factura no tiene RFC de proveedor o capa de texto
+        """
+        rfc = ((invoice.get("proveedor") or {}).get("rfc") or "").strip().upper()
+        if not rfc or not text.strip():
+            return None
+
+        sample = {**learn_sample(text, invoice), "invoiceId": invoice_id, "learnedAt": datetime.utcnow()}
+        doc = await self.collection.find_one_and_update(
+            {"_id": rfc},
+            {
+                "$push": {"samples": {"$each": [sample], "$slice": -settings.TEMPLATE_MAX_SAMPLES}},
+                "$setOnInsert": {"createdAt": datetime.utcnow()}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        template = compile_template(doc["samples"], settings.TEMPLATE_MIN_SAMPLES)
+        await self.collection.update_one(
+            {"_id": rfc},
+            {"$set": {**template, "updatedAt": datetime.utcnow()}}
+        )
+        if template["ready"] and not doc.get("ready"):
+            logger.info(f"📐 Plantilla lista para {rfc} ({len(doc['samples'])} muestras): {', '.join(template['fields'])}")
+        return template
+
+    async def record_review(self, rfc: str, was_modified: bool) -> None:
+        """Registrar la revisión de una factura extraída con plantilla (confirmada o corregida)"""
+        counter = "stats.corrections" if was_modified else "stats.confirmed"
+        await self.collection.update_one({"_id": rfc.strip().upper()}, {"$inc": {counter: 1}})
+
+    async def get_stats(self) -> List[dict]:
+        """Métricas por plantilla: tasa de uso (hits vs. fallbacks) y de correcciones"""
+        results = []
+        async for doc in self.collection.find({}, {"samples": 0}).sort("stats.hits", -1):
+            stats = {"hits": 0, "fallbacks": 0, "confirmed": 0, "corrections": 0, **doc.get("stats", {})}
+            attempts = stats["hits"] + stats["fallbacks"]
+            reviewed = stats["confirmed"] + stats["corrections"]
+            results.append({
+                "rfc": doc["_id"],
+                "proveedor": ((doc.get("constants") or {}).get("proveedor") or {}).get("nombre"),
+                "ready": doc.get("ready", False),
+                "fields": list((doc.get("fields") or {}).keys()),
+                "items": bool(doc.get("items")),
+                **stats,
+                "hitRate": round(stats["hits"] / attempts, 3) if attempts else None,
+                "correctionRate": round(stats["corrections"] / reviewed, 3) if reviewed else None,
+                "updatedAt": doc.get("updatedAt"),
+            })
+        return results
@@ -0,0 +1,114 @@
+from database.mongodb import get_collection
+from services.s3_services import S3Service
+from services.pdf_utils import render_first_page
+from services.raster_pool import run_in_raster_pool
+from config import settings
+from bson import ObjectId
+from typing import Optional
+import asyncio
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Las miniaturas se guardan en un prefijo paralelo a los originales
+THUMBNAIL_PREFIX = "thumbnails/"
+
+THUMBNAIL_MIME_TYPES = {'application/pdf', 'image/png', 'image/jpeg', 'image/jpg', 'image/webp'}
+
+def render_thumbnail(file_content: bytes, mime_type: str, max_size: int, quality: int) -> bytes:
+    """
+    Generar miniatura WebP de una factura (se ejecuta en el pool de procesos)
+    
+    Args:
+        file_content: Contenido del archivo original
+        mime_type: Tipo MIME del archivo original
+        max_size: Lado mayor de la miniatura en píxeles
+        quality: Calidad WebP (0-100)
+    
+    Returns:
+        Miniatura en formato WebP
+    """
+    from PIL import Image, ImageOps
+    
+    if mime_type == 'application/pdf':
+        # ~100 DPI basta para una miniatura de una página carta/A4
+        image = render_first_page(file_content, dpi=100)
+        if image is None:
+            raise ValueError("El PDF no tiene páginas")
+    else:
+        image = Image.open(io.BytesIO(file_content))
+        # Decodificar JPEGs directamente a menor escala
+        image.draft('RGB', (max_size, max_size))
+        image = ImageOps.exif_transpose(image)
+    
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    
+    output = io.BytesIO()
+    image.save(output, format='WEBP', quality=quality, method=4)
+    return output.getvalue()
+
+class ThumbnailService:
+    def __init__(self):
+        self.s3_service = S3Service()
+        self.collection = get_collection("invoices")
+    
+    @staticmethod
+    def build_key(s3_key: str) -> str:
+        """Key de la miniatura correspondiente a un original"""
+        return f"{THUMBNAIL_PREFIX}{s3_key}.webp"
+    
+    async def create_thumbnail(self, file_content: bytes, mime_type: str, s3_key: str) -> str:
+        """
+        Generar y subir la miniatura de un original (si no existe ya)
+        
+        Returns:
+            Key de la miniatura en S3
+        """
+        if not self.s3_service.client:
+            raise ValueError("S3 no está configurado")
+        
+        if mime_type not in THUMBNAIL_MIME_TYPES:
+            raise ValueError(f"Tipo de archivo sin miniatura: {mime_type}")
+        
+        thumbnail_key = self.build_key(s3_key)
+        
+        # Los originales se direccionan por contenido: si la miniatura existe es la misma
+        if await asyncio.to_thread(self.s3_service.object_exists, thumbnail_key):
+            return thumbnail_key
+        
+        thumbnail = await run_in_raster_pool(
+            render_thumbnail,
+            file_content,
+            mime_type,
+            settings.THUMBNAIL_MAX_SIZE,
+            settings.THUMBNAIL_QUALITY
+        )
+        
+        await asyncio.to_thread(
+            self.s3_service.upload_file,
+            thumbnail,
+            "thumbnail.webp",
+            "image/webp",
+            thumbnail_key,
+            False
+        )
+        logger.info(f"🖼️ Miniatura generada: {thumbnail_key} ({len(thumbnail)} bytes)")
+        return thumbnail_key
+    
+    async def generate_for_invoice(self, invoice_id: str, file_content: bytes, mime_type: str, s3_key: str) -> Optional[str]:
+        """Generar la miniatura de una factura y registrar su key en metadata.thumbnailKey"""
+        try:
+            thumbnail_key = await self.create_thumbnail(file_content, mime_type, s3_key)
+            await self.collection.update_one(
+                {"_id": ObjectId(invoice_id)},
+                {"$set": {"metadata.thumbnailKey": thumbnail_key}}
+            )
+            return thumbnail_key
+        except Exception as e:
+            # La miniatura es opcional: nunca debe hacer fallar la validación
+            logger.warning(f"⚠️ No se pudo generar miniatura para {invoice_id}: {e}")
+            return None
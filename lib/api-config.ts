@@ -17,6 +17,7 @@ export const API_CONFIG = {
     LIST_INVOICES: '/api/invoices',
     GET_INVOICE: (id: string) => `/api/invoices/${id}`,
     DELETE_INVOICE: (id: string) => `/api/invoices/${id}`,
+    INVOICE_IMAGES_BATCH: '/api/invoices/image/batch',
   }
 };
 
@@ -24,3 +25,10 @@ export const API_CONFIG = {
 export function getApiUrl(endpoint: string): string {
   return `${API_CONFIG.BACKEND_URL}${endpoint}`;
 }
+
+// Cabecera Authorization con el token de sesión emitido en el login
+export function getAuthHeaders(): Record<string, string> {
+  if (typeof window === 'undefined') return {};
+  const token = localStorage.getItem('sessionToken');
+  return token ? { Authorization: `Bearer ${token}` } : {};
+}